@@ -1,15 +1,48 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 import logging
-from django.utils import timezone
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from accounts.api.message_persister import PersisterFull, message_persister
+from accounts.api.user_profiles import get_user_profile
 from accounts.models import ChatRoom, Message, DirectMessage
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+DEFAULT_COALESCE_SETTINGS = {
+    # Window used when a client asks for ?coalesce=1 without ?window_ms=
+    'DEFAULT_WINDOW_MS': 30,
+    'MIN_WINDOW_MS': 10,
+    'MAX_WINDOW_MS': 200,
+}
+
+
+def get_coalesce_settings():
+    return {**DEFAULT_COALESCE_SETTINGS, **getattr(settings, 'CHAT_COALESCE', {})}
+
+
+def coalesce_window(query_string):
+    """
+    Coalescing window (seconds) requested in the connect query string, None when off.
+
+    ?coalesce=1[&window_ms=N]: events arriving within N ms are sent as one
+    JSON array frame instead of one frame per event.
+    """
+    params = parse_qs(query_string.decode() if isinstance(query_string, bytes) else query_string)
+    if params.get('coalesce', [''])[0].lower() not in ('1', 'true'):
+        return None
+    config = get_coalesce_settings()
+    try:
+        window_ms = int(params['window_ms'][0])
+    except (KeyError, ValueError):
+        window_ms = config['DEFAULT_WINDOW_MS']
+    return min(max(window_ms, config['MIN_WINDOW_MS']), config['MAX_WINDOW_MS']) / 1000
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -21,6 +54,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name = f"dm_{min(sender_id, receiver_id)}_{max(sender_id, receiver_id)}"
         else:
             self.room_group_name = f"{self.chat_type}_{self.room_id}"
+        # Rooms / receivers already known to exist, checked once per connection
+        self.known_targets = set()
+        self.coalesce_window = coalesce_window(self.scope.get('query_string', b''))
+        self.outbox = []
+        self.outbox_flush = None
+        self.closed = False
 
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -30,61 +69,110 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        # Events still dispatched after this point are dropped, not sent to a closed socket
+        self.closed = True
+        self.outbox.clear()
+        if self.outbox_flush is not None:
+            self.outbox_flush.cancel()
+            self.outbox_flush = None
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        # Write this connection's messages now rather than at the next interval
+        message_persister.request_flush()
 
     async def receive(self, text_data):
         data = json.loads(text_data)
         message = data['message']
         sender_id = data['sender_id']
 
-        if self.chat_type == "room":
-            user = await self.save_room_message(sender_id, message)
-        else:  # chat_type == "dm"
-            receiver_id = data['receiver_id']
-            user = await self.save_direct_message(sender_id, receiver_id, message)
-
-        if user:
-            user_info = {
-                'id': user.id,
-                'email': user.email,
-                'name': user.name,
-                'avatar': user.avatar.url if user.avatar and hasattr(user.avatar, 'url') else None
-            }
+        try:
+            if self.chat_type == "room":
+                user_info = await self.save_room_message(sender_id, message)
+            else:  # chat_type == "dm"
+                receiver_id = data['receiver_id']
+                user_info = await self.save_direct_message(sender_id, receiver_id, message)
+        except PersisterFull as e:
+            # Database unreachable for a while: refuse rather than broadcast a message that may be lost
+            logger.error(f"Refusing chat message: {e}")
+            await self.send(text_data=json.dumps({'error': 'Message could not be saved, try again later'}))
+            return
+
+        if user_info:
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'chat_message',
-                    'message': message,
-                    'user': user_info
+                    # Serialized once here instead of by every member's consumer
+                    'frame': json.dumps({'message': message, 'user': user_info})
                 }
             )
 
     async def chat_message(self, event):
-        message = event['message']
-        user = event['user']
-        await self.send(text_data=json.dumps({'message': message, 'user': user}))
+        if self.closed:
+            return
+        # Events without a frame come from servers still running the previous release
+        frame = event.get('frame') or json.dumps({'message': event['message'], 'user': event['user']})
+        if not self.coalesce_window:
+            await self.send(text_data=frame)
+            return
 
-    @database_sync_to_async
-    def save_room_message(self, sender_id, content):
-        try:
-            user = User.objects.get(id=sender_id)
-            room = ChatRoom.objects.get(id=self.room_id)
-            Message.objects.create(room=room, sender=user, content=content, timestamp=timezone.now())
-            return user
-        except ObjectDoesNotExist as e:
-            logger.error(f"Error saving room message: {e}")
+        self.outbox.append(frame)
+        if self.outbox_flush is None:
+            self.outbox_flush = asyncio.create_task(self.flush_outbox())
+
+    async def flush_outbox(self):
+        # Everything received during the window goes out as one array frame
+        await asyncio.sleep(self.coalesce_window)
+        frames, self.outbox = self.outbox, []
+        self.outbox_flush = None
+        if frames and not self.closed:
+            await self.send(text_data=f"[{','.join(frames)}]")
+
+    async def save_room_message(self, sender_id, content):
+        user_info = await self.get_sender(sender_id)
+        if user_info is None or not await self.target_exists(ChatRoom, self.room_id):
+            logger.error(f"Error saving room message: unknown sender {sender_id} or room {self.room_id}")
             return None
+        # Written in the background; the broadcast does not wait for the commit
+        await message_persister.submit(Message(
+            room_id=self.room_id, sender_id=user_info['id'], content=content, timestamp=timezone.now()
+        ))
+        return user_info
+
+    async def save_direct_message(self, sender_id, receiver_id, content):
+        user_info = await self.get_sender(sender_id)
+        if user_info is None or not await self.target_exists(User, receiver_id):
+            logger.error(f"Error saving direct message: unknown sender {sender_id} or receiver {receiver_id}")
+            return None
+        # bulk_create skips save(), so the conversation key is set here
+        await message_persister.submit(DirectMessage(
+            sender_id=user_info['id'],
+            receiver_id=receiver_id,
+            conversation=DirectMessage.conversation_key(user_info['id'], receiver_id),
+            content=content,
+            timestamp=timezone.now()
+        ))
+        return user_info
+
+    async def get_sender(self, sender_id):
+        # Profile from the shared cache (invalidated when the user is saved):
+        # no user query or storage call per message
+        return await database_sync_to_async(get_user_profile)(sender_id)
+
+    async def target_exists(self, model, pk):
+        key = (model._meta.label, str(pk))
+        if key not in self.known_targets:
+            exists = await database_sync_to_async(self._exists)(model, pk)
+            if not exists:
+                return False
+            self.known_targets.add(key)
+        return True
 
-    @database_sync_to_async
-    def save_direct_message(self, sender_id, receiver_id, content):
+    @staticmethod
+    def _exists(model, pk):
         try:
-            sender = User.objects.get(id=sender_id)
-            receiver = User.objects.get(id=receiver_id)
-            DirectMessage.objects.create(sender=sender, receiver=receiver, content=content, timestamp=timezone.now())
-            return sender
-        except ObjectDoesNotExist as e:
-            logger.error(f"Error saving direct message: {e}")
-            return None
\ No newline at end of file
+            return model.objects.filter(pk=pk).exists()
+        except ValueError:
+            return False
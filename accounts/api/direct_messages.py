@@ -5,6 +5,7 @@ import logging
 
 from accounts.api.message_list import UserSerializer
 from accounts.models import DirectMessage
+from common.pagination import KeysetPagination
 
 logger = logging.getLogger(__name__)
 
@@ -18,17 +19,22 @@ class DirectMessageSerializer(serializers.ModelSerializer):
 
 
 class DirectMessages(ListAPIView):
+    """
+    One direct message thread (both directions), one keyset page at a time:
+    ?sender_id=1&receiver_id=2 for the latest messages, then the
+    previous/next links (see KeysetPagination).
+    """
     serializer_class = DirectMessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         sender_id = self.request.query_params.get('sender_id')
         receiver_id = self.request.query_params.get('receiver_id')
 
-        if not sender_id or not receiver_id:
+        try:
+            conversation = DirectMessage.conversation_key(sender_id, receiver_id)
+        except (TypeError, ValueError):
             return DirectMessage.objects.none()
 
-        return DirectMessage.objects.filter(
-            sender_id__in=[sender_id, receiver_id],
-            receiver_id__in=[sender_id, receiver_id]
-        ).order_by('timestamp')
+        return DirectMessage.objects.filter(conversation=conversation).select_related('sender', 'receiver')
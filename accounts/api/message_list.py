@@ -1,9 +1,9 @@
 from rest_framework.generics import ListAPIView
-from rest_framework.response import Response
 from rest_framework import serializers
 import logging
 
 from accounts.models import Message, User
+from common.pagination import KeysetPagination
 
 logger = logging.getLogger(__name__)
 
@@ -22,17 +22,18 @@ class MessageSerializer(serializers.ModelSerializer):
 
 
 class ListMessage(ListAPIView):
+    """
+    Room history, one keyset page at a time (see KeysetPagination):
+    ?room_id=1 for the latest messages, then the previous/next links
+    (?before=<cursor> / ?after=<cursor>) to move through the history.
+    """
     serializer_class = MessageSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         room_id = self.request.query_params.get('room_id')
         if room_id:
-            queryset = Message.objects.filter(room_id=room_id).order_by('timestamp')
+            queryset = Message.objects.filter(room_id=room_id).select_related('sender')
         else:
             queryset = Message.objects.none()
         return queryset
-
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
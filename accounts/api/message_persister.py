@@ -0,0 +1,195 @@
+"""
+Write-behind persistence of chat messages.
+
+ChatConsumer hands unsaved Message / DirectMessage instances to the
+per-process message_persister and broadcasts right away; the persister
+bulk_creates them in arrival order, every FLUSH_INTERVAL seconds or as
+soon as BATCH_SIZE messages are pending.
+
+- Ordering: the consumer stamps each message when it is received, one
+  flush runs at a time and batches are taken from the head of the queue,
+  so ids follow arrival order and (timestamp, id) matches the order the
+  messages were broadcast in.
+- At-least-once: a batch leaves the queue only after its transaction
+  committed. Transient database errors (lost connection, failover) keep
+  the batch at the head of the queue and are retried with backoff for as
+  long as they last; a failed commit whose data did reach the database
+  may therefore be written twice. Only rows the database rejects
+  outright (a deleted sender, a NUL byte, overlong content) are dropped,
+  with an error log, after the batch is retried row by row.
+- Backpressure: once MAX_PENDING messages are queued (the database has
+  been unreachable for a while), submit() raises PersisterFull and the
+  consumer refuses the message instead of broadcasting it.
+- Shutdown: consumers wake the flusher on disconnect and whatever is still
+  pending at interpreter exit is written synchronously. A hard crash
+  loses at most the messages not yet written (one FLUSH_INTERVAL while
+  the database is up).
+"""
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, InterfaceError, OperationalError, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERSISTER_SETTINGS = {
+    # False: every message is written before it is broadcast
+    'ENABLED': True,
+    'BATCH_SIZE': 200,
+    # Seconds a message may wait before its batch is written
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_PENDING': 10000,
+    # Backoff between retries of a failed batch (seconds, doubled up to the max)
+    'RETRY_DELAY': 0.1,
+    'MAX_RETRY_DELAY': 5.0,
+}
+
+# Errors of the connection or server, worth retrying as is
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+# Errors caused by the rows themselves (the psycopg2 driver raises ValueError for NUL bytes)
+REJECTED_ROW_ERRORS = (IntegrityError, DataError, ValueError)
+
+
+class PersisterFull(Exception):
+    pass
+
+
+def get_persister_settings():
+    return {**DEFAULT_PERSISTER_SETTINGS, **getattr(settings, 'CHAT_MESSAGE_PERSISTER', {})}
+
+
+def _runs_by_model(instances):
+    """Consecutive runs of instances of the same model, in order"""
+    runs = []
+    for instance in instances:
+        if runs and type(runs[-1][0]) is type(instance):
+            runs[-1].append(instance)
+        else:
+            runs.append([instance])
+    return runs
+
+
+def write_messages(instances):
+    """
+    Insert a batch in one transaction. When the database rejects some of the
+    rows, insert them one by one and drop the bad ones; transient errors
+    are raised for the caller to retry, so it never drops the whole batch.
+    """
+    try:
+        with transaction.atomic():
+            for run in _runs_by_model(instances):
+                type(run[0]).objects.bulk_create(run)
+        return
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception as e:
+        logger.warning(f"Chat message batch rejected, writing rows one by one: {e}")
+
+    for instance in instances:
+        try:
+            with transaction.atomic():
+                type(instance).objects.bulk_create([instance])
+        except TRANSIENT_ERRORS:
+            raise
+        except (*REJECTED_ROW_ERRORS, DatabaseError) as e:
+            logger.error(f"Dropping chat message that cannot be stored ({type(instance).__name__}): {e}")
+        except Exception:
+            # Anything else about one row must not hold up the rest of the queue either
+            logger.exception(f"Dropping chat message that could not be written ({type(instance).__name__})")
+
+
+class MessagePersister:
+    def __init__(self):
+        self._pending = []
+        self._loop = None
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+        self.written = 0
+        atexit.register(self.flush_sync)
+
+    @property
+    def config(self):
+        return get_persister_settings()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def submit(self, instance):
+        """Queue an unsaved message instance for writing (written immediately when disabled)"""
+        config = self.config
+        if not config['ENABLED']:
+            await database_sync_to_async(write_messages)([instance])
+            self.written += 1
+            return
+
+        self._bind_loop()
+        if len(self._pending) >= config['MAX_PENDING']:
+            self._wakeup.set()
+            raise PersisterFull(f"{len(self._pending)} chat messages are waiting to be written")
+        self._pending.append(instance)
+        if len(self._pending) >= config['BATCH_SIZE']:
+            self._wakeup.set()
+
+    def request_flush(self):
+        """Ask the background flusher to write now, without waiting for it"""
+        if self._wakeup is not None and self._pending:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write everything queued so far, in order; waits out transient database errors"""
+        self._bind_loop()
+        config = self.config
+        async with self._lock:
+            delay = config['RETRY_DELAY']
+            while self._pending:
+                batch = self._pending[:config['BATCH_SIZE']]
+                try:
+                    await database_sync_to_async(write_messages)(batch)
+                except TRANSIENT_ERRORS as e:
+                    # The batch stays at the head of the queue until the database is back
+                    logger.error(f"Writing {len(batch)} chat messages failed, retrying in {delay:.2f}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, config['MAX_RETRY_DELAY'])
+                    continue
+                del self._pending[:len(batch)]
+                self.written += len(batch)
+                delay = config['RETRY_DELAY']
+
+    def flush_sync(self):
+        """Write pending messages from synchronous code (interpreter exit, management commands)"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            write_messages(batch)
+            self.written += len(batch)
+        except Exception as e:
+            logger.error(f"Could not write {len(batch)} pending chat messages: {e}")
+
+    def _bind_loop(self):
+        # Queue primitives belong to the running loop; a new loop (tests,
+        # server reload) gets its own flusher task, pending messages carry over
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.config['FLUSH_INTERVAL'])
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                await self.flush()
+
+
+message_persister = MessagePersister()
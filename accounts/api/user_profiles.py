@@ -0,0 +1,82 @@
+"""
+Public profile of a chat sender (id, email, name, avatar URL), as sent with
+every broadcast message.
+
+Profiles are kept in the shared cache so the WebSocket consumer does not
+load the user and ask the storage backend for the avatar URL on every
+message. Entries are keyed by user id and PROFILE_VERSION (bump it when
+the profile fields change) and are dropped by the User post_save /
+post_delete signals (accounts.signals), e.g. after a MeApi PUT/PATCH.
+
+The avatar URL is cached with the profile. On S3 storage it is a
+presigned URL valid for AWS_QUERYSTRING_EXPIRE seconds (3600 by default),
+so entries live at most a quarter of that (15 minutes by default): every
+URL sent with a message still has at least three quarters of its life.
+
+Invalidation only reaches every server process through a shared backend
+(Redis, REDIS_URL). With a process-local cache (LocMem, the fallback when
+REDIS_URL is unset) other processes would keep a stale profile, so entries
+then live only LOCAL_PROFILE_CACHE_TIMEOUT seconds.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+User = get_user_model()
+
+PROFILE_VERSION = 1
+PROFILE_CACHE_ALIAS = 'default'
+# Upper bound; the avatar URL expiry usually lowers it (see profile_cache_timeout)
+PROFILE_CACHE_TIMEOUT = 60 * 60
+# Staleness other processes may see when the cache is not shared
+LOCAL_PROFILE_CACHE_TIMEOUT = 5
+
+
+def profile_cache():
+    return caches[PROFILE_CACHE_ALIAS]
+
+
+def profile_cache_timeout(cache):
+    if isinstance(cache, LocMemCache):
+        return LOCAL_PROFILE_CACHE_TIMEOUT
+    if getattr(settings, 'AWS_QUERYSTRING_AUTH', True):
+        # Presigned avatar URLs must not go out close to their expiry
+        return min(PROFILE_CACHE_TIMEOUT, getattr(settings, 'AWS_QUERYSTRING_EXPIRE', 3600) // 4)
+    return PROFILE_CACHE_TIMEOUT
+
+
+def profile_cache_key(user_id):
+    return f'chat_user_profile:{user_id}'
+
+
+def build_user_profile(user):
+    return {
+        'id': user.id,
+        'email': user.email,
+        'name': user.name,
+        'avatar': user.avatar.url if user.avatar and hasattr(user.avatar, 'url') else None
+    }
+
+
+def get_user_profile(user_id):
+    """Cached profile of user_id, None if there is no such user"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    cache = profile_cache()
+    key = profile_cache_key(user_id)
+    profile = cache.get(key, version=PROFILE_VERSION)
+    if profile is None:
+        user = User.objects.filter(id=user_id).first()
+        if user is None:
+            return None
+        profile = build_user_profile(user)
+        cache.set(key, profile, profile_cache_timeout(cache), version=PROFILE_VERSION)
+    return profile
+
+
+def invalidate_user_profile(user_id):
+    profile_cache().delete(profile_cache_key(user_id), version=PROFILE_VERSION)
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+
+def backfill_conversation(apps, schema_editor):
+    """Fill the conversation key of existing rows in one UPDATE"""
+    DirectMessage = apps.get_model('accounts', 'DirectMessage')
+    DirectMessage.objects.filter(conversation='').update(conversation=Concat(
+        Cast(Least('sender_id', 'receiver_id'), CharField()),
+        Value('_'),
+        Cast(Greatest('sender_id', 'receiver_id'), CharField()),
+        output_field=CharField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_message_room_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directmessage',
+            name='conversation',
+            field=models.CharField(default='', editable=False, max_length=41),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_conversation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='directmessage',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='dm_conv_ts_id_idx'),
+        ),
+    ]
@@ -1,12 +1,32 @@
 from django.db import models
+from django.utils import timezone
 
 from accounts.models import User
 
 class DirectMessage(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_direct_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_direct_messages')
+    # Same key for both directions of a thread: "<smaller user id>_<larger user id>"
+    conversation = models.CharField(max_length=41, editable=False)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is received; rows may be written later in batches (message_persister)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Thread pages: keyset range scans on (timestamp, id) within a conversation
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='dm_conv_ts_id_idx'),
+        ]
+
+    @staticmethod
+    def conversation_key(user_id, other_user_id):
+        user_id, other_user_id = int(user_id), int(other_user_id)
+        return f'{min(user_id, other_user_id)}_{max(user_id, other_user_id)}'
+
+    def save(self, *args, **kwargs):
+        if not self.conversation:
+            self.conversation = self.conversation_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username} at {self.timestamp}"
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from accounts.models import User
 from accounts.models.chatroom import ChatRoom
@@ -8,7 +9,14 @@ class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is received; rows may be written later in batches (message_persister)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Room history pages: keyset range scans on (timestamp, id)
+            models.Index(fields=['room', 'timestamp', 'id'], name='message_room_ts_id_idx'),
+        ]
 
     def __str__(self):
         return f'Message from {self.sender} in {self.room.name} at {self.timestamp}'
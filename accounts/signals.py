@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.api.user_profiles import invalidate_user_profile
+
+User = get_user_model()
+
+# Saves that cannot change the public profile (e.g. login stamping last_login)
+PROFILE_NEUTRAL_FIELDS = {'last_login', 'password'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= PROFILE_NEUTRAL_FIELDS:
+        return
+    invalidate_user_profile(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user_profile(instance.pk)
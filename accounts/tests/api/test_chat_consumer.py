@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+
+from accounts.api.consumers import coalesce_window
+from accounts.api.message_persister import message_persister
+from accounts.factories.user import UserFactory
+from accounts.models import ChatRoom, Message
+from chatroom.asgi import application
+from common.tests.isolated_cache_test_case import APITestCase
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = UserFactory()
+        cls.room = ChatRoom.objects.create(name='general', created_by=cls.user)
+
+    def test_coalesce_window_is_negotiated_and_clamped(self):
+        self.assertIsNone(coalesce_window(b''))
+        self.assertIsNone(coalesce_window(b'coalesce=0&window_ms=20'))
+        self.assertEqual(coalesce_window(b'coalesce=1'), 0.03)
+        self.assertEqual(coalesce_window(b'coalesce=true&window_ms=40'), 0.04)
+        self.assertEqual(coalesce_window(b'coalesce=1&window_ms=5000'), 0.2)
+
+    def test_coalescing_client_gets_one_array_frame_per_window(self):
+        url = f'/ws/chat/room/{self.room.id}/'
+
+        async def chat():
+            plain = WebsocketCommunicator(application, url)
+            coalesced = WebsocketCommunicator(application, f'{url}?coalesce=1&window_ms=200')
+            await plain.connect()
+            await coalesced.connect()
+            for index in range(3):
+                await plain.send_json_to({'message': f'm{index}', 'sender_id': self.user.id})
+            plain_frames = [await plain.receive_json_from() for _ in range(3)]
+            coalesced_frame = json.loads(await coalesced.receive_from(timeout=1))
+            nothing_else = await coalesced.receive_nothing(timeout=0.1)
+            await plain.disconnect()
+            await coalesced.disconnect()
+            await message_persister.flush()
+            return plain_frames, coalesced_frame, nothing_else
+
+        plain_frames, coalesced_frame, nothing_else = async_to_sync(chat)()
+        self.assertEqual([frame['message'] for frame in plain_frames], ['m0', 'm1', 'm2'])
+        self.assertEqual(coalesced_frame, plain_frames)
+        self.assertTrue(nothing_else)
+        self.assertEqual(plain_frames[0]['user']['id'], self.user.id)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 3)
+
+    def test_group_events_carry_only_the_frame_and_stop_after_disconnect(self):
+        url = f'/ws/chat/room/{self.room.id}/'
+
+        async def chat():
+            layer = get_channel_layer()
+            listener = await layer.new_channel()
+            await layer.group_add(f'room_{self.room.id}', listener)
+            coalesced = WebsocketCommunicator(application, f'{url}?coalesce=1&window_ms=200')
+            await coalesced.connect()
+            await coalesced.send_json_to({'message': 'hello', 'sender_id': self.user.id})
+            event = await layer.receive(listener)
+            # Disconnect while the window is still open: nothing is sent afterwards
+            await coalesced.disconnect()
+            await asyncio.sleep(0.25)
+            await message_persister.flush()
+            return event, coalesced.output_queue.empty()
+
+        event, nothing_sent = async_to_sync(chat)()
+        self.assertEqual(set(event), {'type', 'frame'})
+        self.assertEqual(json.loads(event['frame'])['message'], 'hello')
+        self.assertTrue(nothing_sent)
@@ -0,0 +1,40 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from accounts.factories.user import UserFactory
+from accounts.models import DirectMessage
+from common.tests.isolated_cache_test_case import APITestCase
+
+
+class DirectMessagesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.alice, cls.bob, cls.carol = UserFactory(), UserFactory(), UserFactory()
+        cls.thread = []
+        for index in range(6):
+            sender, receiver = (cls.alice, cls.bob) if index % 2 else (cls.bob, cls.alice)
+            cls.thread.append(DirectMessage.objects.create(sender=sender, receiver=receiver, content=f'dm {index}').pk)
+        DirectMessage.objects.create(sender=cls.alice, receiver=cls.carol, content='other thread')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.alice)
+
+    def test_thread_has_one_key_for_both_directions(self):
+        keys = set(DirectMessage.objects.filter(pk__in=self.thread).values_list('conversation', flat=True))
+        self.assertEqual(keys, {DirectMessage.conversation_key(self.bob.pk, self.alice.pk)})
+
+    def test_thread_pages_load_users_in_one_query(self):
+        url = f'/api/accounts/direct_messages/?sender_id={self.alice.pk}&receiver_id={self.bob.pk}&limit=4'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([message['id'] for message in response.data['results']], self.thread[2:])
+        self.assertEqual(response.data['results'][0]['receiver']['name'], self.alice.name)
+
+        older = self.client.get(response.data['previous']).data
+        self.assertEqual([message['id'] for message in older['results']], self.thread[:2])
+        self.assertEqual(self.client.get('/api/accounts/direct_messages/?sender_id=x&receiver_id=1').data['results'], [])
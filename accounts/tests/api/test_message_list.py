@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+
+from accounts.factories.user import UserFactory
+from accounts.models import ChatRoom, Message
+from common.tests.isolated_cache_test_case import APITestCase
+
+
+class ListMessageTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.users = [UserFactory() for _ in range(3)]
+        cls.room = ChatRoom.objects.create(name='general', created_by=cls.users[0])
+        other_room = ChatRoom.objects.create(name='other', created_by=cls.users[0])
+        start = timezone.now()
+        cls.messages = []
+        for index in range(12):
+            message = Message.objects.create(room=cls.room, sender=cls.users[index % 3], content=f'message {index}')
+            # Pairs of messages share a timestamp, so pages must break ties on id
+            Message.objects.filter(pk=message.pk).update(timestamp=start + timedelta(seconds=index // 2))
+            cls.messages.append(message.pk)
+        Message.objects.create(room=other_room, sender=cls.users[0], content='elsewhere')
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return response.data
+
+    def test_pages_walk_the_history_in_both_directions(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get(f'/api/accounts/messages/?room_id={self.room.pk}&limit=5')
+        # One query for the page, senders included
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([message['id'] for message in page['results']], self.messages[7:])
+        self.assertEqual(page['results'][0]['sender']['name'], self.users[7 % 3].name)
+        self.assertIsNone(page['next'])
+
+        seen = []
+        while page['previous']:
+            seen = [message['id'] for message in page['results']] + seen
+            page = self.get(page['previous'])
+        seen = [message['id'] for message in page['results']] + seen
+        self.assertEqual(seen, self.messages)
+
+        page = self.get(page['next'])
+        self.assertEqual([message['id'] for message in page['results']], self.messages[2:7])
+        self.assertIsNotNone(page['next'])
+
+    def test_invalid_cursor_and_missing_room(self):
+        response = self.client.get(f'/api/accounts/messages/?room_id={self.room.pk}&before=nope')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get('/api/accounts/messages/')['results'], [])
@@ -0,0 +1,139 @@
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import OperationalError
+from django.test import override_settings
+from django.utils import timezone
+
+from accounts.api.message_persister import MessagePersister, PersisterFull, write_messages
+from accounts.factories.user import UserFactory
+from accounts.models import ChatRoom, DirectMessage, Message
+from common.tests.isolated_cache_test_case import APITestCase
+
+
+class MessagePersisterTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.users = [UserFactory() for _ in range(2)]
+        cls.room = ChatRoom.objects.create(name='general', created_by=cls.users[0])
+
+    def room_message(self, content):
+        return Message(room=self.room, sender=self.users[0], content=content)
+
+    def direct_message(self, content):
+        sender, receiver = self.users
+        return DirectMessage(
+            sender=sender,
+            receiver=receiver,
+            conversation=DirectMessage.conversation_key(sender.id, receiver.id),
+            content=content
+        )
+
+    @override_settings(CHAT_MESSAGE_PERSISTER={'BATCH_SIZE': 3, 'FLUSH_INTERVAL': 60})
+    def test_messages_are_written_in_arrival_order(self):
+        persister = MessagePersister()
+        instances = [
+            self.room_message('r0'), self.direct_message('d0'), self.direct_message('d1'),
+            self.room_message('r1'), self.room_message('r2'), self.direct_message('d2'),
+        ]
+
+        async def submit_and_flush():
+            for instance in instances:
+                await persister.submit(instance)
+            queued = persister.pending
+            await persister.flush()
+            return queued
+
+        self.assertEqual(async_to_sync(submit_and_flush)(), 6)
+        self.assertEqual(persister.pending, 0)
+        self.assertEqual(persister.written, 6)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['r0', 'r1', 'r2'])
+        self.assertEqual(
+            list(DirectMessage.objects.order_by('id').values_list('content', 'conversation')),
+            [(f'd{i}', DirectMessage.conversation_key(*[user.id for user in self.users])) for i in range(3)]
+        )
+
+    def test_rejected_rows_do_not_block_the_batch(self):
+        persister = MessagePersister()
+
+        async def submit_and_flush():
+            for instance in (self.room_message('before'), self.room_message(None), self.room_message('after')):
+                await persister.submit(instance)
+            await persister.flush()
+
+        with self.assertLogs('accounts.api.message_persister', level='ERROR'):
+            async_to_sync(submit_and_flush)()
+        self.assertEqual(persister.pending, 0)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['before', 'after'])
+
+    def test_rows_the_driver_rejects_are_dropped(self):
+        persister = MessagePersister()
+        # Fails every time with ValueError (like a NUL byte under psycopg2), never transiently
+        bad = Message(room_id='not-a-room', sender=self.users[0], content='bad')
+
+        async def submit_and_flush():
+            for instance in (self.room_message('before'), bad, self.room_message('after')):
+                await persister.submit(instance)
+            await persister.flush()
+
+        with self.assertLogs('accounts.api.message_persister', level='ERROR'):
+            async_to_sync(submit_and_flush)()
+        self.assertEqual(persister.pending, 0)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['before', 'after'])
+
+    @override_settings(CHAT_MESSAGE_PERSISTER={'RETRY_DELAY': 0, 'FLUSH_INTERVAL': 60})
+    def test_transient_errors_keep_the_batch_until_it_is_written(self):
+        persister = MessagePersister()
+        outage = [OperationalError('server closed the connection')] * 20
+
+        def write(instances):
+            if outage:
+                raise outage.pop()
+            write_messages(instances)
+
+        async def submit_and_flush():
+            for content in ('first', 'second'):
+                await persister.submit(self.room_message(content))
+            await persister.flush()
+
+        with mock.patch('accounts.api.message_persister.write_messages', side_effect=write), \
+                self.assertLogs('accounts.api.message_persister', level='ERROR'):
+            async_to_sync(submit_and_flush)()
+        self.assertEqual(persister.pending, 0)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['first', 'second'])
+
+    @override_settings(CHAT_MESSAGE_PERSISTER={'MAX_PENDING': 2, 'FLUSH_INTERVAL': 60})
+    def test_full_queue_refuses_new_messages(self):
+        persister = MessagePersister()
+
+        async def submit_three():
+            for content in ('a', 'b'):
+                await persister.submit(self.room_message(content))
+            with self.assertRaises(PersisterFull):
+                await persister.submit(self.room_message('c'))
+            await persister.flush()
+
+        async_to_sync(submit_three)()
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['a', 'b'])
+
+    def test_receive_time_is_kept_when_written_later(self):
+        persister = MessagePersister()
+        received_at = timezone.now() - timedelta(seconds=30)
+        message = self.room_message('late')
+        message.timestamp = received_at
+
+        async def submit_and_flush():
+            await persister.submit(message)
+            await persister.flush()
+
+        async_to_sync(submit_and_flush)()
+        self.assertEqual(Message.objects.get(content='late').timestamp, received_at)
+
+    @override_settings(CHAT_MESSAGE_PERSISTER={'ENABLED': False})
+    def test_disabled_persister_writes_through(self):
+        persister = MessagePersister()
+        async_to_sync(persister.submit)(self.room_message('now'))
+        self.assertEqual(persister.pending, 0)
+        self.assertTrue(Message.objects.filter(content='now').exists())
@@ -0,0 +1,56 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from unittest import mock
+
+from django.core.cache.backends.redis import RedisCache
+
+from accounts.api.user_profiles import (
+    LOCAL_PROFILE_CACHE_TIMEOUT,
+    PROFILE_CACHE_TIMEOUT,
+    get_user_profile,
+    profile_cache,
+    profile_cache_timeout,
+)
+from accounts.factories.user import UserFactory
+from common.tests.isolated_cache_test_case import APITestCase
+
+
+class UserProfileCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        profile_cache().clear()
+        self.user = UserFactory()
+
+    def test_profile_is_cached_until_the_user_changes(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = get_user_profile(self.user.id)
+            second = get_user_profile(str(self.user.id))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first['name'], self.user.name)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.patch('/api/accounts/me/', {'name': 'Renamed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        self.assertEqual(get_user_profile(self.user.id)['name'], 'Renamed')
+
+    def test_unknown_users_have_no_profile(self):
+        self.assertIsNone(get_user_profile(self.user.id + 1000))
+        self.assertIsNone(get_user_profile('nope'))
+        user_id = self.user.id
+        get_user_profile(user_id)
+        self.user.delete()
+        self.assertIsNone(get_user_profile(user_id))
+
+    def test_process_local_cache_keeps_profiles_briefly(self):
+        self.assertEqual(profile_cache_timeout(profile_cache()), LOCAL_PROFILE_CACHE_TIMEOUT)
+        redis = mock.Mock(spec=RedisCache)
+        # Presigned avatar URLs (1 hour by default) keep at least 3/4 of their life
+        self.assertEqual(profile_cache_timeout(redis), 900)
+        with override_settings(AWS_QUERYSTRING_EXPIRE=600):
+            self.assertEqual(profile_cache_timeout(redis), 150)
+        with override_settings(AWS_QUERYSTRING_AUTH=False):
+            self.assertEqual(profile_cache_timeout(redis), PROFILE_CACHE_TIMEOUT)
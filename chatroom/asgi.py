@@ -10,7 +10,7 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 import os
 import django
 from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 from django.urls import path
 
@@ -18,13 +18,19 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatroom.settings")
 django.setup()
 
 from accounts.api.consumers import ChatConsumer
+from image_processing.consumers import ImageJobConsumer, ImageJobWorker
+from image_processing.jobs import get_job_settings
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter([
             path('ws/chat/<str:chat_type>/<str:room_id>/', ChatConsumer.as_asgi()),
+            path('ws/image-jobs/', ImageJobConsumer.as_asgi()),
         ])
     ),
+    "channel": ChannelNameRouter({
+        get_job_settings()['CHANNEL']: ImageJobWorker.as_asgi(),
+    }),
 })
 
@@ -177,16 +177,112 @@ REST_FRAMEWORK = {
     # 'EXCEPTION_HANDLER': 'common.api_exception_handler.custom_exception_handler',
 }
 
+# Redis in production (docker-compose and k8s set REDIS_URL): channel layer and shared caches
+REDIS_URL = os.getenv('REDIS_URL')
+
 ASGI_APPLICATION = 'chatroom.asgi.application'
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [("redis", 6379)],
+            "hosts": [REDIS_URL or ("redis", 6379)],
         },
     },
 }
 
+# Chat messages are written in batches behind the broadcast (accounts.api.message_persister)
+CHAT_MESSAGE_PERSISTER = {
+    'ENABLED': os.getenv('CHAT_MESSAGE_PERSISTER_ENABLED', 'true').lower() == 'true',
+    'BATCH_SIZE': int(os.getenv('CHAT_MESSAGE_PERSISTER_BATCH_SIZE', '200')),
+    'FLUSH_INTERVAL': int(os.getenv('CHAT_MESSAGE_PERSISTER_INTERVAL_MS', '50')) / 1000,
+}
+
+# Clients connecting with ?coalesce=1[&window_ms=N] get chat events batched into array frames
+CHAT_COALESCE = {
+    'DEFAULT_WINDOW_MS': int(os.getenv('CHAT_COALESCE_WINDOW_MS', '30')),
+}
+
+# Caches are shared through Redis when REDIS_URL is set, in-process memory otherwise
+if REDIS_URL:
+    CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+else:
+    CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
+CACHES = {
+    'default': {**CACHE_BACKEND, 'KEY_PREFIX': 'default'},
+    'image_processing': {**CACHE_BACKEND, 'KEY_PREFIX': 'image_processing', 'TIMEOUT': 60 * 60},
+}
+
+IMAGE_PROCESSING_CACHE = {
+    'ENABLED': os.getenv('IMAGE_PROCESSING_CACHE_ENABLED', 'true').lower() == 'true',
+    'ALIAS': 'image_processing',
+    'TIMEOUT': 60 * 60,
+    'MAX_ENTRY_BYTES': 8 * 1024 * 1024,
+    'LOCAL_MAX_BYTES': 64 * 1024 * 1024,
+}
+
+# Upload limits; images above 16 MP are processed in strips (image_processing.tiling)
+IMAGE_PROCESSING_UPLOADS = {
+    'MAX_BYTES': int(os.getenv('IMAGE_PROCESSING_MAX_UPLOAD_MB', '10')) * 1024 * 1024,
+    'MAX_PIXELS': int(os.getenv('IMAGE_PROCESSING_MAX_PIXELS', '200000000')),
+}
+
+# Process pool for CPU-heavy color analysis (k-means, GMM, watershed)
+IMAGE_PROCESSING_EXECUTOR = {
+    'ENABLED': os.getenv('IMAGE_PROCESSING_POOL_ENABLED', 'true').lower() == 'true',
+    'MAX_WORKERS': int(os.getenv('IMAGE_PROCESSING_POOL_WORKERS', '0')) or None,
+    'MAX_QUEUE': int(os.getenv('IMAGE_PROCESSING_POOL_QUEUE', '8')),
+    'TIMEOUTS': {
+        'default': 60,
+        'get_dominant_colors': 30,
+        'quantize_colors': 30,
+        'segment_image_by_color': 45,
+        'gmm_quantize_colors': 90,
+    },
+}
+
+# Batch endpoint: shared thread pool size (0 = CPU count) and images per request
+IMAGE_PROCESSING_BATCH = {
+    'MAX_WORKERS': int(os.getenv('IMAGE_PROCESSING_BATCH_WORKERS', '0')) or None,
+    'MAX_FILES': int(os.getenv('IMAGE_PROCESSING_BATCH_MAX_FILES', '500')),
+    'MAX_ARCHIVE_BYTES': int(os.getenv('IMAGE_PROCESSING_BATCH_MAX_ARCHIVE_MB', '256')) * 1024 * 1024,
+}
+
+# Reusable image buffers for effect pipelines (image_processing.buffers)
+IMAGE_PROCESSING_BUFFER_POOL = {
+    'ENABLED': os.getenv('IMAGE_PROCESSING_BUFFER_POOL_ENABLED', 'true').lower() == 'true',
+    'MAX_BYTES': int(os.getenv('IMAGE_PROCESSING_BUFFER_POOL_MB', '192')) * 1024 * 1024,
+}
+
+# Editing sessions for slider previews: stored in the shared cache, decoded
+# images of recently used sessions kept per process
+IMAGE_PROCESSING_SESSIONS = {
+    'CACHE_ALIAS': 'image_processing',
+    'MAX_BYTES': int(os.getenv('IMAGE_PROCESSING_SESSIONS_MB', '512')) * 1024 * 1024,
+    'MAX_SESSIONS': int(os.getenv('IMAGE_PROCESSING_SESSIONS_MAX', '64')),
+    'TTL': int(os.getenv('IMAGE_PROCESSING_SESSIONS_TTL', str(15 * 60))),
+}
+
+# Per-stage timings: Server-Timing header and Prometheus histograms on /metrics
+IMAGE_PROCESSING_METRICS = {
+    'ENABLED': os.getenv('IMAGE_PROCESSING_METRICS_ENABLED', 'true').lower() == 'true',
+    # /metrics answers only requests with Authorization: Bearer <token> (off when unset)
+    'TOKEN': os.getenv('IMAGE_PROCESSING_METRICS_TOKEN'),
+}
+
+# Background image jobs, processed by: python manage.py runworker image-processing-jobs
+IMAGE_PROCESSING_JOBS = {
+    'CHANNEL': 'image-processing-jobs',
+    'CACHE_ALIAS': 'image_processing',
+    'TTL': 60 * 60,
+    'QUEUE_TIMEOUT': 60,
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
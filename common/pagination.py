@@ -0,0 +1,113 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) pagination on a (timestamp, id) ordering.
+
+    ?limit=N             latest N rows
+    ?before=<cursor>     N rows older than the cursor
+    ?after=<cursor>      N rows newer than the cursor
+
+    Pages are always returned oldest first. Every page is one indexed range
+    scan of at most limit + 1 rows, however deep into the history it is,
+    so the queryset should be backed by an index on its filter columns
+    followed by (timestamp, id).
+    """
+    timestamp_field = 'timestamp'
+    default_limit = 50
+    max_limit = 200
+    limit_query_param = 'limit'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        before = self.decode_cursor(request.query_params.get(self.before_query_param))
+        after = self.decode_cursor(request.query_params.get(self.after_query_param))
+        field = self.timestamp_field
+
+        if after is not None:
+            rows = list(self.filter_after(queryset, after).order_by(field, 'pk')[:self.limit + 1])
+            self.has_newer = len(rows) > self.limit
+            self.has_older = True
+            rows = rows[:self.limit]
+        else:
+            if before is not None:
+                queryset = self.filter_before(queryset, before)
+            rows = list(queryset.order_by(f'-{field}', '-pk')[:self.limit + 1])
+            self.has_older = len(rows) > self.limit
+            self.has_newer = before is not None
+            rows = rows[:self.limit][::-1]
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'previous': self.get_previous_link(),
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def filter_before(self, queryset, cursor):
+        timestamp, pk = cursor
+        field = self.timestamp_field
+        # The redundant <= bound keeps the scan on the index range
+        return queryset.filter(
+            Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'pk__lt': pk}),
+            **{f'{field}__lte': timestamp}
+        )
+
+    def filter_after(self, queryset, cursor):
+        timestamp, pk = cursor
+        field = self.timestamp_field
+        return queryset.filter(
+            Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'pk__gt': pk}),
+            **{f'{field}__gte': timestamp}
+        )
+
+    def encode_cursor(self, obj):
+        position = f'{getattr(obj, self.timestamp_field).isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_previous_link(self):
+        if not (self.page and self.has_older):
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.after_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.before_query_param, self.encode_cursor(self.page[0]))
+
+    def get_next_link(self):
+        if not (self.page and self.has_newer):
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.before_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.after_query_param, self.encode_cursor(self.page[-1]))
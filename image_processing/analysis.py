@@ -0,0 +1,285 @@
+import cv2
+
+from .color_names import DEFAULT_COLOR_DICTIONARY
+from .executor import image_executor
+from .masks import DEFAULT_MASK_FORMAT, label_counts, mask_polygons, rle_encode, rle_encode_labels
+from .utils import (
+    KMEANS_ATTEMPTS,
+    KMEANS_FIT_PIXELS,
+    EncodedImage,
+    get_dominant_colors,
+    detect_color_regions,
+    quantize_colors,
+    extract_palette,
+    create_color_mask,
+    make_proxy,
+    restore_from_proxy,
+    scale_bounding_boxes,
+    segment_labels,
+    hex_to_rgb,
+    gmm_quantize_colors,
+    assign_color_names
+)
+
+# Color analysis modes by name: handler(analysis) -> response fields
+ANALYSIS_MODES = {}
+
+
+def analysis_mode(name):
+    """Register the decorated function as the handler of a color analysis mode"""
+    def register(handler):
+        ANALYSIS_MODES[name] = handler
+        return handler
+    return register
+
+
+class ColorAnalysis:
+    """
+    State shared by the mode handlers of one request: the (proxy) image,
+    validated data and helpers that map results back to the original image.
+    """
+
+    def __init__(self, cv2_image, data, image_format='JPEG'):
+        self.data = data
+        self.image_format = image_format
+        self.original_shape = cv2_image.shape
+        self.max_pixels = data.get('max_pixels')
+        self.image, self.proxy_scale = make_proxy(cv2_image, self.max_pixels)
+        self.mask_format = data.get('mask_format', DEFAULT_MASK_FORMAT)
+        self.kmeans_options = {
+            'fit_pixels': data.get('kmeans_fit_pixels', KMEANS_FIT_PIXELS),
+            'attempts': data.get('kmeans_attempts', KMEANS_ATTEMPTS),
+            'backend': data.get('clustering_backend') or 'sample',
+        }
+
+    def encode(self, image):
+        return EncodedImage.from_array(image, self.image_format)
+
+    def restore(self, image):
+        return restore_from_proxy(image, self.original_shape)
+
+    def encode_mask(self, mask):
+        """Response fields for one binary mask in the requested mask_format"""
+        if self.mask_format == 'label_map':
+            return {'mask': EncodedImage.from_array(mask, 'PNG')}
+        if self.mask_format == 'rle':
+            return {'mask_rle': rle_encode(mask)}
+        if self.mask_format == 'polygons':
+            return {'mask_polygons': mask_polygons(mask)}
+        return {'mask': self.encode(mask)}
+
+
+def run_color_analysis(cv2_image, data, image_format='JPEG'):
+    """
+    Run one ColorAnalysisSerializer mode on a decoded image.
+    data: validated serializer data (the upload itself is not used)
+    Returns the response payload; images are EncodedImage in image_format.
+    Heavy modes (k-means, GMM, watershed) go through image_executor.
+    With max_pixels set, the analysis runs on a downscaled proxy; masks,
+    quantized images and bounding boxes are mapped back to the original size.
+    Masks are returned in data['mask_format'] (see masks.MASK_FORMATS).
+    """
+    mode = data['mode']
+    try:
+        handler = ANALYSIS_MODES[mode]
+    except KeyError:
+        raise ValueError(f"Unknown color analysis mode '{mode}'")
+
+    analysis = ColorAnalysis(cv2_image, data, image_format)
+    response_data = {
+        'success': True,
+        'mode': mode
+    }
+    if analysis.max_pixels:
+        response_data.update({
+            'proxy_scale': round(analysis.proxy_scale, 6),
+            'analysis_size': {'width': analysis.image.shape[1], 'height': analysis.image.shape[0]}
+        })
+
+    response_data.update(handler(analysis))
+    return response_data
+
+
+@analysis_mode('dominant_colors')
+def dominant_colors_mode(analysis):
+    num_colors = analysis.data['num_colors']
+    dominant_colors = image_executor.run(
+        get_dominant_colors, analysis.image, k=num_colors, **analysis.kmeans_options
+    )
+
+    return {
+        'message': f'Extracted {len(dominant_colors)} dominant colors successfully',
+        'dominant_colors': dominant_colors,
+        'total_colors': len(dominant_colors)
+    }
+
+
+@analysis_mode('color_detection')
+def color_detection_mode(analysis):
+    target_color_hex = analysis.data['target_color']
+    tolerance = analysis.data['tolerance']
+
+    # Convert hex to RGB
+    target_color_rgb = hex_to_rgb(target_color_hex)
+
+    # Detect color regions
+    # Keep the 100 px minimum region area in original-image pixels
+    mask, bounding_boxes = detect_color_regions(
+        analysis.image, target_color_rgb, tolerance, min_area=100 * analysis.proxy_scale ** 2
+    )
+    mask = analysis.restore(mask)
+    bounding_boxes = scale_bounding_boxes(bounding_boxes, analysis.proxy_scale, analysis.original_shape)
+
+    return {
+        'message': f'Detected {len(bounding_boxes)} regions with target color',
+        'target_color': target_color_hex,
+        'target_color_rgb': target_color_rgb,
+        'tolerance': tolerance,
+        **analysis.encode_mask(mask),
+        'mask_format': analysis.mask_format,
+        'bounding_boxes': bounding_boxes,
+        'regions_found': len(bounding_boxes)
+    }
+
+
+@analysis_mode('color_quantization')
+def color_quantization_mode(analysis):
+    quantization_levels = analysis.data['quantization_levels']
+
+    # Quantize colors
+    quantized_image, palette = image_executor.run(
+        quantize_colors, analysis.image, k=quantization_levels, **analysis.kmeans_options
+    )
+
+    return {
+        'message': f'Image quantized to {len(palette)} colors successfully',
+        'quantized_image': analysis.encode(analysis.restore(quantized_image)),
+        'color_palette': palette,
+        'quantization_levels': quantization_levels
+    }
+
+
+@analysis_mode('color_mask')
+def color_mask_mode(analysis):
+    color_space = analysis.data['color_space']
+
+    # Create color range
+    color_range = {
+        'lower': analysis.data['lower_range'],
+        'upper': analysis.data['upper_range']
+    }
+
+    # Create mask
+    mask = analysis.restore(create_color_mask(analysis.image, color_range, color_space))
+
+    # Calculate mask statistics
+    total_pixels = mask.shape[0] * mask.shape[1]
+    white_pixels = cv2.countNonZero(mask)
+    coverage_percentage = (white_pixels / total_pixels) * 100
+
+    return {
+        'message': f'Color mask created successfully in {color_space} color space',
+        'color_space': color_space,
+        'color_range': color_range,
+        **analysis.encode_mask(mask),
+        'mask_format': analysis.mask_format,
+        'coverage_percentage': round(coverage_percentage, 2),
+        'masked_pixels': int(white_pixels),
+        'total_pixels': int(total_pixels)
+    }
+
+
+@analysis_mode('multi_segment')
+def multi_segment_mode(analysis):
+    num_segments = analysis.data['num_segments']
+    segmentation_method = analysis.data['segmentation_method']
+    mask_format = analysis.mask_format
+
+    # Segment image into one label map (segment i has label i + 1)
+    labels, n_labels, centers = image_executor.run(
+        segment_labels, analysis.image, num_segments, segmentation_method, **analysis.kmeans_options
+    )
+    labels = analysis.restore(labels)
+
+    # Statistics for every segment from one pass over the label map
+    total_pixels = labels.shape[0] * labels.shape[1]
+    pixel_counts = label_counts(labels, n_labels)
+    if mask_format == 'rle':
+        rles = rle_encode_labels(labels, n_labels)
+
+    segment_masks = []
+    for i in range(n_labels):
+        segment_info = {
+            'segment_id': i + 1,
+            'coverage_percentage': round((pixel_counts[i] / total_pixels) * 100, 2),
+            'pixel_count': int(pixel_counts[i])
+        }
+        if mask_format == 'rle':
+            segment_info['rle'] = rles[i]
+        elif mask_format == 'polygons':
+            segment_info['polygons'] = mask_polygons(cv2.compare(labels, i + 1, cv2.CMP_EQ))
+        elif mask_format != 'label_map':
+            segment_info['mask'] = analysis.encode(cv2.compare(labels, i + 1, cv2.CMP_EQ))
+
+        # Add center color if available (from k-means)
+        if centers is not None and i < len(centers):
+            center_bgr = centers[i]
+            center_rgb = [int(center_bgr[2]), int(center_bgr[1]), int(center_bgr[0])]
+            center_hex = '#{:02x}{:02x}{:02x}'.format(center_rgb[0], center_rgb[1], center_rgb[2])
+            segment_info.update({
+                'center_color_rgb': center_rgb,
+                'center_color_hex': center_hex
+            })
+
+        segment_masks.append(segment_info)
+
+    response_data = {
+        'message': f'Image segmented into {n_labels} regions using {segmentation_method}',
+        'segmentation_method': segmentation_method,
+        'num_segments': n_labels,
+        'mask_format': mask_format,
+        'segments': segment_masks
+    }
+    if mask_format == 'label_map':
+        # Lossless PNG whose pixel values are segment ids (0 = none)
+        response_data['label_map'] = EncodedImage.from_array(labels, 'PNG')
+    return response_data
+
+
+@analysis_mode('gmm_quantization')
+def gmm_quantization_mode(analysis):
+    n_components = analysis.data['n_components']
+    covariance_type = analysis.data['covariance_type']
+
+    # Apply GMM-based quantization
+    quant_bgr, palette = image_executor.run(
+        gmm_quantize_colors, analysis.image, n_components=n_components, covariance_type=covariance_type
+    )
+
+    return {
+        'message': f'GMM quantization to {n_components} components completed',
+        'quantized_image': analysis.encode(analysis.restore(quant_bgr)),
+        'palette': palette,
+        'n_components': n_components,
+        'covariance_type': covariance_type
+    }
+
+
+@analysis_mode('color_name_palette')
+def color_name_palette_mode(analysis):
+    # Only the palette is needed, so no quantized image is built; the
+    # histogram backend is the default here since it never labels pixels
+    palette_size = analysis.data['palette_size']
+    palette_options = dict(analysis.kmeans_options, backend=analysis.data.get('clustering_backend') or 'histogram')
+    palette = image_executor.run(extract_palette, analysis.image, k=palette_size, **palette_options)
+
+    # Assign nearest color names
+    dictionary = analysis.data.get('color_dictionary', DEFAULT_COLOR_DICTIONARY)
+    enriched = assign_color_names(palette, dictionary)
+
+    return {
+        'message': 'Color names assigned to palette successfully',
+        'palette': enriched,
+        'palette_size': palette_size,
+        'color_dictionary': dictionary
+    }
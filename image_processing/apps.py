@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ImageProcessingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'image_processing'
+
+    def ready(self):
+        from PIL import Image
+
+        from .utils import get_upload_settings
+
+        # Large scans are processed in strips (see tiling), so Pillow's own
+        # bomb check must not reject them below the configured limit; the
+        # limit itself is enforced explicitly (utils.check_pixel_limit)
+        Image.MAX_IMAGE_PIXELS = get_upload_settings()['MAX_PIXELS']
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .buffers import buffer_pool
+from .utils import (
+    ENCODE_FORMATS,
+    apply_multiple_effects,
+    check_pixel_limit,
+    decode_image_bytes,
+    encode_image,
+    get_upload_settings,
+    image_dimensions,
+    read_image_bytes,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SETTINGS = {
+    # Threads shared by all batch requests; OpenCV releases the GIL while it works
+    'MAX_WORKERS': None,
+    # Images accepted per batch (uploads plus archive members)
+    'MAX_FILES': 500,
+    # Size of an uploaded ZIP archive; each member is also held to the upload MAX_BYTES
+    'MAX_ARCHIVE_BYTES': 256 * 1024 * 1024,
+}
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def get_batch_settings():
+    return {**DEFAULT_BATCH_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_BATCH', {})}
+
+
+def get_batch_workers():
+    return get_batch_settings()['MAX_WORKERS'] or os.cpu_count() or 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_batch_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=get_batch_workers(), thread_name_prefix='image-batch')
+        return _pool
+
+
+def iter_batch_sources(images=(), archive=None):
+    """
+    Yield (name, read) for every image of a batch, where read() returns its bytes.
+    Archive members are read one at a time, only when their turn comes, and
+    never when their uncompressed size is over the upload MAX_BYTES (zipfile
+    stops reading a member at the size its header declares).
+    """
+    for upload in images:
+        yield upload.name, lambda upload=upload: bytes(read_image_bytes(upload))
+
+    if archive is not None:
+        max_bytes = get_upload_settings()['MAX_BYTES']
+
+        def read_member(zf, info):
+            if info.file_size > max_bytes:
+                raise ValueError(f"Image size should not exceed {max_bytes // (1024 * 1024)}MB")
+            return zf.read(info)
+
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or name.startswith('.'):
+                    continue
+                yield info.filename, lambda info=info: read_member(zf, info)
+
+
+def process_batch_image(data, effects, brightness=0, contrast=1.0, format='JPEG'):
+    """Decode one image, apply the effect chain and encode the result"""
+    # Batch inputs are plain files: check the decoded size before allocating it
+    check_pixel_limit(*image_dimensions(data))
+    # Workers reuse the pipeline buffers from one image to the next
+    with buffer_pool.scope():
+        cv2_image = decode_image_bytes(data, keep_gray=True)
+        processed = apply_multiple_effects(cv2_image, effects, brightness, contrast, expand=False)
+        return encode_image(processed, format)
+
+
+class _ZipStream:
+    """Write-only file object that hands back whatever zipfile wrote since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_batch_zip(sources, effects, brightness=0, contrast=1.0, format='JPEG'):
+    """
+    Process a batch on the shared thread pool and yield a ZIP archive chunk by
+    chunk, adding each result as soon as it is ready. At most two images per
+    worker are in flight, so the batch is never held in memory. Failures are
+    recorded in manifest.json, written last, and never abort the batch.
+    """
+    pool = get_batch_pool()
+    window = get_batch_workers() * 2
+    extension = ENCODE_FORMATS[format][0]
+    stream = _ZipStream()
+    zf = zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED)
+    date_time = timezone.localtime().timetuple()[:6]
+    manifest = []
+    used_names = set()
+    pending = {}
+
+    def output_name(source):
+        stem = os.path.splitext(os.path.basename(source))[0] or 'image'
+        name, counter = f'{stem}{extension}', 1
+        while name in used_names:
+            counter += 1
+            name = f'{stem}_{counter}{extension}'
+        used_names.add(name)
+        return name
+
+    def collect(done):
+        for future in done:
+            entry = pending.pop(future)
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.warning(f"Batch image {entry['source']} failed: {str(e)}")
+                entry.update(status='failed', error=str(e))
+                continue
+            entry.update(status='ok', output=output_name(entry['source']), size=len(data))
+            zf.writestr(zipfile.ZipInfo(entry['output'], date_time), data)
+
+    try:
+        for index, (source, read) in enumerate(sources):
+            entry = {'index': index, 'source': source}
+            manifest.append(entry)
+            try:
+                future = pool.submit(process_batch_image, read(), effects, brightness, contrast, format)
+            except Exception as e:
+                entry.update(status='failed', error=str(e))
+                continue
+            pending[future] = entry
+
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+                yield stream.drain()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+            yield stream.drain()
+
+        failed = sum(1 for entry in manifest if entry['status'] == 'failed')
+        zf.writestr(zipfile.ZipInfo(MANIFEST_NAME, date_time), json.dumps({
+            'effects': effects,
+            'settings': {'brightness': brightness, 'contrast': contrast, 'format': format},
+            'total': len(manifest),
+            'succeeded': len(manifest) - failed,
+            'failed': failed,
+            'items': manifest,
+        }, indent=2))
+        zf.close()
+        yield stream.drain()
+    finally:
+        # Client went away or the archive could not be read: drop queued work
+        for future in pending:
+            future.cancel()
+
+
+async def aiter_chunks(chunks):
+    """
+    Async iterator over a blocking chunk iterator, each chunk produced in a
+    worker thread. Under ASGI, StreamingHttpResponse reads a sync iterator to
+    the end before sending anything; an async one is sent chunk by chunk.
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    done = object()
+    try:
+        while True:
+            chunk = await next_chunk(chunks, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        # Client went away: let the generator cancel its queued work
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=False)()
@@ -0,0 +1,289 @@
+"""
+Benchmarks for image_processing: every image-level function in utils on
+synthetic images of several sizes, and end-to-end requests through the
+Django test client for every endpoint and color-analysis mode.
+
+Each case reports latency percentiles, throughput and peak traced memory
+(tracemalloc: numpy arrays, including OpenCV outputs, but not OpenCV's
+internal scratch buffers). Results can be saved as a JSON baseline and
+compared against it; see the benchmark_image_processing command.
+"""
+import json
+import platform
+import re
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .cache import get_cache_settings
+from .masks import rle_encode
+from .utils import get_upload_settings
+from .utils import (
+    adjust_brightness_contrast,
+    apply_clahe,
+    apply_grayscale,
+    apply_histogram_equalization,
+    apply_multiple_effects,
+    apply_negative,
+    convert_to_hsv_channels,
+    create_color_mask,
+    decode_image_bytes,
+    detect_color_regions,
+    encode_image,
+    extract_palette,
+    get_dominant_colors,
+    gmm_quantize_colors,
+    make_proxy,
+    quantize_colors,
+    segment_labels,
+)
+
+# Benchmark image sizes as (height, width), named by megapixels
+SIZES = {
+    '0.3': (480, 640),
+    '2': (1224, 1632),
+    '12': (3000, 4000),
+    '48': (6000, 8000),
+}
+
+DEFAULT_REPEAT = 5
+DEFAULT_WARMUP = 1
+# A case regresses when a metric grows by more than this fraction
+DEFAULT_THRESHOLD = 0.25
+# Metrics compared against the baseline
+COMPARED_METRICS = ('p50_ms', 'peak_mb')
+# Below this, run-to-run noise dominates and latency is not compared
+MIN_COMPARED_MS = 1.0
+
+
+def synthetic_image(height, width, seed=0):
+    """Photo-like BGR test image: smooth colour regions with mild noise"""
+    rng = np.random.RandomState(seed)
+    coarse = rng.randint(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.randint(-8, 9, (height, width, 1), dtype=np.int16)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def function_cases():
+    """(name, func(image, encoded_jpeg)) for every image-level function in utils"""
+    return [
+        ('decode_image_bytes', lambda image, data: decode_image_bytes(data)),
+        ('encode_image_jpeg', lambda image, data: encode_image(image, 'JPEG')),
+        ('encode_image_png', lambda image, data: encode_image(image, 'PNG')),
+        ('apply_grayscale', lambda image, data: apply_grayscale(image)),
+        ('apply_negative', lambda image, data: apply_negative(image)),
+        ('adjust_brightness_contrast', lambda image, data: adjust_brightness_contrast(image, 20, 1.2)),
+        ('convert_to_hsv_channels', lambda image, data: convert_to_hsv_channels(image)),
+        ('apply_histogram_equalization', lambda image, data: apply_histogram_equalization(image)),
+        ('apply_clahe', lambda image, data: apply_clahe(image)),
+        ('apply_multiple_effects', lambda image, data: apply_multiple_effects(
+            image, ['grayscale', 'brightness', 'contrast', 'histogram_eq'], 20, 1.2
+        )),
+        ('make_proxy', lambda image, data: make_proxy(image, 250000)),
+        ('get_dominant_colors', lambda image, data: get_dominant_colors(image, 5)),
+        ('get_dominant_colors_histogram', lambda image, data: get_dominant_colors(image, 5, backend='histogram')),
+        ('extract_palette', lambda image, data: extract_palette(image, 8)),
+        ('detect_color_regions', lambda image, data: detect_color_regions(image, [200, 60, 60], 40)),
+        ('quantize_colors', lambda image, data: quantize_colors(image, 8)),
+        ('create_color_mask', lambda image, data: create_color_mask(
+            image, {'lower': [0, 50, 50], 'upper': [20, 255, 255]}
+        )),
+        ('segment_kmeans', lambda image, data: segment_labels(image, 5, 'kmeans')),
+        ('segment_watershed', lambda image, data: segment_labels(image, 5, 'watershed')),
+        ('gmm_quantize_colors', lambda image, data: gmm_quantize_colors(image, 8)),
+        ('rle_encode', lambda image, data: rle_encode(image[:, :, 2] > 128)),
+    ]
+
+
+COLOR_ANALYSIS_PARAMS = {
+    'dominant_colors': {'num_colors': 5},
+    'color_detection': {'target_color': '#C83C3C', 'tolerance': 40},
+    'color_quantization': {'quantization_levels': 8},
+    'color_mask': {'color_space': 'HSV', 'lower_range': [0, 50, 50], 'upper_range': [20, 255, 255]},
+    'multi_segment': {'num_segments': 5},
+    'gmm_quantization': {'n_components': 8},
+    'color_name_palette': {'palette_size': 8},
+}
+
+
+def endpoint_cases():
+    """(name, path, extra form data) for every image endpoint and color-analysis mode"""
+    cases = [
+        ('grayscale', 'grayscale/', {}),
+        ('negative', 'negative/', {}),
+        ('brightness_contrast', 'brightness-contrast/', {'brightness': 20, 'contrast': 1.2}),
+        ('hsv_channels', 'hsv-channels/', {'channel': 'all'}),
+        ('histogram_equalization', 'histogram-equalization/', {}),
+        ('multiple_effects', 'multiple-effects/', {'effects': ['grayscale', 'brightness', 'histogram_eq']}),
+        ('download', 'download/', {'effects': ['negative']}),
+        ('batch', 'batch/', {'effects': ['negative'], 'batch_size': 4}),
+    ]
+    for mode, params in COLOR_ANALYSIS_PARAMS.items():
+        cases.append((f'color_analysis_{mode}', 'color-analysis/', dict(params, mode=mode)))
+    return cases
+
+
+def measure(func, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP, pixels=None):
+    """
+    Time func() repeat times after warmup calls, then run it once more
+    under tracemalloc for its peak memory.
+    Returns: latency percentiles (ms), throughput and peak_mb
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings_ms = np.array(timings) * 1000
+    p50 = float(np.percentile(timings_ms, 50))
+    result = {
+        'runs': repeat,
+        'p50_ms': round(p50, 3),
+        'p90_ms': round(float(np.percentile(timings_ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(timings_ms, 99)), 3),
+        'mean_ms': round(float(timings_ms.mean()), 3),
+        'ops_per_s': round(1000 / p50, 3) if p50 else None,
+        'peak_mb': round(peak / (1024 * 1024), 3),
+    }
+    if pixels:
+        result['mpix_per_s'] = round(pixels / 1e6 * 1000 / p50, 3) if p50 else None
+    return result
+
+
+def _multipart(data, upload, batch_size):
+    def make_upload(index=0):
+        return SimpleUploadedFile(f'bench_{index}.jpg', upload, content_type='image/jpeg')
+
+    if batch_size:
+        return dict(data, images=[make_upload(index) for index in range(batch_size)])
+    return dict(data, image=make_upload())
+
+
+def _request(client, path, data, upload):
+    data = dict(data)
+    batch_size = data.pop('batch_size', None)
+    response = client.post(
+        f'/api/image-processing/{path}', _multipart(data, upload, batch_size), format='multipart'
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f'{path} returned {response.status_code}: {response.content[:200]!r}')
+    # Consume streamed and rendered content so the whole response is timed
+    if response.streaming:
+        b''.join(response.streaming_content)
+    else:
+        response.content
+
+
+def run_benchmarks(sizes=tuple(SIZES), repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP, pattern=None,
+                   functions=True, endpoints=True, log=None):
+    """
+    Run the selected cases and return {case name: measurements}.
+    Case names are 'function:<name>@<size>MP' and 'endpoint:<name>@<size>MP';
+    pattern (regex) keeps only matching cases.
+    The result cache is disabled and the upload limits lifted while running.
+    """
+    selected = re.compile(pattern) if pattern else None
+    results = {}
+    cache_settings = dict(get_cache_settings(), ENABLED=False)
+    upload_settings = dict(get_upload_settings(), MAX_BYTES=1 << 40)
+
+    with override_settings(IMAGE_PROCESSING_CACHE=cache_settings, IMAGE_PROCESSING_UPLOADS=upload_settings):
+        client = APIClient()
+        for size in sizes:
+            height, width = SIZES[size]
+            image = synthetic_image(height, width)
+            upload = encode_image(image, 'JPEG')
+            cases = []
+            if functions:
+                cases += [
+                    (f'function:{name}@{size}MP', lambda func=func: func(image, upload), 1)
+                    for name, func in function_cases()
+                ]
+            if endpoints:
+                cases += [
+                    (f'endpoint:{name}@{size}MP', lambda path=path, data=data: _request(client, path, data, upload),
+                     data.get('batch_size', 1))
+                    for name, path, data in endpoint_cases()
+                ]
+
+            for name, func, images in cases:
+                if selected and not selected.search(name):
+                    continue
+                results[name] = dict(measure(func, repeat, warmup, height * width * images), size_mp=size)
+                if log:
+                    log(name, results[name])
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'debug': settings.DEBUG,
+    }
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump({
+            'created_at': timezone.now().isoformat(),
+            'environment': environment(),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD, metrics=COMPARED_METRICS):
+    """
+    Cases whose metrics grew by more than threshold (a fraction) over the baseline.
+    Cases missing from either side are ignored; latencies under
+    MIN_COMPARED_MS are too noisy to compare.
+    Returns: list of {case, metric, baseline, current, change}
+    """
+    regressions = []
+    for case, current in sorted(results.items()):
+        previous = baseline.get(case)
+        if not previous:
+            continue
+        for metric in metrics:
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            if metric.endswith('_ms') and before < MIN_COMPARED_MS:
+                continue
+            change = (after - before) / before
+            if change > threshold:
+                regressions.append({
+                    'case': case,
+                    'metric': metric,
+                    'baseline': before,
+                    'current': after,
+                    'change': round(change, 4),
+                })
+    return regressions
@@ -0,0 +1,148 @@
+"""
+Per-process pool of reusable image buffers.
+
+Effect pipelines write their intermediates and results into buffers taken
+from the pool (OpenCV `dst=` arguments, NumPy `out=`) instead of allocating
+a fresh full-frame array per step. Buffers are lent for the duration of a
+scope: image views open one per request, so everything taken while handling
+it goes back to the pool once the response has been rendered, and the next
+request of the same size reuses the memory instead of growing the heap.
+
+Outside a scope (management commands, tests, pool workers) acquire() simply
+allocates, so results can be kept without restriction. Inside a scope a
+buffer must not outlive it: encode results before the scope ends.
+"""
+import contextvars
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_BUFFER_POOL_SETTINGS = {
+    'ENABLED': True,
+    # Bytes of idle buffers kept per process; least recently used sizes go first
+    'MAX_BYTES': 192 * 1024 * 1024,
+    # Smaller arrays are cheap to allocate and never pooled
+    'MIN_BYTES': 64 * 1024,
+}
+
+
+def get_buffer_pool_settings():
+    return {**DEFAULT_BUFFER_POOL_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_BUFFER_POOL', {})}
+
+
+_current_scope = contextvars.ContextVar('image_processing_buffer_scope', default=None)
+
+
+class BufferPool:
+    """Thread-safe free lists of arrays keyed by (shape, dtype)"""
+
+    def __init__(self):
+        self._free = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.bytes_held = 0
+        self.bytes_in_use = 0
+
+    @property
+    def config(self):
+        return get_buffer_pool_settings()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """An uninitialised array of shape and dtype, lent until the active scope ends"""
+        shape = tuple(int(size) for size in shape)
+        dtype = np.dtype(dtype)
+        scope = _current_scope.get()
+        config = self.config
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if scope is None or not config['ENABLED'] or nbytes < config['MIN_BYTES']:
+            return np.empty(shape, dtype=dtype)
+
+        key = (shape, dtype.str)
+        with self._lock:
+            free = self._free.get(key)
+            array = free.pop() if free else None
+            if array is not None:
+                self.hits += 1
+                self.bytes_held -= nbytes
+                if not free:
+                    del self._free[key]
+            else:
+                self.misses += 1
+            self.bytes_in_use += nbytes
+        if array is None:
+            array = np.empty(shape, dtype=dtype)
+        scope.append(array)
+        return array
+
+    def release(self, array):
+        """Give a buffer of the active scope back early; anything else is ignored"""
+        scope = _current_scope.get()
+        if scope is None:
+            return
+        for index, held in enumerate(scope):
+            if held is array:
+                del scope[index]
+                self._put(array)
+                return
+
+    @contextmanager
+    def scope(self):
+        """Lend buffers to the enclosed block and take them all back when it ends"""
+        scope = []
+        token = _current_scope.set(scope)
+        try:
+            yield
+        finally:
+            _current_scope.reset(token)
+            for array in scope:
+                self._put(array)
+
+    def _put(self, array):
+        key = (array.shape, array.dtype.str)
+        max_bytes = self.config['MAX_BYTES']
+        with self._lock:
+            self.bytes_in_use -= array.nbytes
+            if array.nbytes > max_bytes:
+                self.dropped += 1
+                return
+            # Make room by dropping idle buffers of the least recently used sizes
+            while self.bytes_held + array.nbytes > max_bytes:
+                old_key, free = next(iter(self._free.items()))
+                self.bytes_held -= free.pop(0).nbytes
+                self.dropped += 1
+                if not free:
+                    del self._free[old_key]
+            self._free.setdefault(key, []).append(array)
+            self._free.move_to_end(key)
+            self.bytes_held += array.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self.hits = 0
+            self.misses = 0
+            self.dropped = 0
+            self.bytes_held = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            stats = {
+                'hits': hits,
+                'misses': misses,
+                'dropped': self.dropped,
+                'buffers_held': sum(len(free) for free in self._free.values()),
+                'bytes_held': self.bytes_held,
+                'bytes_in_use': self.bytes_in_use,
+            }
+        lookups = hits + misses
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+
+buffer_pool = BufferPool()
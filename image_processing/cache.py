@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS = {
+    'ENABLED': True,
+    'ALIAS': 'image_processing',
+    'TIMEOUT': 60 * 60,
+    # Results bigger than this are never cached
+    'MAX_ENTRY_BYTES': 8 * 1024 * 1024,
+    # Byte budget of the in-process LRU that sits in front of the Django cache
+    'LOCAL_MAX_BYTES': 64 * 1024 * 1024,
+}
+
+
+def get_cache_settings():
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_CACHE', {})}
+
+
+def normalize_params(params):
+    """Make parameters JSON-stable so equivalent values (e.g. 20 and 20.0) share a key"""
+    if isinstance(params, dict):
+        return {str(key): normalize_params(value) for key, value in sorted(params.items())}
+    if isinstance(params, (list, tuple)):
+        return [normalize_params(value) for value in params]
+    if isinstance(params, bool) or params is None:
+        return params
+    if isinstance(params, (int, float)):
+        return float(params)
+    return str(params)
+
+
+def make_cache_key(operation, image_bytes, params):
+    """Content-addressed key: hash of the uploaded bytes, operation and parameters"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(b'\0' + operation.encode())
+    digest.update(b'\0' + json.dumps(normalize_params(params), sort_keys=True).encode())
+    return f'imgproc:{operation}:{digest.hexdigest()}'
+
+
+class LocalLRUCache:
+    """Thread-safe LRU bounded by total bytes, with a per-entry TTL"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            blob, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def set(self, key, blob, timeout):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (blob, time.monotonic() + timeout)
+            self.total_bytes += len(blob)
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        blob, _ = self._entries.pop(key)
+        self.total_bytes -= len(blob)
+
+
+class ResultCache:
+    """
+    Two-tier cache for processed results.
+    Entries are pickled once; the blob is kept in a size-aware in-process LRU
+    and in the Django cache alias (Redis in production) so other pods share it.
+    """
+
+    def __init__(self):
+        self._local = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def config(self):
+        return get_cache_settings()
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = LocalLRUCache(self.config['LOCAL_MAX_BYTES'])
+        return self._local
+
+    @property
+    def backend(self):
+        return caches[self.config['ALIAS']]
+
+    def get(self, key):
+        blob = self.local.get(key)
+        if blob is None:
+            try:
+                blob = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Image result cache unavailable: {str(e)}")
+                blob = None
+            if blob is not None:
+                self.local.set(key, blob, self.config['TIMEOUT'])
+
+        self._count(hit=blob is not None)
+        return pickle.loads(blob) if blob is not None else None
+
+    def set(self, key, result):
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        config = self.config
+        if len(blob) > config['MAX_ENTRY_BYTES']:
+            return
+        self.local.set(key, blob, config['TIMEOUT'])
+        try:
+            self.backend.set(key, blob, timeout=config['TIMEOUT'])
+        except Exception as e:
+            logger.warning(f"Image result cache unavailable: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'local_entries': len(self.local),
+            'local_bytes': self.local.total_bytes,
+        }
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+result_cache = ResultCache()
@@ -0,0 +1,210 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# CSS3 basic color set (the original 20-entry dictionary)
+CSS3_COLORS = [
+    ("black", [0, 0, 0]), ("white", [255, 255, 255]), ("red", [255, 0, 0]),
+    ("lime", [0, 255, 0]), ("blue", [0, 0, 255]), ("yellow", [255, 255, 0]),
+    ("cyan", [0, 255, 255]), ("magenta", [255, 0, 255]), ("silver", [192, 192, 192]),
+    ("gray", [128, 128, 128]), ("maroon", [128, 0, 0]), ("olive", [128, 128, 0]),
+    ("green", [0, 128, 0]), ("purple", [128, 0, 128]), ("teal", [0, 128, 128]),
+    ("navy", [0, 0, 128]), ("orange", [255, 165, 0]), ("pink", [255, 192, 203]),
+    ("brown", [165, 42, 42]), ("gold", [255, 215, 0])
+]
+
+# CSS Color Module Level 4 named colors (aliases such as grey/gray and
+# aqua/cyan share a value; the first name wins on ties)
+CSS4_COLORS = [
+    ("aliceblue", [240, 248, 255]), ("antiquewhite", [250, 235, 215]), ("aqua", [0, 255, 255]),
+    ("aquamarine", [127, 255, 212]), ("azure", [240, 255, 255]), ("beige", [245, 245, 220]),
+    ("bisque", [255, 228, 196]), ("black", [0, 0, 0]), ("blanchedalmond", [255, 235, 205]),
+    ("blue", [0, 0, 255]), ("blueviolet", [138, 43, 226]), ("brown", [165, 42, 42]),
+    ("burlywood", [222, 184, 135]), ("cadetblue", [95, 158, 160]), ("chartreuse", [127, 255, 0]),
+    ("chocolate", [210, 105, 30]), ("coral", [255, 127, 80]), ("cornflowerblue", [100, 149, 237]),
+    ("cornsilk", [255, 248, 220]), ("crimson", [220, 20, 60]), ("cyan", [0, 255, 255]),
+    ("darkblue", [0, 0, 139]), ("darkcyan", [0, 139, 139]), ("darkgoldenrod", [184, 134, 11]),
+    ("darkgray", [169, 169, 169]), ("darkgreen", [0, 100, 0]), ("darkgrey", [169, 169, 169]),
+    ("darkkhaki", [189, 183, 107]), ("darkmagenta", [139, 0, 139]), ("darkolivegreen", [85, 107, 47]),
+    ("darkorange", [255, 140, 0]), ("darkorchid", [153, 50, 204]), ("darkred", [139, 0, 0]),
+    ("darksalmon", [233, 150, 122]), ("darkseagreen", [143, 188, 143]), ("darkslateblue", [72, 61, 139]),
+    ("darkslategray", [47, 79, 79]), ("darkslategrey", [47, 79, 79]), ("darkturquoise", [0, 206, 209]),
+    ("darkviolet", [148, 0, 211]), ("deeppink", [255, 20, 147]), ("deepskyblue", [0, 191, 255]),
+    ("dimgray", [105, 105, 105]), ("dimgrey", [105, 105, 105]), ("dodgerblue", [30, 144, 255]),
+    ("firebrick", [178, 34, 34]), ("floralwhite", [255, 250, 240]), ("forestgreen", [34, 139, 34]),
+    ("fuchsia", [255, 0, 255]), ("gainsboro", [220, 220, 220]), ("ghostwhite", [248, 248, 255]),
+    ("gold", [255, 215, 0]), ("goldenrod", [218, 165, 32]), ("gray", [128, 128, 128]),
+    ("green", [0, 128, 0]), ("greenyellow", [173, 255, 47]), ("grey", [128, 128, 128]),
+    ("honeydew", [240, 255, 240]), ("hotpink", [255, 105, 180]), ("indianred", [205, 92, 92]),
+    ("indigo", [75, 0, 130]), ("ivory", [255, 255, 240]), ("khaki", [240, 230, 140]),
+    ("lavender", [230, 230, 250]), ("lavenderblush", [255, 240, 245]), ("lawngreen", [124, 252, 0]),
+    ("lemonchiffon", [255, 250, 205]), ("lightblue", [173, 216, 230]), ("lightcoral", [240, 128, 128]),
+    ("lightcyan", [224, 255, 255]), ("lightgoldenrodyellow", [250, 250, 210]), ("lightgray", [211, 211, 211]),
+    ("lightgreen", [144, 238, 144]), ("lightgrey", [211, 211, 211]), ("lightpink", [255, 182, 193]),
+    ("lightsalmon", [255, 160, 122]), ("lightseagreen", [32, 178, 170]), ("lightskyblue", [135, 206, 250]),
+    ("lightslategray", [119, 136, 153]), ("lightslategrey", [119, 136, 153]), ("lightsteelblue", [176, 196, 222]),
+    ("lightyellow", [255, 255, 224]), ("lime", [0, 255, 0]), ("limegreen", [50, 205, 50]),
+    ("linen", [250, 240, 230]), ("magenta", [255, 0, 255]), ("maroon", [128, 0, 0]),
+    ("mediumaquamarine", [102, 205, 170]), ("mediumblue", [0, 0, 205]), ("mediumorchid", [186, 85, 211]),
+    ("mediumpurple", [147, 112, 219]), ("mediumseagreen", [60, 179, 113]), ("mediumslateblue", [123, 104, 238]),
+    ("mediumspringgreen", [0, 250, 154]), ("mediumturquoise", [72, 209, 204]), ("mediumvioletred", [199, 21, 133]),
+    ("midnightblue", [25, 25, 112]), ("mintcream", [245, 255, 250]), ("mistyrose", [255, 228, 225]),
+    ("moccasin", [255, 228, 181]), ("navajowhite", [255, 222, 173]), ("navy", [0, 0, 128]),
+    ("oldlace", [253, 245, 230]), ("olive", [128, 128, 0]), ("olivedrab", [107, 142, 35]),
+    ("orange", [255, 165, 0]), ("orangered", [255, 69, 0]), ("orchid", [218, 112, 214]),
+    ("palegoldenrod", [238, 232, 170]), ("palegreen", [152, 251, 152]), ("paleturquoise", [175, 238, 238]),
+    ("palevioletred", [219, 112, 147]), ("papayawhip", [255, 239, 213]), ("peachpuff", [255, 218, 185]),
+    ("peru", [205, 133, 63]), ("pink", [255, 192, 203]), ("plum", [221, 160, 221]),
+    ("powderblue", [176, 224, 230]), ("purple", [128, 0, 128]), ("rebeccapurple", [102, 51, 153]),
+    ("red", [255, 0, 0]), ("rosybrown", [188, 143, 143]), ("royalblue", [65, 105, 225]),
+    ("saddlebrown", [139, 69, 19]), ("salmon", [250, 128, 114]), ("sandybrown", [244, 164, 96]),
+    ("seagreen", [46, 139, 87]), ("seashell", [255, 245, 238]), ("sienna", [160, 82, 45]),
+    ("silver", [192, 192, 192]), ("skyblue", [135, 206, 235]), ("slateblue", [106, 90, 205]),
+    ("slategray", [112, 128, 144]), ("slategrey", [112, 128, 144]), ("snow", [255, 250, 250]),
+    ("springgreen", [0, 255, 127]), ("steelblue", [70, 130, 180]), ("tan", [210, 180, 140]),
+    ("teal", [0, 128, 128]), ("thistle", [216, 191, 216]), ("tomato", [255, 99, 71]),
+    ("turquoise", [64, 224, 208]), ("violet", [238, 130, 238]), ("wheat", [245, 222, 179]),
+    ("white", [255, 255, 255]), ("whitesmoke", [245, 245, 245]), ("yellow", [255, 255, 0]),
+    ("yellowgreen", [154, 205, 50])
+]
+
+# Colours looked up per distance computation; bounds the (chunk x entries)
+# distance matrix when naming every pixel of a large image
+_LOOKUP_CHUNK = 1 << 16
+
+
+def rgb_to_lab(rgb):
+    """
+    Convert any array of RGB triplets (..., 3) to OpenCV 8-bit Lab (float32)
+    with a single cvtColor call.
+    """
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    lab = cv2.cvtColor(rgb.reshape(-1, 1, 3), cv2.COLOR_RGB2LAB)
+    return lab.reshape(rgb.shape).astype(np.float32)
+
+
+class ColorNameIndex:
+    """
+    Named-colour dictionary with Lab coordinates computed once.
+    lookup() names any number of colours in one vectorized distance
+    computation (Euclidean distance in Lab), so the per-request cost does not
+    depend on how the index was built, only on the number of colours named.
+    """
+
+    def __init__(self, entries):
+        if not entries:
+            raise ValueError("A color name index needs at least one entry")
+        self.names = [name for name, _ in entries]
+        self.rgb = np.array([rgb for _, rgb in entries], dtype=np.uint8)
+        self.lab = rgb_to_lab(self.rgb)
+        self._lab_sq = np.einsum('ij,ij->i', self.lab, self.lab)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load a 'name<TAB>#rrggbb' file (e.g. the XKCD rgb.txt survey list).
+        Lines that are not a name followed by a #rrggbb value are skipped.
+        """
+        entries = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().rsplit(None, 1)
+                if len(parts) != 2 or not parts[1].startswith('#') or len(parts[1]) != 7:
+                    continue
+                try:
+                    rgb = [int(parts[1][i:i + 2], 16) for i in (1, 3, 5)]
+                except ValueError:
+                    continue
+                entries.append((parts[0].strip(), rgb))
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, rgb):
+        """
+        Nearest entry for every RGB triplet in rgb (..., 3).
+        Large inputs (whole images) are reduced to their distinct colours first.
+        Returns: entry indices (int32) and Lab distances (float32), shaped rgb.shape[:-1]
+        """
+        rgb = np.asarray(rgb, dtype=np.uint8)
+        shape = rgb.shape[:-1]
+        rgb = rgb.reshape(-1, 3)
+        if len(rgb) > _LOOKUP_CHUNK:
+            packed = (rgb[:, 0].astype(np.int32) << 16) | (rgb[:, 1].astype(np.int32) << 8) | rgb[:, 2]
+            distinct, inverse = np.unique(packed, return_inverse=True)
+            distinct_rgb = np.stack([distinct >> 16, (distinct >> 8) & 0xFF, distinct & 0xFF], axis=1)
+            indices, distances = self._lookup_lab(rgb_to_lab(distinct_rgb))
+            return indices[inverse].reshape(shape), distances[inverse].reshape(shape)
+
+        indices, distances = self._lookup_lab(rgb_to_lab(rgb))
+        return indices.reshape(shape), distances.reshape(shape)
+
+    def _lookup_lab(self, lab):
+        indices = np.empty(len(lab), dtype=np.int32)
+        distances = np.empty(len(lab), dtype=np.float32)
+        for start in range(0, len(lab), _LOOKUP_CHUNK):
+            chunk = lab[start:start + _LOOKUP_CHUNK]
+            # |a - b|^2 = |a|^2 - 2ab + |b|^2, one matrix product per chunk
+            sq = np.einsum('ij,ij->i', chunk, chunk)[:, None] - 2 * chunk @ self.lab.T + self._lab_sq
+            nearest = np.argmin(sq, axis=1)
+            indices[start:start + len(chunk)] = nearest
+            distances[start:start + len(chunk)] = np.sqrt(np.maximum(sq[np.arange(len(chunk)), nearest], 0))
+        return indices, distances
+
+    def nearest(self, rgb):
+        """Name of the closest entry for one [r, g, b] colour"""
+        indices, distances = self.lookup([rgb])
+        return {'name': self.names[indices[0]], 'distance': float(distances[0])}
+
+    def name_palette(self, palette):
+        """
+        Given a palette list [{'color_rgb': [r,g,b], 'color_hex': '#xxxxxx', ...}],
+        return copies with nearest_name and name_distance added.
+        """
+        if not palette:
+            return []
+        indices, distances = self.lookup([item['color_rgb'] for item in palette])
+        return [
+            dict(item, nearest_name=self.names[index], name_distance=float(distance))
+            for item, index, distance in zip(palette, indices, distances)
+        ]
+
+
+# Built-in dictionaries are indexed at import; extra ones come from
+# settings.IMAGE_PROCESSING_COLOR_NAMES = {'xkcd': '/path/to/rgb.txt'} and
+# are loaded once, on first use
+COLOR_INDEXES = {
+    'css3': ColorNameIndex(CSS3_COLORS),
+    'css4': ColorNameIndex(CSS4_COLORS),
+}
+DEFAULT_COLOR_DICTIONARY = 'css3'
+
+_indexes_lock = threading.Lock()
+
+
+def available_color_dictionaries():
+    return list(COLOR_INDEXES) + [
+        name for name in getattr(settings, 'IMAGE_PROCESSING_COLOR_NAMES', {}) if name not in COLOR_INDEXES
+    ]
+
+
+def get_color_index(name=DEFAULT_COLOR_DICTIONARY):
+    """Return the ColorNameIndex registered as name, loading file-based ones on first use"""
+    index = COLOR_INDEXES.get(name)
+    if index is not None:
+        return index
+
+    path = getattr(settings, 'IMAGE_PROCESSING_COLOR_NAMES', {}).get(name)
+    if path is None:
+        raise ValueError(f"Unknown color dictionary: {name}")
+    with _indexes_lock:
+        if name not in COLOR_INDEXES:
+            COLOR_INDEXES[name] = ColorNameIndex.from_file(path)
+            logger.info(f"Loaded color dictionary {name} ({len(COLOR_INDEXES[name])} entries)")
+    return COLOR_INDEXES[name]
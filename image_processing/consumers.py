@@ -0,0 +1,66 @@
+import logging
+from urllib.parse import parse_qs
+
+from channels.consumer import SyncConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+
+from .jobs import job_group_name, run_job
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+class ImageJobWorker(SyncConsumer):
+    """Process queued image jobs: python manage.py runworker image-processing-jobs"""
+
+    def job_run(self, message):
+        run_job(message['job_id'])
+
+
+@database_sync_to_async
+def get_user_from_token(token):
+    """Resolve a DRF token or a JWT access token to a user"""
+    from rest_framework.authtoken.models import Token
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    try:
+        return Token.objects.select_related('user').get(key=token).user
+    except Token.DoesNotExist:
+        pass
+    try:
+        return User.objects.get(id=AccessToken(token)['user_id'])
+    except (TokenError, KeyError, User.DoesNotExist):
+        return AnonymousUser()
+
+
+class ImageJobConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Push job status events to their owner.
+    Connect to ws/image-jobs/?token=<token>; session users need no token.
+    """
+
+    async def connect(self):
+        self.group_name = None
+        user = self.scope.get('user') or AnonymousUser()
+        token = parse_qs(self.scope.get('query_string', b'').decode()).get('token')
+        if token:
+            user = await get_user_from_token(token[0])
+
+        if not user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = job_group_name(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def job_status(self, event):
+        await self.send_json({'type': 'job.status', **event['job']})
@@ -0,0 +1,233 @@
+"""
+Server-side editing sessions for interactive adjustments (sliders).
+
+The image is uploaded and decoded once; the session keeps the decoded
+array plus one preview level of its pyramid (halved with cv2.pyrDown until
+it fits PREVIEW_MAX_PIXELS). Slider moves then send only parameters and
+get the effect chain applied to the small preview; a final render applies
+it to the full-resolution image.
+
+Sessions are stored in the shared Django cache (Redis when REDIS_URL is
+set), keyed by session id: a small record, the uploaded file as sent and
+the preview level encoded as PNG, all expiring TTL seconds after their
+last use. Any server process can therefore serve any session. Each
+process also keeps the decoded images of the sessions it used recently in
+an LRU bounded by total bytes and count, so only its first request for a
+session decodes the image. Clients create a new session whenever they get
+a 404.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import cv2
+from django.conf import settings
+from django.core.cache import caches
+
+from .utils import decode_image_bytes, encode_image
+
+DEFAULT_SESSION_SETTINGS = {
+    'CACHE_ALIAS': 'image_processing',
+    # Bytes of decoded images (full size plus preview) kept per process
+    'MAX_BYTES': 512 * 1024 * 1024,
+    # Sessions whose decoded images are kept per process
+    'MAX_SESSIONS': 64,
+    # Seconds a session is kept after its last use
+    'TTL': 15 * 60,
+    # Pixel budget of the preview level (about 1 MP)
+    'PREVIEW_MAX_PIXELS': 1 << 20,
+}
+
+
+def get_session_settings():
+    return {**DEFAULT_SESSION_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_SESSIONS', {})}
+
+
+class SessionTooLarge(ValueError):
+    pass
+
+
+def build_preview(cv2_image, max_pixels):
+    """Pyramid level of cv2_image with at most max_pixels pixels (the image itself if it already fits)"""
+    preview = cv2_image
+    while preview.shape[0] * preview.shape[1] > max_pixels and min(preview.shape[:2]) > 1:
+        preview = cv2.pyrDown(preview)
+    return preview
+
+
+class EditingSession:
+    def __init__(self, session_id, owner_id, image, preview):
+        self.id = session_id
+        self.owner_id = owner_id
+        # Shared by concurrent requests of the session: never written to
+        image.flags.writeable = False
+        preview.flags.writeable = False
+        self.image = image
+        self.preview = preview
+        self.nbytes = image.nbytes + (preview.nbytes if preview is not image else 0)
+        self.expires_at = None
+
+    def describe(self):
+        return {
+            'session_id': self.id,
+            'width': self.image.shape[1],
+            'height': self.image.shape[0],
+            'channels': 1 if self.image.ndim == 2 else self.image.shape[2],
+            'preview_width': self.preview.shape[1],
+            'preview_height': self.preview.shape[0],
+        }
+
+
+class EditingSessionStore:
+    """
+    Editing sessions in the shared cache, with the decoded images of recently
+    used ones kept in a thread-safe per-process LRU (bounded by total bytes
+    and count, expiring with the session's sliding TTL)
+    """
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evicted = 0
+
+    @property
+    def config(self):
+        return get_session_settings()
+
+    @property
+    def cache(self):
+        return caches[self.config['CACHE_ALIAS']]
+
+    def create(self, cv2_image, owner_id=None, source=None):
+        """
+        Store a new session for cv2_image. source: the encoded file it was
+        decoded from (decode_image_bytes with keep_gray), stored as is; the
+        image is encoded as PNG when not given.
+        """
+        config = self.config
+        preview = build_preview(cv2_image, config['PREVIEW_MAX_PIXELS'])
+        session = EditingSession(uuid.uuid4().hex, owner_id, cv2_image, preview)
+        if session.nbytes > config['MAX_BYTES']:
+            raise SessionTooLarge(
+                f"Image is too large for an editing session (limit {config['MAX_BYTES'] // (1024 * 1024)}MB decoded)"
+            )
+
+        record = {'id': session.id, 'owner_id': owner_id, 'has_preview': preview is not cv2_image}
+        entries = {
+            self._session_key(session.id): record,
+            self._source_key(session.id): bytes(source) if source is not None else encode_image(cv2_image, 'PNG'),
+        }
+        if record['has_preview']:
+            # Lossless, so every process previews the same pixels
+            entries[self._preview_key(session.id)] = encode_image(preview, 'PNG')
+        self.cache.set_many(entries, timeout=config['TTL'])
+        self._keep(session)
+        return session
+
+    def get(self, session_id, owner_id=None):
+        """The session if it exists, has not expired and belongs to owner_id; extends its TTL"""
+        record = self.cache.get(self._session_key(session_id))
+        if record is None or record['owner_id'] != owner_id:
+            return None
+        ttl = self.config['TTL']
+        for key in self._keys(record):
+            self.cache.touch(key, ttl)
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.expires_at = time.monotonic() + ttl
+                self._sessions.move_to_end(session_id)
+                return session
+
+        # Created or last used by another process: decode it here once
+        session = self._load(record)
+        if session is not None:
+            self._keep(session)
+        return session
+
+    def delete(self, session_id, owner_id=None):
+        record = self.cache.get(self._session_key(session_id))
+        if record is None or record['owner_id'] != owner_id:
+            return False
+        self.cache.delete_many(self._keys(record))
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+        return True
+
+    def clear(self):
+        """Forget the decoded images held by this process (the shared cache is left as is)"""
+        with self._lock:
+            self._sessions.clear()
+            self.total_bytes = 0
+            self.evicted = 0
+
+    def stats(self):
+        with self._lock:
+            self._purge_expired()
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self.total_bytes,
+                'evicted': self.evicted,
+            }
+
+    def _load(self, record):
+        blobs = self.cache.get_many(self._keys(record)[1:])
+        source = blobs.get(self._source_key(record['id']))
+        preview_blob = blobs.get(self._preview_key(record['id']))
+        if source is None or (record['has_preview'] and preview_blob is None):
+            # Evicted from the shared cache before the record
+            return None
+        image = decode_image_bytes(source, keep_gray=True)
+        preview = decode_image_bytes(preview_blob, keep_gray=True) if record['has_preview'] else image
+        return EditingSession(record['id'], record['owner_id'], image, preview)
+
+    def _keep(self, session):
+        config = self.config
+        with self._lock:
+            self._purge_expired()
+            if session.id in self._sessions:
+                self._remove(session.id)
+            # Least recently used sessions make room for the new one
+            while self._sessions and (
+                self.total_bytes + session.nbytes > config['MAX_BYTES']
+                or len(self._sessions) >= config['MAX_SESSIONS']
+            ):
+                self._remove(next(iter(self._sessions)))
+                self.evicted += 1
+            session.expires_at = time.monotonic() + config['TTL']
+            self._sessions[session.id] = session
+            self.total_bytes += session.nbytes
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for session_id in [key for key, session in self._sessions.items() if session.expires_at < now]:
+            self._remove(session_id)
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= session.nbytes
+
+    def _keys(self, record):
+        keys = [self._session_key(record['id']), self._source_key(record['id'])]
+        if record['has_preview']:
+            keys.append(self._preview_key(record['id']))
+        return keys
+
+    @staticmethod
+    def _session_key(session_id):
+        return f'imgsession:{session_id}'
+
+    @staticmethod
+    def _source_key(session_id):
+        return f'imgsession:{session_id}:source'
+
+    @staticmethod
+    def _preview_key(session_id):
+        return f'imgsession:{session_id}:preview'
+
+
+editing_sessions = EditingSessionStore()
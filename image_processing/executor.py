@@ -0,0 +1,160 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXECUTOR_SETTINGS = {
+    'ENABLED': True,
+    # Worker processes; defaults to the number of CPUs
+    'MAX_WORKERS': None,
+    # Tasks allowed to wait for a worker before new ones are refused
+    'MAX_QUEUE': None,
+    # Seconds to wait for a result, by function name, with a fallback
+    'TIMEOUTS': {'default': 60},
+    'START_METHOD': 'forkserver',
+}
+
+
+class ExecutorBusy(Exception):
+    """Raised when the worker pool queue is full"""
+
+
+class ExecutorTimeout(Exception):
+    """Raised when a task does not finish within its timeout"""
+
+
+def get_executor_settings():
+    return {**DEFAULT_EXECUTOR_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_EXECUTOR', {})}
+
+
+def _init_worker():
+    # One OpenCV thread per worker; parallelism comes from the pool itself
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def _run_on_shared_image(func, shm_name, shape, dtype, args, kwargs):
+    """Worker side: attach to the shared image and run func on it without copying"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = func(image, *args, **kwargs)
+        del image
+        return result
+    finally:
+        shm.close()
+
+
+class ImageTaskExecutor:
+    """
+    Bounded process pool for CPU-heavy image functions.
+    The decoded image is copied once into shared memory and attached by the
+    worker, so the pixels are never pickled. At most MAX_WORKERS + MAX_QUEUE
+    tasks are in flight; beyond that ExecutorBusy is raised immediately.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return get_executor_settings()
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    def run(self, func, cv2_image, *args, **kwargs):
+        """Run func(cv2_image, *args, **kwargs) in the pool and wait for its result"""
+        if not self.enabled:
+            return func(cv2_image, *args, **kwargs)
+
+        pool, slots = self._get_pool()
+        if not slots.acquire(blocking=False):
+            raise ExecutorBusy("Image processing queue is full, try again later")
+
+        shm = None
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(cv2_image.nbytes, 1))
+            shared = np.ndarray(cv2_image.shape, dtype=cv2_image.dtype, buffer=shm.buf)
+            shared[...] = cv2_image
+            del shared
+            future = pool.submit(
+                _run_on_shared_image, func, shm.name, cv2_image.shape, cv2_image.dtype.str, args, kwargs
+            )
+        except BaseException:
+            slots.release()
+            if shm is not None:
+                self._release_shared(shm)
+            raise
+
+        # Free the slot and the shared block only once the worker is done,
+        # even if the caller stopped waiting because of a timeout
+        future.add_done_callback(lambda _: (slots.release(), self._release_shared(shm)))
+
+        timeout = self.get_timeout(func)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise ExecutorTimeout(f"{func.__name__} did not finish within {timeout} seconds")
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise
+
+    def get_timeout(self, func):
+        timeouts = self.config['TIMEOUTS']
+        return timeouts.get(func.__name__, timeouts.get('default'))
+
+    def shutdown(self):
+        atexit.unregister(self.shutdown)
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._slots = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                config = self.config
+                max_workers = config['MAX_WORKERS'] or os.cpu_count() or 1
+                max_queue = config['MAX_QUEUE']
+                if max_queue is None:
+                    max_queue = max_workers * 2
+                context = multiprocessing.get_context(config['START_METHOD'])
+                self._pool = ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=context, initializer=_init_worker
+                )
+                self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+                atexit.register(self.shutdown)
+            return self._pool, self._slots
+
+    def _reset_pool(self, broken_pool):
+        with self._lock:
+            if self._pool is broken_pool:
+                logger.error("Image processing pool broke, starting a new one")
+                self._pool = None
+                self._slots = None
+
+    @staticmethod
+    def _release_shared(shm):
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+image_executor = ImageTaskExecutor()
@@ -0,0 +1,201 @@
+import logging
+import pickle
+import uuid
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .analysis import run_color_analysis
+from .cache import make_cache_key, result_cache
+from .executor import ExecutorBusy
+from .utils import decode_image_bytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_SETTINGS = {
+    # Channel the worker listens on: manage.py runworker image-processing-jobs
+    'CHANNEL': 'image-processing-jobs',
+    'CACHE_ALIAS': 'image_processing',
+    # Seconds a job (its upload, status and result) is kept
+    'TTL': 60 * 60,
+    # Seconds a queued job may wait for a worker; channels_redis drops
+    # unread channel messages after its expiry (60s by default), so a job
+    # still queued after that will never run and is reported as failed
+    'QUEUE_TIMEOUT': 60,
+}
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+def get_job_settings():
+    return {**DEFAULT_JOB_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_JOBS', {})}
+
+
+def job_group_name(user_id):
+    """Channels group that receives job events for one user"""
+    return f'image_jobs_{user_id}'
+
+
+class ImageJobStore:
+    """
+    Job records, uploads and results kept in the Django cache with a TTL.
+    The record is small JSON-like data; the upload and the result live under
+    their own keys so status polling never loads image bytes.
+    """
+
+    @property
+    def cache(self):
+        return caches[get_job_settings()['CACHE_ALIAS']]
+
+    @property
+    def ttl(self):
+        return get_job_settings()['TTL']
+
+    def create(self, user_id, operation, params, image_bytes):
+        now = timezone.now()
+        job = {
+            'id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'operation': operation,
+            'params': params,
+            'status': JOB_QUEUED,
+            'error': None,
+            'created_at': now.isoformat(),
+            'queued_until': (now + timedelta(seconds=get_job_settings()['QUEUE_TIMEOUT'])).isoformat(),
+            'finished_at': None,
+        }
+        self.cache.set(self._image_key(job['id']), bytes(image_bytes), timeout=self.ttl)
+        self.cache.set(self._job_key(job['id']), job, timeout=self.ttl)
+        return job
+
+    def get(self, job_id):
+        job = self.cache.get(self._job_key(job_id))
+        if job is not None and is_stale(job):
+            # No worker took the job before its channel message expired
+            self.delete_image(job_id)
+            job = self.update(
+                job, status=JOB_FAILED, error='No worker picked up the job in time',
+                finished_at=timezone.now().isoformat()
+            )
+        return job
+
+    def update(self, job, **fields):
+        job.update(fields)
+        self.cache.set(self._job_key(job['id']), job, timeout=self.ttl)
+        return job
+
+    def get_image(self, job_id):
+        return self.cache.get(self._image_key(job_id))
+
+    def delete_image(self, job_id):
+        self.cache.delete(self._image_key(job_id))
+
+    def set_result(self, job_id, result):
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        self.cache.set(self._result_key(job_id), blob, timeout=self.ttl)
+
+    def get_result(self, job_id):
+        blob = self.cache.get(self._result_key(job_id))
+        return pickle.loads(blob) if blob is not None else None
+
+    @staticmethod
+    def _job_key(job_id):
+        return f'imgjob:{job_id}'
+
+    @staticmethod
+    def _image_key(job_id):
+        return f'imgjob:{job_id}:image'
+
+    @staticmethod
+    def _result_key(job_id):
+        return f'imgjob:{job_id}:result'
+
+
+job_store = ImageJobStore()
+
+
+def is_stale(job):
+    """Whether a job is still queued after its enqueue deadline"""
+    queued_until = job.get('queued_until')
+    return (
+        job['status'] == JOB_QUEUED and queued_until is not None
+        and datetime.fromisoformat(queued_until) < timezone.now()
+    )
+
+
+def public_job(job):
+    """Job fields that are safe to return to clients"""
+    return {
+        'job_id': job['id'],
+        'operation': job['operation'],
+        'mode': job['params'].get('mode'),
+        'status': job['status'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+    }
+
+
+def submit_color_analysis_job(user_id, params, image_bytes):
+    """Store the upload and queue a color analysis job; returns the job record"""
+    job = job_store.create(user_id, 'color_analysis', params, image_bytes)
+    try:
+        async_to_sync(get_channel_layer().send)(
+            get_job_settings()['CHANNEL'], {'type': 'job.run', 'job_id': job['id']}
+        )
+    except ChannelFull:
+        job_store.delete_image(job['id'])
+        job_store.update(job, status=JOB_FAILED, error='Job queue is full')
+        raise ExecutorBusy("Image processing job queue is full, try again later")
+    return job
+
+
+def run_job(job_id):
+    """Worker side: process one queued job, store its result and notify the owner"""
+    job = job_store.get(job_id)
+    # Unknown, already handled, or failed for missing its enqueue deadline
+    if job is None or job['status'] != JOB_QUEUED:
+        return
+
+    job = job_store.update(job, status=JOB_RUNNING)
+    try:
+        image_bytes = job_store.get_image(job_id)
+        if image_bytes is None:
+            raise ValueError("Uploaded image expired before the job ran")
+
+        # Same key as the synchronous endpoint, so either path can reuse the other's work
+        params = dict(job['params'], format='JPEG')
+        key = make_cache_key(job['operation'], image_bytes, params)
+        result = result_cache.get(key) if result_cache.enabled else None
+        if result is None:
+            cv2_image = decode_image_bytes(image_bytes)
+            result = run_color_analysis(cv2_image, job['params'], 'JPEG')
+            if result_cache.enabled:
+                result_cache.set(key, result)
+
+        job_store.set_result(job_id, result)
+        job = job_store.update(job, status=JOB_COMPLETED, finished_at=timezone.now().isoformat())
+    except Exception as e:
+        logger.error(f"Error in image job {job_id}: {str(e)}")
+        job = job_store.update(job, status=JOB_FAILED, error=str(e), finished_at=timezone.now().isoformat())
+    finally:
+        job_store.delete_image(job_id)
+
+    notify_job_status(job)
+
+
+def notify_job_status(job):
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            job_group_name(job['user_id']), {'type': 'job.status', 'job': public_job(job)}
+        )
+    except Exception as e:
+        logger.warning(f"Could not publish status of image job {job['id']}: {str(e)}")
@@ -0,0 +1,99 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from image_processing.benchmarks import (
+    DEFAULT_REPEAT,
+    DEFAULT_THRESHOLD,
+    DEFAULT_WARMUP,
+    SIZES,
+    find_regressions,
+    load_baseline,
+    run_benchmarks,
+    save_baseline,
+)
+
+DEFAULT_BASELINE = os.path.join('benchmarks', 'image_processing_baseline.json')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark image_processing functions and endpoints on synthetic images. '
+        'Fails when a case regresses past --threshold against the baseline JSON, '
+        'or when there is no baseline (create it once with --save-baseline).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default=','.join(SIZES),
+            help=f"Comma-separated image sizes in megapixels, from: {', '.join(SIZES)}"
+        )
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Timed runs per case')
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help='Untimed runs per case')
+        parser.add_argument('--only', help='Regex; run only matching cases, e.g. "function:.*@2MP"')
+        parser.add_argument('--skip-functions', action='store_true', help='Do not benchmark utils functions')
+        parser.add_argument('--skip-endpoints', action='store_true', help='Do not benchmark endpoints')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Write the results to --baseline instead of comparing against it'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=DEFAULT_THRESHOLD,
+            help='Allowed growth of p50 latency and peak memory, as a fraction (0.25 = 25%%)'
+        )
+        parser.add_argument('--output', help='Also write the results of this run to this JSON file')
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        unknown = [size for size in sizes if size not in SIZES]
+        if unknown:
+            raise CommandError(f"Unknown sizes: {', '.join(unknown)}. Available: {', '.join(SIZES)}")
+
+        baseline_path = options['baseline']
+        # Without a baseline nothing can regress: fail before spending time on the run
+        if not options['save_baseline'] and not os.path.exists(baseline_path):
+            raise CommandError(f'No baseline at {baseline_path}; run once with --save-baseline to create it')
+
+        results = run_benchmarks(
+            sizes=sizes,
+            repeat=options['repeat'],
+            warmup=options['warmup'],
+            pattern=options['only'],
+            functions=not options['skip_functions'],
+            endpoints=not options['skip_endpoints'],
+            log=self.log_result,
+        )
+        if not results:
+            raise CommandError('No benchmark case matched')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if options['save_baseline']:
+            if os.path.dirname(baseline_path):
+                os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+            save_baseline(baseline_path, results)
+            self.stdout.write(self.style.SUCCESS(f'Saved {len(results)} results to {baseline_path}'))
+            return
+
+        regressions = find_regressions(results, load_baseline(baseline_path), options['threshold'])
+        for regression in regressions:
+            self.stderr.write(
+                f"{regression['case']}: {regression['metric']} {regression['baseline']} -> "
+                f"{regression['current']} (+{regression['change']:.0%})"
+            )
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} regression(s) past the {options['threshold']:.0%} threshold"
+            )
+        self.stdout.write(self.style.SUCCESS(f'No regressions in {len(results)} cases against {baseline_path}'))
+
+    def log_result(self, name, result):
+        throughput = f"{result['mpix_per_s']} MP/s" if result.get('mpix_per_s') else ''
+        self.stdout.write(
+            f"{name:<55} p50 {result['p50_ms']:>10.2f} ms  p90 {result['p90_ms']:>10.2f} ms  "
+            f"p99 {result['p99_ms']:>10.2f} ms  peak {result['peak_mb']:>8.1f} MB  {throughput}"
+        )
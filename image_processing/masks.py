@@ -0,0 +1,77 @@
+"""
+Compact encodings for binary masks and segment label maps.
+
+'image' keeps the original output: one encoded image per mask. The other
+formats avoid lossy JPEG masks and the per-segment encode passes:
+- 'label_map': one lossless PNG label map (0 = unassigned, 1..n = segments)
+- 'rle':       run-length counts per mask (row-major, alternating runs of
+               outside / inside pixels, starting with outside)
+- 'polygons':  external contours per mask as [[x, y], ...] point lists
+"""
+import cv2
+import numpy as np
+
+MASK_FORMATS = ('image', 'label_map', 'rle', 'polygons')
+DEFAULT_MASK_FORMAT = 'image'
+
+# approxPolyDP tolerance (pixels) for polygon outputs
+POLYGON_EPSILON = 1.0
+
+
+def label_runs(labels):
+    """(values, starts) of every run of equal values in the row-major flattened array"""
+    flat = labels.reshape(-1)
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    return flat[starts], starts
+
+
+def _rle_counts(values, starts, total, label):
+    inside = values == label
+    bounds = np.column_stack((starts[inside], np.append(starts, total)[1:][inside])).reshape(-1)
+    counts = np.diff(np.concatenate(([0], bounds, [total])))
+    # Adjacent runs of the label never occur (runs are maximal), so only
+    # the trailing outside run can be empty
+    if len(counts) > 1 and counts[-1] == 0:
+        counts = counts[:-1]
+    return counts.tolist()
+
+
+def rle_encode(mask):
+    """RLE of a binary mask (any non-zero pixel is inside): {'size': [h, w], 'counts': [...]}"""
+    values, starts = label_runs(mask != 0)
+    return {'size': list(mask.shape[:2]), 'counts': _rle_counts(values, starts, mask.size, True)}
+
+
+def rle_encode_labels(labels, n_labels):
+    """RLE of every segment 1..n_labels of a label map from a single scan of the map"""
+    values, starts = label_runs(labels)
+    size = list(labels.shape[:2])
+    return [
+        {'size': size, 'counts': _rle_counts(values, starts, labels.size, label)}
+        for label in range(1, n_labels + 1)
+    ]
+
+
+def rle_decode(rle):
+    """Binary mask (uint8, 0/255) from rle_encode output"""
+    height, width = rle['size']
+    counts = np.asarray(rle['counts'], dtype=np.int64)
+    inside = np.arange(len(counts)) % 2 == 1
+    return np.repeat(np.where(inside, 255, 0).astype(np.uint8), counts).reshape(height, width)
+
+
+def mask_polygons(mask, epsilon=POLYGON_EPSILON):
+    """External contours of a binary mask, simplified, as lists of [x, y] points"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    polygons = []
+    for contour in contours:
+        if epsilon:
+            contour = cv2.approxPolyDP(contour, epsilon, True)
+        if len(contour) >= 3:
+            polygons.append(contour.reshape(-1, 2).tolist())
+    return polygons
+
+
+def label_counts(labels, n_labels):
+    """Pixels per segment 1..n_labels, in one pass over the label map"""
+    return np.bincount(labels.reshape(-1), minlength=n_labels + 1)[1:n_labels + 1]
@@ -0,0 +1,298 @@
+"""
+Per-stage timing for image requests, exported as a Server-Timing header
+and as Prometheus histograms on /metrics.
+
+A StageTimer is active for the duration of each image view; code on the
+hot path wraps its work in `with stage('decode'):` and the time is
+recorded only when a timer is active (elsewhere, e.g. in pool workers,
+stage() costs one context variable lookup). Stages may nest: each stage
+records its own time excluding nested stages, so the operation stage
+does not double count the decode and encode inside it.
+
+Histograms live in the process; with several server processes each one
+exposes its own series, as prometheus_client does without multiprocess
+mode.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_METRICS_SETTINGS = {
+    'ENABLED': True,
+    # Bearer token required by GET /metrics; the endpoint is off (404) without one
+    'TOKEN': None,
+    # Histogram bucket upper bounds in seconds
+    'BUCKETS': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+}
+
+
+def get_metrics_settings():
+    return {**DEFAULT_METRICS_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_METRICS', {})}
+
+
+_current_timer = contextvars.ContextVar('image_processing_stage_timer', default=None)
+
+
+class StageTimer:
+    """Wall-clock time per stage of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self._stack = []
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        # Child time of this stage, subtracted from its own duration
+        self._stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            self.add(name, elapsed - children)
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total=None):
+        """Server-Timing header value, durations in milliseconds"""
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.durations.items()]
+        entries.append(f'total;dur={(self.total() if total is None else total) * 1000:.2f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage name of the active request, if any"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+@contextmanager
+def request_timer():
+    """Activate a StageTimer for the enclosed request; yields it (None when metrics are disabled)"""
+    if not get_metrics_settings()['ENABLED']:
+        yield None
+        return
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Thread-safe labelled histogram with cumulative Prometheus buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._buckets = tuple(buckets) if buckets else None
+        self._series = {}
+        self._lock = threading.Lock()
+
+    @property
+    def buckets(self):
+        if self._buckets is None:
+            self._buckets = tuple(sorted(get_metrics_settings()['BUCKETS']))
+        return self._buckets
+
+    def observe(self, labels, value):
+        buckets = self.buckets
+        index = bisect_left(buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), count and sum
+                series = self._series[labels] = [[0] * (len(buckets) + 1), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for labels, (counts, count, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, labels, [f'le="{bound}"']), cumulative
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), count
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), total
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    """Thread-safe labelled counter"""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}_total', _format_labels(self.labelnames, labels), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time: fn() -> {label values: value}"""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def samples(self):
+        for labels, value in sorted(self.fn().items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+    def clear(self):
+        pass
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.clear()
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.register(Histogram(
+    'image_processing_stage_seconds',
+    'Time spent per request stage (parse, validate, cache, decode, operation, encode, render, total)',
+    ('endpoint', 'mode', 'stage'),
+))
+requests_total = registry.register(Counter(
+    'image_processing_requests',
+    'Image processing requests by endpoint, mode and response status',
+    ('endpoint', 'mode', 'status'),
+))
+
+
+def _cache_stats():
+    from .cache import result_cache
+
+    stats = result_cache.stats()
+    return {(name,): stats[name] for name in ('hits', 'misses', 'local_entries', 'local_bytes')}
+
+
+registry.register(Gauge(
+    'image_processing_result_cache',
+    'Result cache counters of this process (hits, misses, local_entries, local_bytes)',
+    ('stat',),
+    _cache_stats,
+))
+
+
+def _buffer_pool_stats():
+    from .buffers import buffer_pool
+
+    stats = buffer_pool.stats()
+    return {(name,): stats[name] for name in ('hits', 'misses', 'dropped', 'buffers_held', 'bytes_held', 'bytes_in_use')}
+
+
+registry.register(Gauge(
+    'image_processing_buffer_pool',
+    'Image buffer pool counters of this process (hits, misses, dropped, buffers_held, bytes_held, bytes_in_use)',
+    ('stat',),
+    _buffer_pool_stats,
+))
+
+
+def _editing_session_stats():
+    from .editing import editing_sessions
+
+    return {(name,): value for name, value in editing_sessions.stats().items()}
+
+
+registry.register(Gauge(
+    'image_processing_editing_sessions',
+    'Editing sessions decoded in this process (sessions, bytes, evicted)',
+    ('stat',),
+    _editing_session_stats,
+))
+
+
+def record_request(timer, endpoint, mode, status_code, total=None):
+    """Observe every stage of a finished request and count it"""
+    endpoint = endpoint or ''
+    mode = mode or ''
+    for name, seconds in timer.durations.items():
+        stage_seconds.observe((endpoint, mode, name), seconds)
+    stage_seconds.observe((endpoint, mode, 'total'), timer.total() if total is None else total)
+    requests_total.inc((endpoint, mode, str(status_code)))
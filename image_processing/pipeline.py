@@ -0,0 +1,361 @@
+"""
+Operation registry and planner for effect chains.
+
+Each operation declares the colour space it works in, the spaces it
+accepts without conversion, its channel count, a relative per-pixel cost
+and whether it is a point op. plan_effects() turns a requested chain into
+an explicit list of steps:
+- runs of point ops (negative, brightness, contrast) are fused into one
+  lookup table, applied in BGR or grayscale;
+- colour conversions are inserted lazily, only when the next step needs
+  another space, so back-to-back inverse conversions (YUV->BGR->YUV
+  between two equalizations, LAB->BGR->LAB between two CLAHE passes)
+  never appear and consecutive steps share the converted intermediate;
+- grayscale input and the chain after grayscale stay single-channel:
+  point and luma ops run on the gray plane directly (identical to going
+  through YUV, where a gray image has Y = gray and U = V = 128), and ops
+  that need colour (CLAHE in LAB) expand to BGR on demand. With
+  output_space=None the result is left single-channel, so endpoints
+  encode 8-bit grayscale files.
+
+Plan.explain() describes the steps for debugging (the multiple-effects
+endpoint returns it with explain=true). Strip-local steps run strip by
+strip on large images (see tiling); global ops (equalization, CLAHE)
+use the two-pass strip-wise implementations. Plans run into buffers from
+buffers.buffer_pool, in place wherever a step allows it.
+"""
+import cv2
+import numpy as np
+
+from .tiling import (
+    clahe_interpolate,
+    clahe_luts,
+    equalize_hist_lut,
+    iter_strips,
+    map_into,
+    should_tile,
+)
+from .buffers import buffer_pool
+from .utils import point_effect_lut
+
+BGR = 'BGR'
+GRAY = 'GRAY'
+
+# Colour spaces whose channels are display values, where point ops apply
+POINT_SPACES = (BGR, GRAY)
+
+# Direct conversions; anything else goes through BGR
+CONVERSIONS = {
+    (BGR, GRAY): cv2.COLOR_BGR2GRAY,
+    (GRAY, BGR): cv2.COLOR_GRAY2BGR,
+    (BGR, 'YUV'): cv2.COLOR_BGR2YUV,
+    ('YUV', BGR): cv2.COLOR_YUV2BGR,
+    (BGR, 'LAB'): cv2.COLOR_BGR2LAB,
+    ('LAB', BGR): cv2.COLOR_LAB2BGR,
+    (BGR, 'HSV'): cv2.COLOR_BGR2HSV,
+    ('HSV', BGR): cv2.COLOR_HSV2BGR,
+}
+
+# Relative per-pixel cost of the step kinds, used by Plan.explain()
+CONVERSION_COST = 1.0
+LUT_COST = 0.3
+
+
+class Operation:
+    """
+    A registered effect.
+    space: colour space it is applied in (conversion target)
+    accepts: spaces it can also run in without conversion
+    channel: channel of `space` it modifies (None: the whole image)
+    output_space: space of its result (None: unchanged)
+    point: per-value mapping that fuses into a lookup table
+    is_global: needs whole-image statistics (cannot run on one strip alone)
+    """
+
+    def __init__(self, name, space, accepts=(), channel=None, output_space=None, channels=3,
+                 cost=1.0, point=False, is_global=False, apply=None):
+        self.name = name
+        self.space = space
+        self.accepts = (space,) + tuple(accepts)
+        self.channel = channel
+        self.output_space = output_space
+        self.channels = channels
+        self.cost = cost
+        self.point = point
+        self.is_global = is_global
+        self.apply = apply
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'space': self.space,
+            'accepts': list(self.accepts),
+            'output_space': self.output_space or self.space,
+            'channels': self.channels,
+            'cost': self.cost,
+            'point': self.point,
+            'global': self.is_global,
+        }
+
+
+OPERATIONS = {}
+
+
+def register_operation(operation):
+    OPERATIONS[operation.name] = operation
+    return operation
+
+
+def get_operation(name):
+    try:
+        return OPERATIONS[name]
+    except KeyError:
+        raise ValueError(f"Unknown effect '{name}'. Available effects: {', '.join(OPERATIONS)}")
+
+
+def _plane(image, channel):
+    return image if image.ndim == 2 or channel is None else image[:, :, channel]
+
+
+def equalize_plane(image, channel):
+    """Histogram-equalize one channel of image in place (two passes over strips when tiled)"""
+    plane = _plane(image, channel)
+    if not should_tile(image):
+        plane[...] = cv2.equalizeHist(np.ascontiguousarray(plane))
+        return image
+
+    height, width = plane.shape[:2]
+    hist = np.zeros(256, dtype=np.int64)
+    for rows in iter_strips(height, width):
+        hist += np.bincount(plane[rows].ravel(), minlength=256)
+    lut = equalize_hist_lut(hist)
+    for rows in iter_strips(height, width):
+        plane[rows] = cv2.LUT(np.ascontiguousarray(plane[rows]), lut)
+    return image
+
+
+def clahe_plane(image, channel, clip_limit=2.0, tile_grid_size=(8, 8)):
+    """Apply CLAHE to one channel of image in place (strip-wise tile LUTs when tiled)"""
+    plane = _plane(image, channel)
+    if not should_tile(image):
+        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+        plane[...] = clahe.apply(np.ascontiguousarray(plane))
+        return image
+
+    height, width = plane.shape[:2]
+    luts, tile_size = clahe_luts(
+        lambda rows: np.ascontiguousarray(plane[rows]), height, width, clip_limit, tile_grid_size
+    )
+    for rows in iter_strips(height, width):
+        plane[rows] = clahe_interpolate(np.ascontiguousarray(plane[rows]), rows.start, luts, tile_size)
+    return image
+
+
+# Point ops: their tables come from utils.point_effect_lut
+register_operation(Operation('negative', BGR, accepts=(GRAY,), point=True, cost=LUT_COST))
+register_operation(Operation('brightness', BGR, accepts=(GRAY,), point=True, cost=LUT_COST))
+register_operation(Operation('contrast', BGR, accepts=(GRAY,), point=True, cost=LUT_COST))
+register_operation(Operation('grayscale', BGR, accepts=(GRAY,), output_space=GRAY, channels=1, cost=0.0))
+register_operation(Operation(
+    'histogram_eq', 'YUV', accepts=(GRAY,), channel=0, channels=1, cost=1.5, is_global=True,
+    apply=equalize_plane,
+))
+register_operation(Operation(
+    'clahe', 'LAB', channel=0, channels=1, cost=4.0, is_global=True, apply=clahe_plane,
+))
+
+
+class Step:
+    """One planned step: a colour conversion, a fused lookup table or a global operation"""
+
+    def __init__(self, kind, name, space, cost, code=None, lut=None, operation=None, effects=()):
+        self.kind = kind
+        self.name = name
+        self.space = space
+        self.cost = cost
+        self.code = code
+        self.lut = lut
+        self.operation = operation
+        self.effects = list(effects)
+
+    @property
+    def is_global(self):
+        return self.kind == 'operation'
+
+    def output_shape(self, shape):
+        if self.kind != 'convert':
+            return shape
+        return shape[:2] if self.space == GRAY else shape[:2] + (3,)
+
+    def run_into(self, src, dst):
+        """Write the step's result into dst (a lookup table may run in place, dst is src)"""
+        if self.kind == 'convert':
+            return cv2.cvtColor(src, self.code, dst=dst)
+        return cv2.LUT(src, self.lut, dst=dst)
+
+    def describe(self):
+        info = {'kind': self.kind, 'name': self.name, 'space': self.space, 'cost': self.cost}
+        if self.effects:
+            info['effects'] = self.effects
+        return info
+
+
+class Plan:
+    def __init__(self, effects, steps, naive_conversions):
+        self.effects = list(effects)
+        self.steps = steps
+        self.naive_conversions = naive_conversions
+
+    @property
+    def conversions(self):
+        return sum(1 for step in self.steps if step.kind == 'convert')
+
+    def explain(self, shape=None):
+        """Steps, conversion counts and relative cost (in full-frame passes) for debugging"""
+        cost = sum(step.cost for step in self.steps)
+        info = {
+            'effects': self.effects,
+            'steps': [step.describe() for step in self.steps],
+            'conversions': self.conversions,
+            'conversions_without_planning': self.naive_conversions,
+            'estimated_cost': round(cost, 2),
+        }
+        if shape is not None:
+            info['estimated_cost_mpix'] = round(cost * shape[0] * shape[1] / 1e6, 2)
+        return info
+
+    def run(self, cv2_image):
+        """
+        Execute the plan into buffers from the buffer pool. The caller's image
+        is never modified; lookup tables and global ops run in place on the
+        plan's own buffers, and intermediates go back to the pool as soon as
+        the next step has consumed them.
+        """
+        result = cv2_image
+        local = []
+
+        for step in self.steps:
+            if not step.is_global:
+                local.append(step)
+                continue
+            result = self._run_local(local, result, owned=result is not cv2_image)
+            local = []
+            if result is cv2_image:
+                result = _pooled_copy(cv2_image)
+            result = step.operation.apply(result, step.operation.channel)
+
+        result = self._run_local(local, result, owned=result is not cv2_image)
+        if result is cv2_image:
+            result = _pooled_copy(cv2_image)
+        return result
+
+    @staticmethod
+    def _run_local(steps, image, owned):
+        """Run strip-local steps; owned: image is a pool buffer of this plan that may be overwritten"""
+        if not steps:
+            return image
+
+        if should_tile(image):
+            # One pass over strips: per-strip intermediates stay strip-sized
+            shape = image.shape
+            for step in steps:
+                shape = step.output_shape(shape)
+
+            def run_steps(strip, dst):
+                for step in steps[:-1]:
+                    strip = step.run_into(strip, None)
+                steps[-1].run_into(strip, dst)
+
+            out = map_into(run_steps, image, buffer_pool.acquire(shape))
+            if owned:
+                buffer_pool.release(image)
+            return out
+
+        for step in steps:
+            if step.kind == 'lut' and owned:
+                step.run_into(image, image)
+                continue
+            out = step.run_into(image, buffer_pool.acquire(step.output_shape(image.shape)))
+            if owned:
+                buffer_pool.release(image)
+            image, owned = out, True
+        return image
+
+
+def _pooled_copy(cv2_image):
+    copy = buffer_pool.acquire(cv2_image.shape, cv2_image.dtype)
+    np.copyto(copy, cv2_image)
+    return copy
+
+
+def image_space(cv2_image):
+    """Colour space of a decoded image: GRAY for single-channel arrays, else BGR"""
+    return GRAY if cv2_image.ndim == 2 else BGR
+
+
+def _conversion_steps(source, target):
+    """Conversion steps from source to target space (through BGR when there is no direct code)"""
+    if source == target:
+        return []
+    if (source, target) in CONVERSIONS:
+        return [Step('convert', f'{source}->{target}', target, CONVERSION_COST, code=CONVERSIONS[(source, target)])]
+    return _conversion_steps(source, BGR) + _conversion_steps(BGR, target)
+
+
+def plan_effects(effects, brightness=0, contrast=1.0, input_space=BGR, output_space=BGR):
+    """
+    Build the execution Plan of an effect chain.
+    input_space: BGR or GRAY (see image_space)
+    output_space: BGR or GRAY; None keeps a BGR or GRAY result as it is,
+                  so single-channel images are encoded single-channel
+    """
+    steps = []
+    space = input_space
+    pending = []
+    naive_conversions = 0
+
+    def flush():
+        nonlocal space
+        if not pending:
+            return
+        if space not in POINT_SPACES:
+            steps.extend(_conversion_steps(space, BGR))
+            space = BGR
+        lut = np.arange(256, dtype=np.uint8)
+        for operation in pending:
+            lut = point_effect_lut(operation.name, brightness, contrast)[lut]
+        steps.append(Step(
+            'lut', '+'.join(operation.name for operation in pending), space, LUT_COST, lut=lut,
+            effects=[operation.name for operation in pending],
+        ))
+        pending.clear()
+
+    for name in effects:
+        operation = get_operation(name)
+        if operation.point:
+            pending.append(operation)
+            continue
+
+        flush()
+        # Applied on its own, every non-point effect converts to its space and back
+        if operation.space != BGR or operation.output_space:
+            naive_conversions += 2
+
+        if space not in operation.accepts:
+            steps.extend(_conversion_steps(space, operation.space))
+            space = operation.space
+
+        if operation.output_space and operation.output_space != space:
+            # A change of space (grayscale) is a conversion step
+            steps.extend(_conversion_steps(space, operation.output_space))
+            space = operation.output_space
+        elif operation.is_global:
+            steps.append(Step(
+                'operation', operation.name, space, operation.cost, operation=operation,
+            ))
+
+    flush()
+    if output_space is None:
+        output_space = space if space in POINT_SPACES else BGR
+    steps.extend(_conversion_steps(space, output_space))
+    return Plan(effects, steps, naive_conversions)
@@ -0,0 +1,123 @@
+import json
+import uuid
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+from .utils import EncodedImage
+
+
+def iter_images(data, path=''):
+    """Yield (path, EncodedImage) for every image inside a response payload"""
+    if isinstance(data, EncodedImage):
+        yield path, data
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            yield from iter_images(value, f'{path}.{key}' if path else str(key))
+    elif isinstance(data, (list, tuple)):
+        for index, value in enumerate(data):
+            yield from iter_images(value, f'{path}.{index}' if path else str(index))
+
+
+def replace_images(data, replace, path=''):
+    """Return a copy of the payload with every image swapped for replace(path, image)"""
+    if isinstance(data, EncodedImage):
+        return replace(path, data)
+    if isinstance(data, dict):
+        return {
+            key: replace_images(value, replace, f'{path}.{key}' if path else str(key))
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [
+            replace_images(value, replace, f'{path}.{index}' if path else str(index))
+            for index, value in enumerate(data)
+        ]
+    return data
+
+
+class ImageJSONEncoder(encoders.JSONEncoder):
+    """JSON encoder that inlines images as base64 data URLs"""
+
+    def default(self, obj):
+        if isinstance(obj, EncodedImage):
+            return obj.to_data_url()
+        return super().default(obj)
+
+
+class ImageJSONRenderer(JSONRenderer):
+    """Default renderer, keeps the data:image/...;base64 responses"""
+    encoder_class = ImageJSONEncoder
+
+
+class ImageRenderer(BaseRenderer):
+    """
+    Return the primary (first) image of the response as raw bytes.
+    Payloads without an image, such as validation errors, fall back to JSON.
+    """
+    media_type = 'image/*'
+    format = 'image'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        image = next((image for _, image in iter_images(data)), None)
+
+        if image is None:
+            if response is not None:
+                response['Content-Type'] = 'application/json'
+            return ImageJSONRenderer().render(data, 'application/json', renderer_context)
+
+        if response is not None:
+            response['Content-Type'] = image.content_type
+        return image.data
+
+
+class MultipartMixedRenderer(BaseRenderer):
+    """
+    Send JSON metadata and raw image bytes side by side.
+    The first part is the JSON payload where every image is replaced by
+    {"part": <name>, "content_type": ..., "size": ...}; each image follows
+    as its own part named after its path in the payload (e.g. segments.0.mask).
+    """
+    media_type = 'multipart/mixed'
+    format = 'multipart'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        boundary = uuid.uuid4().hex
+        images = []
+
+        def reference(path, image):
+            images.append((path, image))
+            return {'part': path, 'content_type': image.content_type, 'size': len(image)}
+
+        metadata = replace_images(data, reference)
+        metadata_json = json.dumps(metadata, cls=encoders.JSONEncoder, ensure_ascii=False).encode('utf-8')
+
+        chunks = [
+            f'--{boundary}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Disposition: inline; name="metadata"\r\n'
+            f'\r\n'.encode(),
+            metadata_json,
+            b'\r\n',
+        ]
+        for path, image in images:
+            chunks.append((
+                f'--{boundary}\r\n'
+                f'Content-Type: {image.content_type}\r\n'
+                f'Content-Disposition: inline; name="{path}"; filename="{path}{image.extension}"\r\n'
+                f'Content-Length: {len(image)}\r\n'
+                f'\r\n'
+            ).encode())
+            chunks.append(image.data)
+            chunks.append(b'\r\n')
+        chunks.append(f'--{boundary}--\r\n'.encode())
+
+        if response is not None:
+            response['Content-Type'] = f'{self.media_type}; boundary={boundary}'
+        return b''.join(chunks)
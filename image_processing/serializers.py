@@ -1,5 +1,24 @@
+import zipfile
+
 from rest_framework import serializers
 
+from .batch import get_batch_settings
+from .color_names import DEFAULT_COLOR_DICTIONARY, available_color_dictionaries
+from .masks import DEFAULT_MASK_FORMAT, MASK_FORMATS
+from .pipeline import OPERATIONS
+from .utils import check_pixel_limit, get_upload_settings
+
+
+def validate_pixel_limit(value):
+    """Reject an uploaded image whose decoded size exceeds MAX_PIXELS (read from its header)"""
+    image = getattr(value, 'image', None)
+    if image is not None:
+        try:
+            check_pixel_limit(*image.size)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+    return value
+
 
 class ImageUploadSerializer(serializers.Serializer):
     """Serializer for image upload"""
@@ -7,9 +26,10 @@ class ImageUploadSerializer(serializers.Serializer):
     
     def validate_image(self, value):
         """Validate uploaded image"""
-        # Check file size (max 10MB)
-        if value.size > 10 * 1024 * 1024:
-            raise serializers.ValidationError("Image size should not exceed 10MB")
+        # Check file size (IMAGE_PROCESSING_UPLOADS['MAX_BYTES'], 10MB by default)
+        max_bytes = get_upload_settings()['MAX_BYTES']
+        if value.size > max_bytes:
+            raise serializers.ValidationError(f"Image size should not exceed {max_bytes // (1024 * 1024)}MB")
         
         # Check file format
         allowed_formats = ['JPEG', 'JPG', 'PNG', 'BMP', 'TIFF']
@@ -17,7 +37,8 @@ class ImageUploadSerializer(serializers.Serializer):
             if value.image.format not in allowed_formats:
                 raise serializers.ValidationError(f"Unsupported image format. Allowed formats: {', '.join(allowed_formats)}")
         
-        return value
+        # Pillow only warns up to twice its own limit: enforce MAX_PIXELS explicitly
+        return validate_pixel_limit(value)
 
 
 class ImageProcessingSerializer(serializers.Serializer):
@@ -27,20 +48,78 @@ class ImageProcessingSerializer(serializers.Serializer):
         child=serializers.CharField(),
         required=False,
         default=list,
-        help_text="List of effects to apply: grayscale, negative, brightness, contrast, histogram_eq"
+        help_text="List of effects to apply: grayscale, negative, brightness, contrast, histogram_eq, clahe"
     )
     brightness = serializers.FloatField(required=False, default=0, min_value=-100, max_value=100)
     contrast = serializers.FloatField(required=False, default=1.0, min_value=0.1, max_value=3.0)
+    explain = serializers.BooleanField(
+        default=False,
+        help_text="Return the execution plan of the effect chain (multiple-effects and editing sessions)"
+    )
     
+    def validate_image(self, value):
+        return validate_pixel_limit(value)
+
     def validate_effects(self, value):
-        """Validate effects list"""
-        allowed_effects = ['grayscale', 'negative', 'brightness', 'contrast', 'histogram_eq']
+        """Validate effects list against the operation registry"""
+        allowed_effects = list(OPERATIONS)
         for effect in value:
             if effect not in allowed_effects:
                 raise serializers.ValidationError(f"Invalid effect '{effect}'. Allowed effects: {', '.join(allowed_effects)}")
         return value
 
 
+class BatchEffectsSerializer(ImageProcessingSerializer):
+    """Serializer for applying one effect chain to many images (uploads and/or a ZIP archive)"""
+    image = None
+    images = serializers.ListField(
+        child=serializers.FileField(),
+        required=False,
+        default=list,
+        help_text="Images to process (repeat the field for each file)"
+    )
+    archive = serializers.FileField(required=False, help_text="ZIP archive of images to process")
+    format = serializers.ChoiceField(choices=['JPEG', 'PNG'], default='JPEG', help_text="Output format")
+
+    def validate_archive(self, value):
+        max_bytes = get_batch_settings()['MAX_ARCHIVE_BYTES']
+        if value.size > max_bytes:
+            raise serializers.ValidationError(f"Archive size should not exceed {max_bytes // (1024 * 1024)}MB")
+        if not zipfile.is_zipfile(value):
+            raise serializers.ValidationError("Archive must be a ZIP file")
+        value.seek(0)
+        return value
+
+    def validate(self, data):
+        images = data.get('images', [])
+        archive = data.get('archive')
+        if not images and archive is None:
+            raise serializers.ValidationError("Upload at least one image or an archive")
+
+        # Per-image failures go to the batch manifest; only the limits are checked here
+        max_bytes = get_upload_settings()['MAX_BYTES']
+        too_large = [image.name for image in images if image.size > max_bytes]
+        if too_large:
+            raise serializers.ValidationError(
+                f"Image size should not exceed {max_bytes // (1024 * 1024)}MB: {', '.join(too_large)}"
+            )
+
+        count = len(images)
+        if archive is not None:
+            with zipfile.ZipFile(archive) as zf:
+                count += sum(1 for info in zf.infolist() if not info.is_dir())
+            archive.seek(0)
+        max_files = get_batch_settings()['MAX_FILES']
+        if count > max_files:
+            raise serializers.ValidationError(f"A batch can contain at most {max_files} images")
+        return data
+
+
+class EditingSessionSerializer(ImageProcessingSerializer):
+    """Serializer for previewing or rendering an effect chain on an editing session's image"""
+    image = None
+
+
 class BrightnessContrastSerializer(serializers.Serializer):
     """Serializer for brightness and contrast adjustment"""
     image = serializers.ImageField(required=True)
@@ -52,9 +131,13 @@ class HSVChannelSerializer(serializers.Serializer):
     """Serializer for HSV channel extraction"""
     image = serializers.ImageField(required=True)
     channel = serializers.ChoiceField(
-        choices=['H', 'S', 'V', 'all'],
+        choices=['H', 'S', 'V', 'hsv', 'all'],
         default='all',
-        help_text="HSV channel to extract: H (Hue), S (Saturation), V (Value), or all"
+        help_text="HSV channel to extract: H (Hue), S (Saturation), V (Value), hsv (composite) or all"
+    )
+    include_composite = serializers.BooleanField(
+        default=False,
+        help_text="With channel=all, also return the hsv composite"
     )
 
 
@@ -67,12 +150,52 @@ class ColorAnalysisSerializer(serializers.Serializer):
         help_text="Analysis mode: dominant_colors, color_detection, color_quantization, color_mask, multi_segment, gmm_quantization, color_name_palette"
     )
     
+    # Pixel budget: when set, the analysis runs on a proxy downscaled to at
+    # most max_pixels pixels; geometric outputs are mapped back to the
+    # original resolution and the response reports proxy_scale
+    max_pixels = serializers.IntegerField(
+        required=False, min_value=10000, max_value=50000000,
+        help_text="Analyse a downscaled proxy of at most this many pixels (10000-50000000)"
+    )
+
+    # Mask output for color_detection, color_mask and multi_segment: 'image'
+    # (one encoded image per mask), 'label_map' (one lossless PNG; for
+    # multi_segment pixel values are segment ids), 'rle' or 'polygons'
+    mask_format = serializers.ChoiceField(
+        choices=MASK_FORMATS,
+        default=DEFAULT_MASK_FORMAT,
+        help_text="Mask output: image, label_map, rle or polygons"
+    )
+
     # Parameters for dominant_colors mode
     num_colors = serializers.IntegerField(
         default=5, min_value=2, max_value=20,
         help_text="Number of dominant colors to extract (2-20)"
     )
     
+    # K-means parameters shared by dominant_colors, color_quantization,
+    # multi_segment (kmeans) and color_name_palette: the model is fitted on a
+    # sample of kmeans_fit_pixels pixels, then every pixel is assigned to its
+    # nearest centre. Smaller samples / fewer attempts are faster but less
+    # stable on small colour regions.
+    kmeans_fit_pixels = serializers.IntegerField(
+        default=100000, min_value=1000, max_value=2000000,
+        help_text="Number of sampled pixels used to fit k-means (1000-2000000)"
+    )
+    kmeans_attempts = serializers.IntegerField(
+        default=3, min_value=1, max_value=10,
+        help_text="Number of k-means restarts on the sample (1-10)"
+    )
+    # 'sample' fits k-means on sampled pixels; 'histogram' clusters the
+    # occupied bins of a 32x32x32 colour histogram weighted by pixel count,
+    # so its cost depends on the number of distinct colours, not on the
+    # resolution. Defaults to 'histogram' for color_name_palette, else 'sample'.
+    clustering_backend = serializers.ChoiceField(
+        choices=['sample', 'histogram'],
+        required=False,
+        help_text="K-means backend: sample or histogram"
+    )
+    
     # Parameters for color_detection mode
     target_color = serializers.CharField(
         required=False, max_length=7,
@@ -133,6 +256,11 @@ class ColorAnalysisSerializer(serializers.Serializer):
         default=8, min_value=2, max_value=20,
         help_text="Number of colors to extract before assigning nearest color names"
     )
+    color_dictionary = serializers.ChoiceField(
+        choices=available_color_dictionaries(),
+        default=DEFAULT_COLOR_DICTIONARY,
+        help_text="Named-color dictionary: css3 (20 colors), css4 (148 colors) or one from IMAGE_PROCESSING_COLOR_NAMES"
+    )
     
     def validate(self, data):
         """Custom validation based on mode"""
@@ -1,3 +1,822 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import tempfile
+import zipfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.factories.user import UserFactory
+from common.tests.isolated_cache_test_case import APITestCase
+from . import tiling
+from .benchmarks import find_regressions, run_benchmarks
+from .batch import aiter_chunks
+from .buffers import buffer_pool
+from .cache import LocalLRUCache, make_cache_key, result_cache
+from .color_names import ColorNameIndex, get_color_index
+from .consumers import ImageJobConsumer
+from .editing import editing_sessions
+from .executor import ExecutorBusy, ImageTaskExecutor
+from .jobs import get_job_settings, run_job
+from .masks import mask_polygons, rle_decode, rle_encode, rle_encode_labels
+from .pipeline import plan_effects
+from .utils import (
+    decode_image,
+    encode_image,
+    apply_grayscale,
+    apply_negative,
+    adjust_brightness_contrast,
+    apply_clahe,
+    apply_histogram_equalization,
+    apply_multiple_effects,
+    assign_to_centers,
+    convert_to_hsv_channels,
+    extract_palette,
+    get_dominant_colors,
+    histogram_kmeans,
+    quantize_colors,
+)
+
+
+def make_test_image(height=48, width=64, seed=0):
+    """Random BGR image used as a fixture by the tests below"""
+    return np.random.RandomState(seed).randint(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def make_upload(image=None, format='PNG', name='test.png'):
+    """Encode an image into an uploaded file suitable for the multipart APIs"""
+    if image is None:
+        image = make_test_image()
+    content_type = 'image/png' if format == 'PNG' else 'image/jpeg'
+    return SimpleUploadedFile(name, encode_image(image, format), content_type=content_type)
+
+
+def decode_data_url(data_url):
+    header, encoded = data_url.split(',', 1)
+    return cv2.imdecode(np.frombuffer(base64.b64decode(encoded), np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+class MultipleEffectsTests(SimpleTestCase):
+    def apply_sequentially(self, image, effects, brightness, contrast):
+        result = image.copy()
+        for effect in effects:
+            if effect == 'grayscale':
+                result = apply_grayscale(result)
+            elif effect == 'negative':
+                result = apply_negative(result)
+            elif effect == 'brightness':
+                result = adjust_brightness_contrast(result, brightness=brightness, contrast=1.0)
+            elif effect == 'contrast':
+                result = adjust_brightness_contrast(result, brightness=0, contrast=contrast)
+            elif effect == 'histogram_eq':
+                result = apply_histogram_equalization(result)
+            elif effect == 'clahe':
+                result = apply_clahe(result)
+        return result
+
+    def test_fused_chain_matches_sequential_application(self):
+        image = make_test_image()
+        chains = [
+            [],
+            ['negative', 'brightness', 'contrast'],
+            ['contrast', 'negative', 'contrast', 'brightness'],
+            ['grayscale', 'negative', 'brightness'],
+            ['brightness', 'histogram_eq', 'contrast', 'negative'],
+            ['negative', 'grayscale', 'histogram_eq', 'grayscale', 'contrast'],
+            ['clahe', 'negative', 'histogram_eq', 'clahe', 'grayscale', 'clahe'],
+        ]
+        for effects in chains:
+            with self.subTest(effects=effects):
+                expected = self.apply_sequentially(image, effects, 35.5, 1.7)
+                result = apply_multiple_effects(image, effects, 35.5, 1.7)
+                self.assertEqual(result.shape, expected.shape)
+                np.testing.assert_array_equal(result, expected)
+
+    def test_plan_shares_conversions(self):
+        plan = plan_effects(['histogram_eq', 'histogram_eq', 'negative', 'grayscale', 'histogram_eq'])
+        self.assertEqual(
+            [step['name'] for step in plan.explain()['steps']],
+            ['BGR->YUV', 'histogram_eq', 'histogram_eq', 'YUV->BGR', 'negative', 'BGR->GRAY', 'histogram_eq',
+             'GRAY->BGR'],
+        )
+        self.assertEqual(plan.explain()['conversions_without_planning'], 8)
+        with self.assertRaises(ValueError):
+            plan_effects(['sepia'])
+
+    def test_gray_input_stays_single_channel(self):
+        image = make_test_image()
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        for effects in (['negative', 'histogram_eq', 'contrast'], ['grayscale', 'brightness'], ['clahe']):
+            with self.subTest(effects=effects):
+                expected = apply_multiple_effects(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), effects, 20, 1.5)
+                np.testing.assert_array_equal(apply_multiple_effects(gray, effects, 20, 1.5), expected)
+                native = apply_multiple_effects(gray, effects, 20, 1.5, expand=False)
+                if 'clahe' in effects:
+                    # CLAHE works in LAB, so the image is expanded to colour
+                    np.testing.assert_array_equal(native, expected)
+                else:
+                    np.testing.assert_array_equal(native, expected[:, :, 0])
+        self.assertEqual(apply_multiple_effects(image, ['grayscale', 'negative'], expand=False).ndim, 2)
+
+    def test_input_is_not_modified(self):
+        image = make_test_image()
+        original = image.copy()
+        result = apply_multiple_effects(image, [])
+        self.assertIsNot(result, image)
+        apply_multiple_effects(image, ['negative', 'contrast'], 0, 2.0)
+        np.testing.assert_array_equal(image, original)
+
+
+class KMeansTests(SimpleTestCase):
+    def test_assign_to_centers_picks_nearest_center(self):
+        pixels = np.array([[0, 0, 0], [250, 250, 250], [10, 200, 10], [120, 120, 120]], dtype=np.uint8)
+        centers = np.array([[0, 0, 0], [255, 255, 255], [0, 255, 0]], dtype=np.float32)
+        np.testing.assert_array_equal(assign_to_centers(pixels, centers), [0, 1, 2, 0])
+
+    def test_sampled_fit_is_reproducible_and_uses_palette_colors(self):
+        image = make_test_image(120, 160)
+        first, palette = quantize_colors(image, k=4, fit_pixels=2000, attempts=1)
+        second, _ = quantize_colors(image, k=4, fit_pixels=2000, attempts=1)
+        np.testing.assert_array_equal(first, second)
+        palette_bgr = {tuple(color['color_rgb'][::-1]) for color in palette}
+        self.assertTrue({tuple(pixel) for pixel in first.reshape(-1, 3)} <= palette_bgr)
+
+    def test_dominant_colors_percentages_cover_the_image(self):
+        image = np.zeros((40, 40, 3), dtype=np.uint8)
+        image[:10] = (0, 0, 255)
+        colors = get_dominant_colors(image, k=2, fit_pixels=1000)
+        self.assertEqual(colors[0]['color_hex'], '#000000')
+        self.assertAlmostEqual(colors[0]['percentage'], 75.0)
+        self.assertAlmostEqual(sum(color['percentage'] for color in colors), 100.0)
+
+    def test_histogram_backend_matches_exact_colors_when_bins_are_few(self):
+        image = np.zeros((40, 40, 3), dtype=np.uint8)
+        image[:10] = (0, 0, 248)
+        image[10:20] = (248, 0, 0)
+        labels, centers, counts = histogram_kmeans(image, 3)
+        self.assertEqual(sorted(counts.tolist()), [400, 400, 800])
+        np.testing.assert_array_equal(np.uint8(centers)[labels].reshape(image.shape), image)
+
+    def test_extract_palette_agrees_with_dominant_colors(self):
+        image = np.zeros((40, 40, 3), dtype=np.uint8)
+        image[:10] = (0, 0, 255)
+        palette = extract_palette(image, k=2)
+        colors = get_dominant_colors(image, k=2, backend='histogram')
+        self.assertEqual(
+            sorted((c['color_hex'], c['percentage']) for c in palette),
+            sorted((c['color_hex'], c['percentage']) for c in colors)
+        )
+
+
+class ColorNameIndexTests(SimpleTestCase):
+    def test_lookup_names_palette_and_image_shapes(self):
+        index = get_color_index('css3')
+        indices, distances = index.lookup([[250, 5, 5], [0, 0, 120]])
+        self.assertEqual([index.names[i] for i in indices], ['red', 'navy'])
+        image = np.zeros((300, 300, 3), dtype=np.uint8)
+        image[:, 150:] = (255, 255, 255)
+        indices, distances = index.lookup(image)
+        self.assertEqual(indices.shape, (300, 300))
+        self.assertEqual(index.names[indices[0, 0]], 'black')
+        self.assertEqual(index.names[indices[0, -1]], 'white')
+        self.assertEqual(float(distances.max()), 0.0)
+
+    def test_from_file_reads_xkcd_format(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('# License: CC0\nvery dark purple\t#2a0134\ncloudy blue\t#acc2d9\t\n')
+        self.addCleanup(os.remove, f.name)
+        index = ColorNameIndex.from_file(f.name)
+        self.assertEqual(index.names, ['very dark purple', 'cloudy blue'])
+        self.assertEqual(index.nearest([170, 190, 220])['name'], 'cloudy blue')
+
+
+class TilingTests(SimpleTestCase):
+    def setUp(self):
+        # Smooth image so equalization and CLAHE have real work to do
+        self.image = cv2.resize(make_test_image(12, 16), (401, 301), interpolation=cv2.INTER_CUBIC)
+
+    def tiled(self):
+        return mock.patch.multiple(tiling, TILED_MIN_PIXELS=1000, STRIP_PIXELS=7000)
+
+    def test_two_pass_equalization_matches_whole_frame(self):
+        # 400 columns divide into the CLAHE grid, 301 rows do not
+        divisible_width = np.ascontiguousarray(self.image[:, :400])
+
+        def run():
+            return [
+                apply_histogram_equalization(self.image),
+                apply_clahe(self.image, 3.0),
+                apply_clahe(divisible_width),
+                apply_multiple_effects(self.image, ['clahe', 'clahe', 'grayscale', 'histogram_eq']),
+            ]
+
+        expected = run()
+        with self.tiled():
+            actual = run()
+        for want, got in zip(expected, actual):
+            np.testing.assert_array_equal(got, want)
+
+    def test_strip_wise_effects_and_clustering_match_whole_frame(self):
+        def run():
+            return [
+                apply_multiple_effects(self.image, ['grayscale', 'negative', 'brightness'], 20),
+                convert_to_hsv_channels(self.image)['hsv'],
+                quantize_colors(self.image, k=4, fit_pixels=2000)[0],
+                quantize_colors(self.image, k=4, backend='histogram')[0],
+            ]
+
+        expected = run()
+        with self.tiled():
+            actual = run()
+        for want, got in zip(expected, actual):
+            np.testing.assert_array_equal(got, want)
+
+
+@override_settings(IMAGE_PROCESSING_BUFFER_POOL={'MIN_BYTES': 0})
+class BufferPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.image = make_test_image(120, 90)
+        buffer_pool.clear()
+
+    def run_chains(self):
+        chains = [['negative', 'brightness'], ['grayscale', 'histogram_eq'], ['clahe', 'contrast'], []]
+        with buffer_pool.scope():
+            results = [apply_multiple_effects(self.image, chain, 20, 1.5).copy() for chain in chains]
+            results.append(convert_to_hsv_channels(self.image)['V'].copy())
+        return results
+
+    def test_scopes_reuse_buffers_without_changing_results(self):
+        original = self.image.copy()
+        expected = [
+            apply_multiple_effects(self.image, ['negative', 'brightness'], 20),
+            apply_multiple_effects(self.image, ['grayscale', 'histogram_eq']),
+            apply_multiple_effects(self.image, ['clahe', 'contrast'], 0, 1.5),
+            self.image,
+            convert_to_hsv_channels(self.image, ['V'])['V'],
+        ]
+        self.assertEqual(buffer_pool.stats()['misses'], 0)
+
+        first = self.run_chains()
+        misses = buffer_pool.stats()['misses']
+        second = self.run_chains()
+        with mock.patch.multiple(tiling, TILED_MIN_PIXELS=1000, STRIP_PIXELS=7000):
+            tiled = self.run_chains()
+
+        stats = buffer_pool.stats()
+        self.assertEqual(stats['misses'], misses)
+        self.assertGreater(stats['hits'], 0)
+        self.assertEqual(stats['bytes_in_use'], 0)
+        self.assertGreater(stats['bytes_held'], 0)
+        np.testing.assert_array_equal(self.image, original)
+        for results in (first, second, tiled):
+            for want, got in zip(expected, results):
+                np.testing.assert_array_equal(got, want)
+
+    def test_idle_buffers_are_bounded(self):
+        with override_settings(IMAGE_PROCESSING_BUFFER_POOL={'MIN_BYTES': 0, 'MAX_BYTES': 100}):
+            with buffer_pool.scope():
+                small = buffer_pool.acquire((8, 8))
+                buffer_pool.acquire((4, 4))
+                buffer_pool.release(small)
+                buffer_pool.acquire((9, 9))
+        # The least recently released size makes room for the last buffer
+        stats = buffer_pool.stats()
+        self.assertEqual((stats['buffers_held'], stats['bytes_held'], stats['dropped']), (2, 97, 1))
+
+
+class MaskEncodingTests(SimpleTestCase):
+    def test_rle_round_trips_masks_and_label_maps(self):
+        labels = np.random.RandomState(3).randint(0, 4, (30, 40)).astype(np.uint8)
+        for label, rle in enumerate(rle_encode_labels(labels, 3), start=1):
+            mask = cv2.compare(labels, label, cv2.CMP_EQ)
+            self.assertEqual(rle, rle_encode(mask))
+            np.testing.assert_array_equal(rle_decode(rle), mask)
+        # Masks starting inside begin with an empty outside run
+        self.assertEqual(rle_encode(np.full((2, 3), 255, np.uint8))['counts'], [0, 6])
+
+    def test_polygons_outline_regions(self):
+        mask = np.zeros((50, 50), dtype=np.uint8)
+        mask[10:20, 5:45] = 255
+        [polygon] = mask_polygons(mask)
+        self.assertEqual(sorted(map(tuple, polygon)), [(5, 10), (5, 19), (44, 10), (44, 19)])
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_runs_selected_cases(self):
+        results = run_benchmarks(sizes=['0.3'], repeat=2, warmup=0, pattern='apply_negative|endpoint:negative@')
+        self.assertEqual(sorted(results), ['endpoint:negative@0.3MP', 'function:apply_negative@0.3MP'])
+        for result in results.values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['mpix_per_s'], 0)
+
+    def test_regressions_past_threshold_are_reported(self):
+        baseline = {
+            'slow': {'p50_ms': 100.0, 'peak_mb': 10.0},
+            'fast': {'p50_ms': 0.1, 'peak_mb': 10.0},
+            'gone': {'p50_ms': 1.0, 'peak_mb': 1.0},
+        }
+        results = {
+            'slow': {'p50_ms': 130.0, 'peak_mb': 11.0},
+            'fast': {'p50_ms': 0.5, 'peak_mb': 10.0},
+            'new': {'p50_ms': 5.0, 'peak_mb': 1.0},
+        }
+        [regression] = find_regressions(results, baseline, threshold=0.25)
+        self.assertEqual((regression['case'], regression['metric']), ('slow', 'p50_ms'))
+        self.assertEqual(find_regressions(results, baseline, threshold=0.5), [])
+
+
+    def test_missing_baseline_fails_the_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            options = {'sizes': '0.3', 'repeat': 1, 'warmup': 0, 'only': 'apply_negative', 'baseline': baseline}
+            with self.assertRaisesMessage(CommandError, 'No baseline'):
+                call_command('benchmark_image_processing', stdout=io.StringIO(), **options)
+            call_command('benchmark_image_processing', save_baseline=True, stdout=io.StringIO(), **options)
+            call_command('benchmark_image_processing', threshold=100, stdout=io.StringIO(), **options)
+
+
+class ImageCodecTests(SimpleTestCase):
+    def test_decode_round_trip_is_lossless_for_png(self):
+        image = make_test_image()
+        np.testing.assert_array_equal(decode_image(make_upload(image)), image)
+
+    def test_decode_rejects_garbage(self):
+        upload = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        with self.assertRaises(ValueError):
+            decode_image(upload)
+
+
+class ImageApiTestCase(SimpleTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.image = make_test_image()
+        result_cache.clear()
+
+    def post(self, endpoint, HTTP_ACCEPT='application/json', **data):
+        data.setdefault('image', make_upload(self.image))
+        data = {key: value for key, value in data.items() if value is not None}
+        return self.client.post(
+            f'/api/image-processing/{endpoint}/', data, format='multipart', HTTP_ACCEPT=HTTP_ACCEPT
+        )
+
+
+class ImageProcessingApiTests(ImageApiTestCase):
+
+    def test_grayscale_returns_data_url(self):
+        response = self.post('grayscale')
+        self.assertEqual(response.status_code, 200, response.content)
+        processed_image = response.json()['processed_image']
+        self.assertTrue(processed_image.startswith('data:image/jpeg;base64,'))
+        result = decode_data_url(processed_image)
+        self.assertEqual(result.shape, self.image.shape[:2])
+
+    def test_gray_upload_is_processed_and_encoded_single_channel(self):
+        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        for endpoint, data in [('negative', {}), ('histogram-equalization', {}),
+                               ('multiple-effects', {'effects': ['negative', 'histogram_eq']})]:
+            with self.subTest(endpoint=endpoint):
+                response = self.post(endpoint, image=make_upload(gray), HTTP_ACCEPT='image/png', **data)
+                self.assertEqual(response.status_code, 200, response.content)
+                result = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+                self.assertEqual(result.shape, gray.shape)
+        np.testing.assert_array_equal(result, cv2.equalizeHist(255 - gray))
+
+    def test_image_accept_returns_raw_bytes(self):
+        response = self.post('negative', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        result = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+        np.testing.assert_array_equal(result, 255 - self.image)
+
+    def test_image_accept_falls_back_to_json_for_errors(self):
+        response = self.post('negative', image=SimpleUploadedFile('x.png', b'nope'), HTTP_ACCEPT='image/*')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('image', response.json())
+
+    @override_settings(IMAGE_PROCESSING_UPLOADS={'MAX_PIXELS': 100})
+    def test_pixel_limit_is_checked_before_decoding(self):
+        for endpoint in ('negative', 'multiple-effects', 'sessions'):
+            with self.subTest(endpoint=endpoint):
+                response = self.post(endpoint)
+                self.assertEqual(response.status_code, 400, response.content)
+                self.assertIn('too large', response.json()['image'][0])
+
+    def test_multiple_effects_explain_returns_plan(self):
+        response = self.post('multiple-effects', effects=['grayscale', 'negative', 'histogram_eq'], explain=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        plan = response.json()['plan']
+        # The result of grayscale is encoded single-channel, never expanded back
+        self.assertEqual([step['kind'] for step in plan['steps']], ['convert', 'lut', 'operation'])
+        self.assertEqual(plan['conversions'], 1)
+        self.assertNotIn('plan', self.post('multiple-effects', effects=['negative']).json())
+
+    def test_multipart_accept_sends_metadata_and_image_parts(self):
+        response = self.post('hsv-channels', HTTP_ACCEPT='multipart/mixed')
+        self.assertEqual(response.status_code, 200)
+        content_type = response['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/mixed; boundary='))
+        boundary = content_type.split('boundary=', 1)[1].encode()
+        parts = response.content.split(b'--' + boundary)[1:-1]
+        headers, body = parts[0].split(b'\r\n\r\n', 1)
+        metadata = json.loads(body.rstrip(b'\r\n'))
+        self.assertEqual(metadata['H_channel']['part'], 'H_channel')
+        self.assertNotIn('hsv_channel', metadata)
+        self.assertEqual(len(parts), 4)
+        for part in parts[1:]:
+            headers, body = part.split(b'\r\n\r\n', 1)
+            self.assertIn(b'Content-Type: image/jpeg', headers)
+            self.assertEqual(body[:2], b'\xff\xd8')
+
+    def test_single_hsv_channel_is_encoded_as_grayscale(self):
+        response = self.post('hsv-channels', channel='S', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        result = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+        np.testing.assert_array_equal(result, cv2.cvtColor(self.image, cv2.COLOR_BGR2HSV)[:, :, 1])
+
+        response = self.post('hsv-channels', include_composite=True)
+        self.assertLessEqual({'H_channel', 'S_channel', 'V_channel', 'hsv_channel'}, set(response.data))
+
+    def test_stage_timings_are_reported_and_exported(self):
+        response = self.post('negative')
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for name in ('parse', 'validate', 'decode', 'operation', 'encode', 'render', 'total'):
+            self.assertIn(name, stages)
+
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(IMAGE_PROCESSING_METRICS={'TOKEN': 'scrape'}):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer nope').status_code, 403)
+            metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+            # Same protection for the JSON cache statistics
+            self.assertEqual(self.client.get('/api/image-processing/cache-stats/').status_code, 403)
+            stats = self.client.get('/api/image-processing/cache-stats/', HTTP_AUTHORIZATION='Bearer scrape')
+            self.assertIn('misses', stats.json())
+        self.assertEqual(self.client.get('/api/image-processing/cache-stats/').status_code, 404)
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = metrics.content.decode()
+        self.assertIn('image_processing_stage_seconds_count{endpoint="negative",mode="",stage="decode"}', body)
+        self.assertIn('image_processing_requests_total{endpoint="negative",mode="",status="200"}', body)
+        self.assertIn('image_processing_result_cache{stat="misses"}', body)
+
+    def test_download_without_effects_returns_original_bytes(self):
+        upload = make_upload(self.image)
+        original = upload.read()
+        upload.seek(0)
+        response = self.post('download', image=upload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, original)
+
+    def test_download_with_effects_returns_jpeg(self):
+        response = self.post('download', effects=['negative', 'contrast'], contrast=1.5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content[:2], b'\xff\xd8')
+
+    def test_color_mask_reports_coverage(self):
+        response = self.post(
+            'color-analysis', mode='color_mask', color_space='RGB',
+            lower_range=[0, 0, 0], upper_range=[255, 255, 255],
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['coverage_percentage'], 100.0)
+
+    def test_compact_mask_formats_agree(self):
+        params = dict(mode='multi_segment', num_segments=3)
+        label_map = self.post('color-analysis', mask_format='label_map', **params).data
+        labels = cv2.imdecode(np.frombuffer(label_map['label_map'].data, np.uint8), cv2.IMREAD_UNCHANGED)
+        self.assertEqual(labels.shape, self.image.shape[:2])
+        self.assertNotIn('mask', label_map['segments'][0])
+
+        rle = self.post('color-analysis', mask_format='rle', **params).data
+        for segment in rle['segments']:
+            mask = rle_decode(segment['rle'])
+            np.testing.assert_array_equal(mask, cv2.compare(labels, segment['segment_id'], cv2.CMP_EQ))
+            self.assertEqual(segment['pixel_count'], cv2.countNonZero(mask))
+
+        default = self.post('color-analysis', **params).data
+        self.assertEqual(
+            [segment['pixel_count'] for segment in default['segments']],
+            [segment['pixel_count'] for segment in rle['segments']],
+        )
+        self.assertIn('mask', default['segments'][0])
+
+    def test_proxy_analysis_maps_regions_back_to_original_size(self):
+        image = np.zeros((400, 600, 3), dtype=np.uint8)
+        image[100:200, 300:500] = (0, 0, 255)
+        response = self.post(
+            'color-analysis', image=make_upload(image), mode='color_detection',
+            target_color='#FF0000', max_pixels=15000, HTTP_ACCEPT='image/png',
+        )
+        self.assertEqual(response.status_code, 200)
+        mask = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(mask.shape, (400, 600))
+
+        [full_box] = self.post(
+            'color-analysis', image=make_upload(image), mode='color_detection', target_color='#FF0000',
+        ).data['bounding_boxes']
+        response = self.post(
+            'color-analysis', image=make_upload(image), mode='color_detection',
+            target_color='#FF0000', max_pixels=15000,
+        )
+        self.assertEqual(response.data['proxy_scale'], 0.25)
+        [box] = response.data['bounding_boxes']
+        self.assertEqual((box['x'], box['y'], box['width'], box['height']), (300, 100, 200, 100))
+        self.assertEqual((full_box['x'], full_box['y'], full_box['width'], full_box['height']), (300, 100, 200, 100))
+        self.assertAlmostEqual(box['area'], full_box['area'], delta=full_box['area'] * 0.05)
+
+    def test_invalid_upload_is_rejected(self):
+        response = self.post('negative', image=SimpleUploadedFile('x.png', b'nope'))
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchEffectsApiTests(ImageApiTestCase):
+    def read_zip(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        return archive, json.loads(archive.read('manifest.json'))
+
+    def test_failures_are_reported_in_the_manifest(self):
+        broken = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        response = self.post(
+            'batch', image=None, images=[make_upload(name='a.png'), broken, make_upload(name='a.png')],
+            effects=['negative'],
+        )
+        archive, manifest = self.read_zip(response)
+        self.assertEqual((manifest['succeeded'], manifest['failed']), (2, 1))
+        self.assertEqual(sorted(archive.namelist()), ['a.jpg', 'a_2.jpg', 'manifest.json'])
+        [failure] = [item for item in manifest['items'] if item['status'] == 'failed']
+        self.assertEqual(failure['source'], 'broken.png')
+
+    def test_archive_members_are_processed(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr('photos/one.png', encode_image(self.image, 'PNG'))
+            zf.writestr('photos/', b'')
+        archive_upload = SimpleUploadedFile('photos.zip', buffer.getvalue(), content_type='application/zip')
+
+        response = self.post('batch', image=None, archive=archive_upload, effects=['grayscale'], format='PNG')
+        archive, manifest = self.read_zip(response)
+        self.assertEqual(manifest['succeeded'], 1)
+        result = cv2.imdecode(np.frombuffer(archive.read('one.png'), np.uint8), cv2.IMREAD_COLOR)
+        np.testing.assert_array_equal(result, apply_grayscale(self.image))
+
+    def test_archive_limits(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            # Compresses to a few KB, far over the member limit once expanded
+            zf.writestr('bomb.png', b'\0' * (2 * 1024 * 1024))
+            zf.writestr('one.png', encode_image(self.image, 'PNG'))
+        upload = lambda: SimpleUploadedFile('photos.zip', buffer.getvalue(), content_type='application/zip')
+
+        with override_settings(IMAGE_PROCESSING_UPLOADS={'MAX_BYTES': 1024 * 1024}):
+            archive, manifest = self.read_zip(self.post('batch', image=None, archive=upload(), effects=['negative']))
+        self.assertEqual((manifest['succeeded'], manifest['failed']), (1, 1))
+        self.assertIn('should not exceed', manifest['items'][0]['error'])
+
+        with override_settings(IMAGE_PROCESSING_BATCH={'MAX_ARCHIVE_BYTES': 1024}):
+            response = self.post('batch', image=None, archive=upload(), effects=['negative'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('archive', response.json())
+
+    def test_async_chunks_keep_order_and_close_the_stream(self):
+        closed = []
+
+        def chunks():
+            try:
+                yield from (b'a', b'b', b'c')
+            finally:
+                closed.append(True)
+
+        async def read(iterator, count=None):
+            collected = []
+            async for chunk in iterator:
+                collected.append(chunk)
+                if len(collected) == count:
+                    break
+            await iterator.aclose()
+            return collected
+
+        self.assertEqual(async_to_sync(read)(aiter_chunks(chunks())), [b'a', b'b', b'c'])
+        self.assertEqual(async_to_sync(read)(aiter_chunks(chunks()), count=1), [b'a'])
+        self.assertEqual(closed, [True, True])
+
+    @override_settings(IMAGE_PROCESSING_UPLOADS={'MAX_PIXELS': 100})
+    def test_images_over_the_pixel_limit_fail_in_the_manifest(self):
+        archive, manifest = self.read_zip(self.post('batch', image=None, images=[make_upload()], effects=['negative']))
+        self.assertEqual(archive.namelist(), ['manifest.json'])
+        self.assertIn('too large', manifest['items'][0]['error'])
+
+    def test_empty_batch_is_rejected(self):
+        response = self.post('batch', image=None, effects=['negative'])
+        self.assertEqual(response.status_code, 400)
+
+
+class EditingSessionApiTests(ImageApiTestCase):
+    def setUp(self):
+        super().setUp()
+        editing_sessions.clear()
+
+    def create_session(self, image):
+        response = self.post('sessions', image=make_upload(image))
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def test_preview_and_render_apply_parameters_to_the_stored_image(self):
+        image = make_test_image(300, 400)
+        with override_settings(IMAGE_PROCESSING_SESSIONS={'PREVIEW_MAX_PIXELS': 20000}):
+            session = self.create_session(image)
+        self.assertEqual((session['preview_width'], session['preview_height']), (100, 75))
+
+        params = {'effects': ['brightness', 'negative'], 'brightness': 25}
+        for url, source in [(session['preview_url'], cv2.pyrDown(cv2.pyrDown(image))), (session['render_url'], image)]:
+            response = self.client.post(url, params, format='json', HTTP_ACCEPT='image/png')
+            self.assertEqual(response.status_code, 200, response.content)
+            result = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+            np.testing.assert_array_equal(result, apply_multiple_effects(source, params['effects'], 25))
+
+    def test_sessions_are_private_bounded_and_deletable(self):
+        session = self.create_session(self.image)
+        url = f"/api/image-processing/sessions/{session['session_id']}/"
+
+        other = APIClient()
+        other.force_authenticate(user=SimpleNamespace(id=5, is_authenticated=True))
+        self.assertEqual(other.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).json()['width'], self.image.shape[1])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.post(session['preview_url'], {}, format='json').status_code, 404)
+
+        with override_settings(IMAGE_PROCESSING_SESSIONS={'MAX_SESSIONS': 2}):
+            first, second, third = (editing_sessions.create(self.image.copy()) for _ in range(3))
+            self.assertIs(editing_sessions.get(third.id), third)
+            self.assertEqual(editing_sessions.stats(), {'sessions': 2, 'bytes': 2 * self.image.nbytes, 'evicted': 1})
+            # Evicted from this process only: decoded again from the shared cache
+            reloaded = editing_sessions.get(first.id)
+        self.assertIsNot(reloaded, first)
+        np.testing.assert_array_equal(reloaded.image, self.image)
+
+    def test_session_is_served_by_any_process(self):
+        image = make_test_image(300, 400)
+        with override_settings(IMAGE_PROCESSING_SESSIONS={'PREVIEW_MAX_PIXELS': 20000}):
+            session = self.create_session(image)
+        # Another process has none of the decoded images, only the shared cache
+        editing_sessions.clear()
+
+        response = self.client.post(
+            session['preview_url'], {'effects': ['negative']}, format='json', HTTP_ACCEPT='image/png'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        result = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+        np.testing.assert_array_equal(result, 255 - cv2.pyrDown(cv2.pyrDown(image)))
+        self.assertEqual(editing_sessions.stats()['sessions'], 1)
+
+
+class ResultCacheTests(ImageApiTestCase):
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.post('brightness-contrast', brightness=20, contrast=1.5)
+        second = self.post('brightness-contrast', brightness=20.0, contrast=1.5)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(result_cache.stats()['hits'], 1)
+
+    def test_parameters_and_format_are_part_of_the_key(self):
+        self.post('brightness-contrast', brightness=20)
+        self.assertEqual(self.post('brightness-contrast', brightness=25)['X-Cache'], 'MISS')
+        self.assertEqual(self.post('brightness-contrast', brightness=20, HTTP_ACCEPT='image/png')['X-Cache'], 'MISS')
+        self.assertNotEqual(
+            make_cache_key('negative', b'abc', {}),
+            make_cache_key('grayscale', b'abc', {}),
+        )
+
+    def test_local_lru_evicts_least_recently_used_by_size(self):
+        lru = LocalLRUCache(max_bytes=10)
+        lru.set('a', b'1234', timeout=60)
+        lru.set('b', b'1234', timeout=60)
+        lru.get('a')
+        lru.set('c', b'1234', timeout=60)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'1234')
+        self.assertEqual(lru.total_bytes, 8)
+        lru.set('expired', b'1', timeout=-1)
+        self.assertIsNone(lru.get('expired'))
+
+
+class ImageTaskExecutorTests(ImageApiTestCase):
+    @override_settings(IMAGE_PROCESSING_EXECUTOR={'MAX_WORKERS': 1, 'MAX_QUEUE': 0})
+    def test_runs_function_on_shared_image(self):
+        executor = ImageTaskExecutor()
+        self.addCleanup(executor.shutdown)
+        result = executor.run(apply_negative, self.image)
+        np.testing.assert_array_equal(result, 255 - self.image)
+
+    @override_settings(IMAGE_PROCESSING_EXECUTOR={'MAX_WORKERS': 1, 'MAX_QUEUE': 0})
+    def test_refuses_work_when_queue_is_full(self):
+        executor = ImageTaskExecutor()
+        self.addCleanup(executor.shutdown)
+        _, slots = executor._get_pool()
+        slots.acquire()
+        self.addCleanup(slots.release)
+        with self.assertRaises(ExecutorBusy):
+            executor.run(apply_negative, self.image)
+
+    def test_busy_pool_returns_service_unavailable(self):
+        with mock.patch('image_processing.analysis.image_executor.run', side_effect=ExecutorBusy('full')):
+            response = self.post('color-analysis', mode='dominant_colors')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    IMAGE_PROCESSING_EXECUTOR={'ENABLED': False},
+)
+class ColorAnalysisJobTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = UserFactory()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        result_cache.clear()
+        async_to_sync(get_channel_layer().flush)()
+
+    def submit(self, **data):
+        data.setdefault('image', make_upload(make_test_image()))
+        return self.client.post('/api/image-processing/jobs/', data, format='multipart')
+
+    def run_queued_job(self):
+        message = async_to_sync(get_channel_layer().receive)(get_job_settings()['CHANNEL'])
+        run_job(message['job_id'])
+        return message['job_id']
+
+    def test_submit_poll_and_fetch_result(self):
+        response = self.submit(mode='dominant_colors', num_colors=3)
+        self.assertEqual(response.status_code, 202, response.content)
+        job_id = response.data['job_id']
+        self.assertEqual(response.data['status'], 'queued')
+
+        pending = self.client.get(f'/api/image-processing/jobs/{job_id}/result/', HTTP_ACCEPT='application/json')
+        self.assertEqual(pending.status_code, 409)
+
+        self.assertEqual(self.run_queued_job(), job_id)
+
+        detail = self.client.get(f'/api/image-processing/jobs/{job_id}/')
+        self.assertEqual(detail.data['status'], 'completed')
+        result = self.client.get(f'/api/image-processing/jobs/{job_id}/result/', HTTP_ACCEPT='application/json')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(result.json()['dominant_colors']), 3)
+
+    def test_jobs_past_their_enqueue_deadline_fail(self):
+        with override_settings(IMAGE_PROCESSING_JOBS={'QUEUE_TIMEOUT': -1}):
+            job_id = self.submit(mode='dominant_colors').data['job_id']
+        detail = self.client.get(f'/api/image-processing/jobs/{job_id}/')
+        self.assertEqual(detail.data['status'], 'failed')
+        self.assertIn('No worker', detail.data['error'])
+        # The message arriving late no longer runs the job
+        self.run_queued_job()
+        self.assertEqual(self.client.get(f'/api/image-processing/jobs/{job_id}/').data['status'], 'failed')
+
+    def test_jobs_are_private_to_their_owner(self):
+        job_id = self.submit(mode='dominant_colors').data['job_id']
+        self.client.force_authenticate(UserFactory())
+        self.assertEqual(self.client.get(f'/api/image-processing/jobs/{job_id}/').status_code, 404)
+
+    def test_anonymous_users_cannot_submit(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.submit(mode='dominant_colors').status_code, (401, 403))
+
+    def test_completion_is_pushed_to_the_owner_group(self):
+        job_id = self.submit(mode='color_quantization', quantization_levels=4).data['job_id']
+
+        async def scenario():
+            communicator = WebsocketCommunicator(ImageJobConsumer.as_asgi(), '/ws/image-jobs/')
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await sync_to_async(self.run_queued_job)()
+            event = await communicator.receive_json_from(timeout=5)
+            await communicator.disconnect()
+            return event
+
+        event = async_to_sync(scenario)()
+        self.assertEqual(event['job_id'], job_id)
+        self.assertEqual(event['status'], 'completed')
@@ -0,0 +1,232 @@
+"""
+Strip-wise (tiled) execution for large images.
+
+The decoded input and the final output are the only full-size buffers:
+pixel-local work (point effects, colour conversions, cluster assignment)
+runs over horizontal strips of about STRIP_PIXELS pixels and writes into a
+single preallocated output, so intermediates stay bounded by the strip size.
+Operations that need global or neighbourhood context run in two passes:
+histogram equalization accumulates one global histogram first, CLAHE builds
+its per-tile lookup tables first; the second pass maps every strip through
+those tables exactly as OpenCV would on the whole frame.
+"""
+import cv2
+import numpy as np
+
+# Pixels per strip; bounds every per-strip intermediate (~1 MP)
+STRIP_PIXELS = 1 << 20
+# Images above this many pixels go through the strip-wise code paths
+TILED_MIN_PIXELS = 1 << 24
+
+
+def should_tile(cv2_image):
+    return cv2_image.shape[0] * cv2_image.shape[1] > TILED_MIN_PIXELS
+
+
+def iter_strips(height, width, strip_pixels=None):
+    """Yield row slices covering an image in strips of about strip_pixels (default STRIP_PIXELS) pixels"""
+    rows = max(1, (strip_pixels or STRIP_PIXELS) // max(width, 1))
+    for start in range(0, height, rows):
+        yield slice(start, min(start + rows, height))
+
+
+def map_strips(func, cv2_image, strip_pixels=None):
+    """
+    Apply a pixel-local func strip by strip and gather the results into one
+    output array (func may change the channel count or dtype, not the rows).
+    A func returning a tuple or dict of arrays gets one output per entry.
+    """
+    height, width = cv2_image.shape[:2]
+    outputs = None
+    for rows in iter_strips(height, width, strip_pixels):
+        result = func(cv2_image[rows])
+        parts = _as_parts(result)
+        if outputs is None:
+            outputs = {
+                key: np.empty((height,) + part.shape[1:], dtype=part.dtype) for key, part in parts.items()
+            }
+        for key, part in parts.items():
+            outputs[key][rows] = part
+
+    if isinstance(result, dict):
+        return outputs
+    if isinstance(result, tuple):
+        return tuple(outputs[index] for index in range(len(outputs)))
+    return outputs[None]
+
+
+def _as_parts(result):
+    if isinstance(result, dict):
+        return result
+    if isinstance(result, tuple):
+        return dict(enumerate(result))
+    return {None: result}
+
+
+def map_tiled(func, cv2_image):
+    """func(cv2_image), run strip by strip when the image is large enough to tile"""
+    if should_tile(cv2_image):
+        return map_strips(func, cv2_image)
+    return func(cv2_image)
+
+
+def map_into(func, cv2_image, out):
+    """
+    Run func(src, dst) writing into the preallocated out (an array or a dict
+    of arrays), strip by strip when the image is large enough to tile.
+    """
+    if not should_tile(cv2_image):
+        func(cv2_image, out)
+        return out
+    for rows in iter_strips(cv2_image.shape[0], cv2_image.shape[1]):
+        dst = {key: part[rows] for key, part in out.items()} if isinstance(out, dict) else out[rows]
+        func(cv2_image[rows], dst)
+    return out
+
+
+def equalize_hist_lut(hist):
+    """Lookup table of cv2.equalizeHist for a 256-bin histogram (same rounding)"""
+    hist = np.asarray(hist, dtype=np.int64)
+    total = int(hist.sum())
+    first = int(np.flatnonzero(hist)[0]) if total else 0
+    if total == 0 or hist[first] == total:
+        return np.full(256, first, dtype=np.uint8)
+
+    scale = 255.0 / (total - hist[first])
+    lut = np.zeros(256, dtype=np.uint8)
+    cumulative = np.cumsum(hist[first + 1:])
+    lut[first + 1:] = np.clip(np.rint(cumulative * scale), 0, 255)
+    return lut
+
+
+def equalize_luma_strips(cv2_image, strip_pixels=None):
+    """
+    apply_histogram_equalization in two passes: a global Y histogram
+    accumulated over strips, then every strip mapped through its LUT.
+    """
+    height, width = cv2_image.shape[:2]
+    hist = np.zeros(256, dtype=np.int64)
+    for rows in iter_strips(height, width, strip_pixels):
+        luma = cv2.cvtColor(cv2_image[rows], cv2.COLOR_BGR2YUV)[:, :, 0]
+        hist += np.bincount(luma.ravel(), minlength=256)
+    lut = equalize_hist_lut(hist)
+
+    def equalize(strip):
+        yuv = cv2.cvtColor(strip, cv2.COLOR_BGR2YUV)
+        yuv[:, :, 0] = cv2.LUT(yuv[:, :, 0], lut)
+        return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+
+    return map_strips(equalize, cv2_image, strip_pixels)
+
+
+def _reflect_101(indices, size):
+    """Map indices past the end back inside like cv2.BORDER_REFLECT_101"""
+    indices = np.asarray(indices)
+    return np.where(indices < size, indices, 2 * (size - 1) - indices)
+
+
+def clahe_luts(lightness_rows, height, width, clip_limit=2.0, tile_grid_size=(8, 8)):
+    """
+    Per-tile CLAHE lookup tables (grid_y x grid_x x 256), computed like
+    cv2.createCLAHE: the plane is padded (reflect-101) to a multiple of the
+    grid, each tile histogram is clipped and the excess redistributed.
+    lightness_rows(rows) must return the 8-bit plane for an array of row
+    indices, so only one row of tiles is materialised at a time.
+    """
+    grid_x, grid_y = tile_grid_size
+    if width % grid_x == 0 and height % grid_y == 0:
+        tile_w, tile_h = width // grid_x, height // grid_y
+    else:
+        # Like OpenCV, pad both axes as soon as either does not divide,
+        # by a full extra tile step on an axis that already divides
+        tile_w = (width + grid_x - width % grid_x) // grid_x
+        tile_h = (height + grid_y - height % grid_y) // grid_y
+    tile_area = tile_w * tile_h
+    limit = max(int(clip_limit * tile_area / 256), 1) if clip_limit > 0 else 0
+    lut_scale = np.float32(255.0 / tile_area)
+
+    pad_right = grid_x * tile_w - width
+    luts = np.empty((grid_y, grid_x, 256), dtype=np.uint8)
+    for ty in range(grid_y):
+        rows = _reflect_101(np.arange(ty * tile_h, (ty + 1) * tile_h), height)
+        plane = lightness_rows(rows)
+        if pad_right:
+            plane = cv2.copyMakeBorder(plane, 0, 0, 0, pad_right, cv2.BORDER_REFLECT_101)
+
+        for tx in range(grid_x):
+            hist = np.bincount(plane[:, tx * tile_w:(tx + 1) * tile_w].ravel(), minlength=256)
+            if limit > 0:
+                clipped = int(np.maximum(hist - limit, 0).sum())
+                hist = np.minimum(hist, limit)
+                hist += clipped // 256
+                residual = clipped % 256
+                if residual:
+                    step = max(256 // residual, 1)
+                    hist[np.arange(0, 256, step)[:residual]] += 1
+            cumulative = np.cumsum(hist).astype(np.float32)
+            luts[ty, tx] = np.clip(np.rint(cumulative * lut_scale), 0, 255)
+    return luts, (tile_w, tile_h)
+
+
+def _clahe_weights(start, count, tile_size, n_tiles):
+    """Neighbouring tile indices and interpolation weight along one axis"""
+    position = np.arange(start, start + count, dtype=np.float32) * np.float32(1.0 / tile_size) - np.float32(0.5)
+    first = np.floor(position).astype(np.int64)
+    weight = position - first
+    second = np.minimum(first + 1, n_tiles - 1)
+    first = np.maximum(first, 0)
+    return first, second, weight.astype(np.float32)
+
+
+def _runs(values):
+    """(start, stop) of every run of equal consecutive values"""
+    edges = np.flatnonzero(np.diff(values)) + 1
+    bounds = np.concatenate(([0], edges, [len(values)]))
+    return zip(bounds[:-1], bounds[1:])
+
+
+def clahe_interpolate(plane, row_start, luts, tile_size):
+    """
+    Map one strip of the 8-bit plane through the bilinearly blended tile LUTs.
+    Within each block between tile centres the four neighbouring LUTs are
+    fixed, so each block costs four cv2.LUT calls and one weighted sum.
+    """
+    grid_y, grid_x = luts.shape[:2]
+    tile_w, tile_h = tile_size
+    tx1, tx2, xa = _clahe_weights(0, plane.shape[1], tile_w, grid_x)
+    ty1, ty2, ya = _clahe_weights(row_start, plane.shape[0], tile_h, grid_y)
+    xa1 = np.float32(1.0) - xa
+    ya1 = np.float32(1.0) - ya
+
+    out = np.empty_like(plane)
+    for r0, r1 in _runs(ty1 * grid_y + ty2):
+        top, bottom = luts[ty1[r0]], luts[ty2[r0]]
+        wy, wy1 = ya[r0:r1, None], ya1[r0:r1, None]
+        for c0, c1 in _runs(tx1 * grid_x + tx2):
+            block = plane[r0:r1, c0:c1]
+            left, right = tx1[c0], tx2[c0]
+            wx, wx1 = xa[c0:c1], xa1[c0:c1]
+            upper = cv2.LUT(block, top[left]) * wx1 + cv2.LUT(block, top[right]) * wx
+            lower = cv2.LUT(block, bottom[left]) * wx1 + cv2.LUT(block, bottom[right]) * wx
+            out[r0:r1, c0:c1] = np.clip(np.rint(upper * wy1 + lower * wy), 0, 255)
+    return out
+
+
+def clahe_lab_strips(cv2_image, clip_limit=2.0, tile_grid_size=(8, 8), strip_pixels=None):
+    """
+    apply_clahe in two passes: per-tile LUTs from the L channel (one row of
+    tiles at a time), then every strip interpolated and converted back.
+    """
+    height, width = cv2_image.shape[:2]
+
+    def lightness_rows(rows):
+        return cv2.cvtColor(cv2_image[rows], cv2.COLOR_BGR2LAB)[:, :, 0]
+
+    luts, tile_size = clahe_luts(lightness_rows, height, width, clip_limit, tile_grid_size)
+
+    out = np.empty_like(cv2_image)
+    for rows in iter_strips(height, width, strip_pixels):
+        lab = cv2.cvtColor(cv2_image[rows], cv2.COLOR_BGR2LAB)
+        lab[:, :, 0] = clahe_interpolate(lab[:, :, 0], rows.start, luts, tile_size)
+        out[rows] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    return out
@@ -6,8 +6,17 @@ from .views import (
     HSVChannelView,
     HistogramEqualizationView,
     MultipleEffectsView,
+    BatchEffectsView,
     ImageDownloadView,
-    ColorAnalysisView
+    ColorAnalysisView,
+    ColorAnalysisJobView,
+    ImageJobDetailView,
+    ImageJobResultView,
+    EditingSessionCreateView,
+    EditingSessionDetailView,
+    EditingSessionPreviewView,
+    EditingSessionRenderView,
+    CacheStatsView
 )
 
 app_name = 'image_processing'
@@ -22,10 +31,27 @@ urlpatterns = [
     
     # Multiple effects API
     path('multiple-effects/', MultipleEffectsView.as_view(), name='multiple_effects'),
+
+    # Batch API: one effect chain over many images, streamed back as a ZIP
+    path('batch/', BatchEffectsView.as_view(), name='batch'),
+    
+    # Editing sessions: upload once, then preview/render with parameters only
+    path('sessions/', EditingSessionCreateView.as_view(), name='sessions'),
+    path('sessions/<str:session_id>/', EditingSessionDetailView.as_view(), name='session_detail'),
+    path('sessions/<str:session_id>/preview/', EditingSessionPreviewView.as_view(), name='session_preview'),
+    path('sessions/<str:session_id>/render/', EditingSessionRenderView.as_view(), name='session_render'),
     
     # Color analysis API
     path('color-analysis/', ColorAnalysisView.as_view(), name='color_analysis'),
+
+    # Background color analysis jobs
+    path('jobs/', ColorAnalysisJobView.as_view(), name='jobs'),
+    path('jobs/<str:job_id>/', ImageJobDetailView.as_view(), name='job_detail'),
+    path('jobs/<str:job_id>/result/', ImageJobResultView.as_view(), name='job_result'),
     
     # Download processed image
     path('download/', ImageDownloadView.as_view(), name='download'),
+
+    # Result cache statistics
+    path('cache-stats/', CacheStatsView.as_view(), name='cache_stats'),
 ]
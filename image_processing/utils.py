@@ -3,6 +3,67 @@ import numpy as np
 from PIL import Image
 import base64
 import io
+import warnings
+
+from django.conf import settings
+
+from .buffers import buffer_pool
+from .color_names import DEFAULT_COLOR_DICTIONARY, get_color_index
+from .metrics import stage
+from .tiling import (
+    clahe_lab_strips,
+    equalize_luma_strips,
+    iter_strips,
+    map_into,
+    map_strips,
+    map_tiled,
+    should_tile,
+)
+
+
+DEFAULT_UPLOAD_SETTINGS = {
+    'MAX_BYTES': 10 * 1024 * 1024,
+    # Decoded size limit, checked on the image header before anything is decoded
+    'MAX_PIXELS': 200 * 1000 * 1000,
+}
+
+
+def get_upload_settings():
+    return {**DEFAULT_UPLOAD_SETTINGS, **getattr(settings, 'IMAGE_PROCESSING_UPLOADS', {})}
+
+
+def check_pixel_limit(width, height):
+    """Raise ValueError when a width x height image exceeds the decoded size limit (MAX_PIXELS)"""
+    max_pixels = get_upload_settings()['MAX_PIXELS']
+    if width * height > max_pixels:
+        raise ValueError(
+            f"Image is too large: {width}x{height} pixels (limit {max_pixels} pixels)"
+        )
+
+
+def image_dimensions(data):
+    """(width, height) read from the header of encoded image bytes, without decoding the pixels"""
+    with warnings.catch_warnings():
+        # The explicit MAX_PIXELS check replaces Pillow's decompression-bomb warning
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        try:
+            return Image.open(io.BytesIO(data)).size
+        except Image.DecompressionBombError as e:
+            raise ValueError(f"Image is too large: {e}")
+        except (OSError, SyntaxError):
+            raise ValueError("Could not decode image")
+
+
+# Decode like PIL did: always 3-channel BGR and no implicit EXIF rotation
+DECODE_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+# Same, but grayscale files stay single-channel (2-D arrays)
+DECODE_FLAGS_KEEP_GRAY = cv2.IMREAD_ANYCOLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+# Encoder settings per output format; JPEG quality matches PIL's default
+ENCODE_FORMATS = {
+    'JPEG': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 75]),
+    'PNG': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+}
 
 
 def pil_to_cv2(pil_image):
@@ -25,24 +86,117 @@ def cv2_to_pil(cv2_image):
     return pil_image
 
 
+def read_image_bytes(image_file):
+    """
+    Return the raw bytes of an uploaded file without copying when possible.
+    In-memory uploads expose their BytesIO buffer directly; uploads spooled
+    to disk are read once.
+    """
+    raw = getattr(image_file, 'file', None)
+    if isinstance(raw, io.BytesIO):
+        return raw.getbuffer()
+    image_file.seek(0)
+    return image_file.read()
+
+
+def decode_image_bytes(data, keep_gray=False):
+    """
+    Decode encoded image bytes (or any buffer) into an OpenCV BGR array.
+    keep_gray: decode grayscale files into single-channel arrays instead
+    """
+    flags = DECODE_FLAGS_KEEP_GRAY if keep_gray else DECODE_FLAGS
+    with stage('decode'):
+        cv2_image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if cv2_image is None:
+        raise ValueError("Could not decode image")
+    return cv2_image
+
+
+def decode_image(image_file, keep_gray=False):
+    """Decode an uploaded image file straight into an OpenCV BGR array (see decode_image_bytes)"""
+    return decode_image_bytes(read_image_bytes(image_file), keep_gray)
+
+
+def encode_image(cv2_image, format='JPEG'):
+    """Encode an OpenCV image (BGR or single channel) to bytes"""
+    extension, params = ENCODE_FORMATS[format.upper()]
+    with stage('encode'):
+        ok, buffer = cv2.imencode(extension, cv2_image, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {format}")
+    return buffer.tobytes()
+
+
+class EncodedImage:
+    """
+    Encoded image bytes placed in a response payload.
+    Renderers decide how it goes over the wire: a data URL inside JSON,
+    raw bytes for image/* or one part of a multipart/mixed response.
+    """
+
+    def __init__(self, data, format='JPEG'):
+        self.data = data
+        self.format = format.upper()
+
+    @classmethod
+    def from_array(cls, cv2_image, format='JPEG'):
+        return cls(encode_image(cv2_image, format), format)
+
+    @property
+    def content_type(self):
+        return f"image/{self.format.lower()}"
+
+    @property
+    def extension(self):
+        return ENCODE_FORMATS[self.format][0]
+
+    def to_data_url(self):
+        img_str = base64.b64encode(self.data).decode()
+        return f"data:{self.content_type};base64,{img_str}"
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        return isinstance(other, EncodedImage) and (self.format, self.data) == (other.format, other.data)
+
+
 def image_to_base64(image, format='JPEG'):
-    """Convert PIL Image to base64 string"""
-    buffer = io.BytesIO()
-    image.save(buffer, format=format)
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    """Convert an OpenCV array or a PIL Image to a base64 data URL"""
+    if isinstance(image, np.ndarray):
+        data = encode_image(image, format)
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, format=format)
+        data = buffer.getvalue()
+    img_str = base64.b64encode(data).decode()
     return f"data:image/{format.lower()};base64,{img_str}"
 
 
-def apply_grayscale(cv2_image):
-    """Convert image to grayscale"""
-    gray = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2GRAY)
-    # Convert back to 3-channel for consistency
-    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+def apply_grayscale(cv2_image, expand=True):
+    """
+    Convert image (BGR or already single-channel) to grayscale
+    expand: return it as 3-channel BGR; otherwise as one 8-bit channel
+    """
+    def convert(image, dst):
+        if not expand:
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+            return
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        # Convert back to 3-channel for consistency
+        cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=dst)
+
+    if not expand and cv2_image.ndim == 2:
+        return cv2_image.copy()
+    shape = cv2_image.shape[:2] + ((3,) if expand else ())
+    return map_into(convert, cv2_image, buffer_pool.acquire(shape))
 
 
 def apply_negative(cv2_image):
     """Apply negative effect to image"""
-    return 255 - cv2_image
+    return map_into(
+        lambda image, dst: cv2.bitwise_not(image, dst=dst), cv2_image, buffer_pool.acquire(cv2_image.shape)
+    )
 
 
 def adjust_brightness_contrast(cv2_image, brightness=0, contrast=1.0):
@@ -55,108 +209,351 @@ def adjust_brightness_contrast(cv2_image, brightness=0, contrast=1.0):
     brightness = int(brightness * 2.55)
     
     # Apply brightness and contrast
-    adjusted = cv2.convertScaleAbs(cv2_image, alpha=contrast, beta=brightness)
+    adjusted = map_into(
+        lambda image, dst: cv2.convertScaleAbs(image, dst=dst, alpha=contrast, beta=brightness),
+        cv2_image, buffer_pool.acquire(cv2_image.shape)
+    )
     return adjusted
 
 
-def convert_to_hsv_channels(cv2_image):
+HSV_CHANNELS = ('H', 'S', 'V', 'hsv')
+
+
+def convert_to_hsv_channels(cv2_image, channels=HSV_CHANNELS):
     """
-    Convert image to HSV and return individual channels
-    Returns: dict with 'H', 'S', 'V' channels and 'hsv' combined
+    Convert image to HSV and return the requested channels
+    channels: any of 'H', 'S', 'V' (single-channel 8-bit images) and 'hsv'
+              (the HSV image converted back to BGR for display)
+    Returns: dict with one image per requested channel
     """
-    hsv = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2HSV)
-    h, s, v = cv2.split(hsv)
-    
-    # Convert single channels back to 3-channel for display
-    h_3ch = cv2.cvtColor(h, cv2.COLOR_GRAY2BGR)
-    s_3ch = cv2.cvtColor(s, cv2.COLOR_GRAY2BGR)
-    v_3ch = cv2.cvtColor(v, cv2.COLOR_GRAY2BGR)
-    hsv_3ch = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-    
-    return {
-        'H': h_3ch,
-        'S': s_3ch,
-        'V': v_3ch,
-        'hsv': hsv_3ch
-    }
+    indexes = [(name, 'HSV'.index(name)) for name in channels if name != 'hsv']
+    outputs = {name: buffer_pool.acquire(cv2_image.shape[:2]) for name, _ in indexes}
+    if 'hsv' in channels:
+        outputs['hsv'] = buffer_pool.acquire(cv2_image.shape)
+
+    def convert(image, dst):
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        for name, index in indexes:
+            cv2.extractChannel(hsv, index, dst=dst[name])
+        if 'hsv' in dst:
+            cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=dst['hsv'])
+
+    # Large images are converted strip by strip into the requested outputs
+    return map_into(convert, cv2_image, outputs)
 
 
 def apply_histogram_equalization(cv2_image):
     """Apply histogram equalization to enhance image contrast"""
+    if cv2_image.ndim == 2:
+        # A single-channel image is its own luma (Y = gray, U = V = 128)
+        return cv2.equalizeHist(cv2_image, dst=buffer_pool.acquire(cv2_image.shape))
+    if should_tile(cv2_image):
+        # Two passes: global Y histogram over strips, then the LUT per strip
+        return equalize_luma_strips(cv2_image)
     # Convert to YUV color space
-    yuv = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2YUV)
+    yuv = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2YUV, dst=buffer_pool.acquire(cv2_image.shape))
     
     # Apply histogram equalization to the Y channel (luminance)
     yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
     
     # Convert back to BGR
-    result = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+    result = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR, dst=buffer_pool.acquire(cv2_image.shape))
+    buffer_pool.release(yuv)
     return result
 
 
 def apply_clahe(cv2_image, clip_limit=2.0, tile_grid_size=(8, 8)):
     """Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)"""
+    if should_tile(cv2_image):
+        # Two passes: per-tile LUTs first, then bilinear interpolation per strip
+        return clahe_lab_strips(cv2_image, clip_limit, tile_grid_size)
     # Convert to LAB color space
-    lab = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2LAB)
+    lab = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2LAB, dst=buffer_pool.acquire(cv2_image.shape))
     
     # Apply CLAHE to the L channel
     clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
     lab[:, :, 0] = clahe.apply(lab[:, :, 0])
     
     # Convert back to BGR
-    result = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    result = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=buffer_pool.acquire(cv2_image.shape))
+    buffer_pool.release(lab)
     return result
 
 
-def apply_multiple_effects(cv2_image, effects, brightness=0, contrast=1.0):
+def point_effect_lut(effect, brightness=0, contrast=1.0):
+    """
+    Build the uint8 lookup table of a single point effect.
+    The table is produced by running the effect itself over the 0..255 ramp,
+    so applying it with cv2.LUT gives exactly the same pixels.
+    """
+    ramp = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    if effect == 'negative':
+        table = apply_negative(ramp)
+    elif effect == 'brightness':
+        table = adjust_brightness_contrast(ramp, brightness=brightness, contrast=1.0)
+    elif effect == 'contrast':
+        table = adjust_brightness_contrast(ramp, brightness=0, contrast=contrast)
+    else:
+        raise ValueError(f"'{effect}' is not a point effect")
+    return table.reshape(256)
+
+
+def apply_multiple_effects(cv2_image, effects, brightness=0, contrast=1.0, expand=True):
     """
     Apply multiple effects to an image in sequence
-    effects: list of effect names
+    effects: list of effect names (see pipeline.OPERATIONS)
+    The chain is planned first (pipeline.plan_effects): point effects fuse
+    into one lookup table and colour conversions are shared between steps.
+    Single-channel input, and any image after grayscale, stays single-channel
+    until an effect needs colour; expand=False also returns it that way
+    instead of as BGR.
     """
-    result = cv2_image.copy()
-    
-    for effect in effects:
-        if effect == 'grayscale':
-            result = apply_grayscale(result)
-        elif effect == 'negative':
-            result = apply_negative(result)
-        elif effect == 'brightness':
-            result = adjust_brightness_contrast(result, brightness=brightness, contrast=1.0)
-        elif effect == 'contrast':
-            result = adjust_brightness_contrast(result, brightness=0, contrast=contrast)
-        elif effect == 'histogram_eq':
-            result = apply_histogram_equalization(result)
-        elif effect == 'clahe':
-            result = apply_clahe(result)
-    
-    return result
+    from .pipeline import BGR, image_space, plan_effects
+
+    output_space = BGR if expand else None
+    return plan_effects(
+        effects, brightness, contrast, input_space=image_space(cv2_image), output_space=output_space
+    ).run(cv2_image)
 
 
 # Color Analysis Functions
-def get_dominant_colors(cv2_image, k=5):
+# Sample-then-assign k-means: the model is fitted on at most KMEANS_FIT_PIXELS
+# randomly (but reproducibly) sampled pixels with KMEANS_ATTEMPTS restarts,
+# then every pixel is assigned to its nearest centre in one vectorized pass.
+# Quality/speed trade-off: 100k samples keep palettes visually identical to a
+# full fit on typical photos; lower values (10k-50k) are faster but can miss
+# colours covering well under 1% of the image, higher values converge on the
+# full-image result. Each attempt costs one more full k-means run on the
+# sample, and 3 attempts are as stable as 10 once centres use k-means++.
+KMEANS_FIT_PIXELS = 100000
+KMEANS_ATTEMPTS = 3
+KMEANS_SEED = 42
+_KMEANS_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+# Pixels labelled per chunk; bounds the (chunk x k) distance matrix
+_ASSIGN_CHUNK_PIXELS = 1 << 20
+
+
+def assign_to_centers(pixels, centers):
+    """
+    Label each pixel (N x 3) with the index of its nearest centre (k x 3)
+    by squared Euclidean distance, processed in chunks to bound memory.
+    """
+    centers = np.asarray(centers, dtype=np.float32)
+    center_norms = np.einsum('ij,ij->i', centers, centers)
+    labels = np.empty(len(pixels), dtype=np.int32)
+    for start in range(0, len(pixels), _ASSIGN_CHUNK_PIXELS):
+        chunk = np.asarray(pixels[start:start + _ASSIGN_CHUNK_PIXELS], dtype=np.float32)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 does not change the argmin
+        distances = center_norms - 2.0 * (chunk @ centers.T)
+        labels[start:start + len(chunk)] = np.argmin(distances, axis=1)
+    return labels
+
+
+def fit_kmeans_model(cv2_image, k, fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS, seed=KMEANS_SEED,
+                     backend='sample'):
+    """
+    Fit k-means without labelling the image.
+    backend: 'sample' fits on a pixel sample, 'histogram' on the occupied
+             bins of a colour histogram (see histogram_kmeans)
+    Returns: centers (k x 3 float32, BGR) and label_pixels, a function that
+             labels any block of pixels (..., 3) as a flat int32 array, so
+             callers can label the image strip by strip
+    """
+    if backend == 'histogram':
+        centers, _, table = histogram_kmeans_model(cv2_image, k, attempts=attempts, seed=seed)
+        return centers, lambda pixels: table[color_bin_ids(pixels)]
+
+    sample = _sample_pixels_for_model(cv2_image, max_samples=fit_pixels, seed=seed)
+    cv2.setRNGSeed(seed)
+    _, _, centers = cv2.kmeans(sample, k, None, _KMEANS_CRITERIA, attempts, cv2.KMEANS_PP_CENTERS)
+    return centers, lambda pixels: assign_to_centers(pixels.reshape(-1, 3), centers)
+
+
+def fit_kmeans(cv2_image, k, fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS, seed=KMEANS_SEED,
+               backend='sample'):
+    """
+    Fit k-means and label every pixel of the image.
+    Returns: labels (flat int32, one per pixel) and centers (k x 3 float32, BGR)
+    """
+    centers, label_pixels = fit_kmeans_model(cv2_image, k, fit_pixels, attempts, seed, backend)
+    return label_image(cv2_image, label_pixels), centers
+
+
+def label_image(cv2_image, label_pixels):
+    """Labels of every pixel (flat int32), computed strip by strip on large images"""
+    return map_tiled(lambda strip: label_pixels(strip).reshape(strip.shape[:2]), cv2_image).reshape(-1)
+
+
+def count_labels(cv2_image, label_pixels, n_labels):
+    """Pixels per label, accumulated strip by strip without keeping the labels"""
+    counts = np.zeros(n_labels, dtype=np.int64)
+    for rows in iter_strips(*cv2_image.shape[:2]):
+        counts += np.bincount(label_pixels(cv2_image[rows]), minlength=n_labels)
+    return counts
+
+
+# Histogram-weighted clustering: pixels are binned into a 3D colour histogram
+# with 2^HISTOGRAM_BITS levels per channel (5 bits = 32768 bins), and k-means
+# runs over the occupied bins weighted by their pixel counts. The cost scales
+# with the number of distinct binned colours instead of the pixel count; the
+# only per-pixel work is binning and the final bin -> cluster table lookup.
+HISTOGRAM_BITS = 5
+
+
+def color_bin_ids(pixels, bits=HISTOGRAM_BITS):
+    """Histogram bin of every BGR pixel in pixels (..., 3), as a flat int32 array"""
+    shift = 8 - bits
+    pixels = pixels.reshape(-1, 3)
+    bin_ids = (pixels[:, 0] >> shift).astype(np.int32) << (2 * bits)
+    bin_ids |= (pixels[:, 1] >> shift).astype(np.int32) << bits
+    bin_ids |= (pixels[:, 2] >> shift).astype(np.int32)
+    return bin_ids
+
+
+def build_color_histogram(cv2_image, bits=HISTOGRAM_BITS):
+    """
+    Bin BGR pixels into a 3D colour histogram, accumulated strip by strip.
+    Returns: the occupied bin ids, the mean BGR colour (float32) and the
+             pixel count of each occupied bin
+    """
+    n_bins = 1 << (3 * bits)
+    counts = np.zeros(n_bins, dtype=np.int64)
+    sums = np.zeros((3, n_bins), dtype=np.float64)
+    for rows in iter_strips(*cv2_image.shape[:2]):
+        pixels = cv2_image[rows].reshape(-1, 3)
+        bin_ids = color_bin_ids(pixels, bits)
+        counts += np.bincount(bin_ids, minlength=n_bins)
+        for channel in range(3):
+            sums[channel] += np.bincount(bin_ids, weights=pixels[:, channel], minlength=n_bins)
+
+    occupied = np.flatnonzero(counts)
+    colors = (sums[:, occupied] / counts[occupied]).T.astype(np.float32)
+    return occupied, colors, counts[occupied]
+
+
+def _weighted_kmeans_pp(points, weights, k, rng):
+    """k-means++ seeding where each point counts as many times as its weight"""
+    centers = np.empty((k, 3), dtype=np.float32)
+    centers[0] = points[rng.choice(len(points), p=weights / weights.sum())]
+    closest = np.sum((points - centers[0]) ** 2, axis=1)
+    for i in range(1, k):
+        scores = weights * closest
+        total = scores.sum()
+        index = rng.choice(len(points), p=scores / total) if total > 0 else rng.integers(len(points))
+        centers[i] = points[index]
+        closest = np.minimum(closest, np.sum((points - centers[i]) ** 2, axis=1))
+    return centers
+
+
+def weighted_kmeans(points, weights, k, attempts=KMEANS_ATTEMPTS, seed=KMEANS_SEED, max_iter=20, eps=1.0):
+    """
+    Lloyd's k-means where each point (N x 3) carries a weight, e.g. a pixel count.
+    Stops like the cv2.kmeans criteria used above: max_iter iterations or
+    centres moving less than eps. Returns labels (one per point) and centers.
+    """
+    points = np.asarray(points, dtype=np.float32)
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(points) <= k:
+        # Fewer distinct colours than clusters: every colour is its own centre
+        return np.arange(len(points), dtype=np.int32), points.copy()
+
+    rng = np.random.default_rng(seed)
+    best_labels, best_centers, best_inertia = None, None, np.inf
+    for _ in range(attempts):
+        centers = _weighted_kmeans_pp(points, weights, k, rng)
+        for _ in range(max_iter):
+            labels = assign_to_centers(points, centers)
+            cluster_weights = np.bincount(labels, weights=weights, minlength=k)
+            new_centers = centers.copy()
+            filled = cluster_weights > 0
+            for channel in range(3):
+                sums = np.bincount(labels, weights=weights * points[:, channel], minlength=k)
+                new_centers[filled, channel] = sums[filled] / cluster_weights[filled]
+            shift = np.abs(new_centers - centers).max()
+            centers = new_centers
+            if shift < eps:
+                break
+
+        labels = assign_to_centers(points, centers)
+        inertia = float(np.sum(weights * np.sum((points - centers[labels]) ** 2, axis=1)))
+        if inertia < best_inertia:
+            best_labels, best_centers, best_inertia = labels, centers, inertia
+    return best_labels, best_centers
+
+
+def histogram_kmeans_model(cv2_image, k, bits=HISTOGRAM_BITS, attempts=KMEANS_ATTEMPTS, seed=KMEANS_SEED):
+    """
+    Cluster the colours of an image through its colour histogram.
+    Returns: centers (float32 BGR), the pixel count of each cluster and the
+             bin -> cluster table (index it with color_bin_ids)
+    """
+    occupied, colors, counts = build_color_histogram(cv2_image, bits)
+    bin_labels, centers = weighted_kmeans(colors, counts, k, attempts=attempts, seed=seed)
+    cluster_counts = np.bincount(bin_labels, weights=counts, minlength=len(centers)).astype(np.int64)
+
+    table = np.zeros(1 << (3 * bits), dtype=np.int32)
+    table[occupied] = bin_labels
+    return centers, cluster_counts, table
+
+
+def histogram_kmeans(cv2_image, k, bits=HISTOGRAM_BITS, attempts=KMEANS_ATTEMPTS, seed=KMEANS_SEED,
+                     assign_pixels=True):
+    """
+    histogram_kmeans_model plus the label of every pixel.
+    Returns: pixel labels (flat int32, None when assign_pixels is False),
+             centers (float32 BGR) and the pixel count of each cluster
+    """
+    centers, cluster_counts, table = histogram_kmeans_model(cv2_image, k, bits, attempts, seed)
+    labels = None
+    if assign_pixels:
+        # bin -> cluster table, then one lookup per pixel
+        labels = label_image(cv2_image, lambda pixels: table[color_bin_ids(pixels, bits)])
+    return labels, centers, cluster_counts
+
+
+def extract_palette(cv2_image, k=8, backend='histogram', fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS):
+    """
+    Cluster the image colours and return only the palette (no quantized image).
+    Returns: list of {'color_rgb', 'color_hex', 'percentage'} in cluster order
+    """
+    if backend == 'histogram':
+        _, centers, counts = histogram_kmeans(cv2_image, k, attempts=attempts, assign_pixels=False)
+    else:
+        centers, label_pixels = fit_kmeans_model(cv2_image, k, fit_pixels, attempts)
+        counts = count_labels(cv2_image, label_pixels, len(centers))
+
+    centers = np.uint8(centers)
+    total = counts.sum()
+    palette = []
+    for center, count in zip(centers, counts):
+        if count == 0:
+            continue
+        color_rgb = [int(center[2]), int(center[1]), int(center[0])]  # BGR to RGB
+        palette.append({
+            'color_rgb': color_rgb,
+            'color_hex': '#{:02x}{:02x}{:02x}'.format(*color_rgb),
+            'percentage': float(count / total * 100)
+        })
+    return palette
+
+
+def get_dominant_colors(cv2_image, k=5, fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS, backend='sample'):
     """
     Extract dominant colors from image using K-means clustering
+    backend: 'sample' or 'histogram' (see fit_kmeans)
     Returns: list of colors with percentages
     """
-    from sklearn.cluster import KMeans
-    
-    # Reshape image to be a list of pixels
-    data = cv2_image.reshape((-1, 3))
-    data = np.float32(data)
-    
-    # Apply K-means clustering
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-    _, labels, centers = cv2.kmeans(data, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    centers, label_pixels = fit_kmeans_model(cv2_image, k, fit_pixels, attempts, backend=backend)
     
     # Convert centers to uint8
     centers = np.uint8(centers)
     
     # Calculate percentages
-    unique_labels, counts = np.unique(labels, return_counts=True)
-    percentages = (counts / len(labels)) * 100
+    counts = count_labels(cv2_image, label_pixels, len(centers))
+    percentages = (counts / counts.sum()) * 100
     
-    # Sort by percentage (descending)
-    sorted_indices = np.argsort(percentages)[::-1]
+    # Sort by percentage (descending), skipping clusters no pixel was assigned to
+    sorted_indices = [i for i in np.argsort(percentages)[::-1] if counts[i] > 0]
     
     dominant_colors = []
     for i in sorted_indices:
@@ -173,11 +570,52 @@ def get_dominant_colors(cv2_image, k=5):
     return dominant_colors
 
 
-def detect_color_regions(cv2_image, target_color_rgb, tolerance=30):
+def make_proxy(cv2_image, max_pixels):
+    """
+    Downscale an image to at most max_pixels pixels (area interpolation).
+    Returns: proxy image and the scale applied (1.0 when already small enough)
+    """
+    height, width = cv2_image.shape[:2]
+    if not max_pixels or height * width <= max_pixels:
+        return cv2_image, 1.0
+    scale = float(np.sqrt(max_pixels / (height * width)))
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(cv2_image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def restore_from_proxy(image, shape):
+    """Resize a proxy-resolution mask/label image back to shape with nearest-neighbour"""
+    if image.shape[:2] == tuple(shape[:2]):
+        return image
+    return cv2.resize(image, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+
+
+def scale_bounding_boxes(bounding_boxes, scale, shape):
+    """Map bounding boxes found on a proxy (see make_proxy) back to original coordinates"""
+    if scale == 1.0:
+        return bounding_boxes
+    height, width = shape[:2]
+    restored = []
+    for box in bounding_boxes:
+        x = int(box['x'] / scale)
+        y = int(box['y'] / scale)
+        restored.append(dict(
+            box,
+            x=x,
+            y=y,
+            width=min(int(np.ceil((box['x'] + box['width']) / scale)), width) - x,
+            height=min(int(np.ceil((box['y'] + box['height']) / scale)), height) - y,
+            area=int(round(box['area'] / (scale * scale)))
+        ))
+    return restored
+
+
+def detect_color_regions(cv2_image, target_color_rgb, tolerance=30, min_area=100):
     """
     Detect regions similar to target color
     target_color_rgb: [R, G, B] values
     tolerance: color similarity threshold
+    min_area: smallest contour area (in pixels) reported as a region
     Returns: mask and bounding boxes
     """
     # Convert target color to BGR
@@ -194,7 +632,7 @@ def detect_color_regions(cv2_image, target_color_rgb, tolerance=30):
     
     bounding_boxes = []
     for contour in contours:
-        if cv2.contourArea(contour) > 100:  # Filter small regions
+        if cv2.contourArea(contour) > min_area:  # Filter small regions
             x, y, w, h = cv2.boundingRect(contour)
             bounding_boxes.append({
                 'x': int(x),
@@ -207,25 +645,19 @@ def detect_color_regions(cv2_image, target_color_rgb, tolerance=30):
     return mask, bounding_boxes
 
 
-def quantize_colors(cv2_image, k=8):
+def quantize_colors(cv2_image, k=8, fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS, backend='sample'):
     """
     Reduce number of colors using K-means clustering
+    backend: 'sample' or 'histogram' (see fit_kmeans)
     Returns: quantized image and color palette
     """
-    # Reshape image
-    data = cv2_image.reshape((-1, 3))
-    data = np.float32(data)
-    
-    # Apply K-means
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-    _, labels, centers = cv2.kmeans(data, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    centers, label_pixels = fit_kmeans_model(cv2_image, k, fit_pixels, attempts, backend=backend)
     
     # Convert centers to uint8
     centers = np.uint8(centers)
     
     # Create quantized image
-    quantized_data = centers[labels.flatten()]
-    quantized_image = quantized_data.reshape(cv2_image.shape)
+    quantized_image = map_tiled(lambda strip: centers[label_pixels(strip)].reshape(strip.shape), cv2_image)
     
     # Create palette
     palette = []
@@ -262,30 +694,25 @@ def create_color_mask(cv2_image, color_range, color_space='HSV'):
     return mask
 
 
-def segment_image_by_color(cv2_image, n_segments=5, method='kmeans'):
+def segment_labels(cv2_image, n_segments=5, method='kmeans',
+                   fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS, backend='sample'):
     """
-    Segment image into N color regions
+    Segment image into N color regions as a single label map
     method: 'kmeans' or 'watershed'
-    Returns: list of masks for each segment
+    fit_pixels, attempts: k-means sample size and restarts (see KMEANS_FIT_PIXELS)
+    backend: k-means backend, 'sample' or 'histogram' (see fit_kmeans)
+    Returns: labels (uint8, or uint16 past 255 watershed segments; 0 = no
+             segment, 1..n = segments), n and the
+             k-means centres (None for watershed)
     """
     if method == 'kmeans':
-        # Reshape image
-        data = cv2_image.reshape((-1, 3))
-        data = np.float32(data)
-        
-        # Apply K-means
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-        _, labels, centers = cv2.kmeans(data, n_segments, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-        
-        # Create masks for each segment
-        labels = labels.reshape(cv2_image.shape[:2])
-        masks = []
-        
-        for i in range(n_segments):
-            mask = (labels == i).astype(np.uint8) * 255
-            masks.append(mask)
-        
-        return masks, centers
+        centers, label_pixels = fit_kmeans_model(cv2_image, n_segments, fit_pixels, attempts, backend=backend)
+
+        # Label one strip at a time; segment i gets label i + 1
+        def label_strip(strip):
+            return (label_pixels(strip).reshape(strip.shape[:2]) + 1).astype(np.uint8)
+
+        return map_tiled(label_strip, cv2_image), n_segments, centers
     
     elif method == 'watershed':
         # Convert to grayscale for watershed
@@ -317,16 +744,27 @@ def segment_image_by_color(cv2_image, n_segments=5, method='kmeans'):
         # Apply watershed
         markers = cv2.watershed(cv2_image, markers)
         
-        # Create masks for each segment
-        masks = []
+        # Number the segments 1..n, skipping background (1) and borders (-1);
+        # more than 255 segments need a 16-bit label map
         unique_markers = np.unique(markers)
+        segments = unique_markers[unique_markers > 1]
+        dtype = np.uint8 if len(segments) <= 255 else np.uint16
+        table = np.zeros(int(unique_markers.max()) + 2, dtype=dtype)
+        table[segments + 1] = np.arange(1, len(segments) + 1)
         
-        for marker in unique_markers:
-            if marker > 1:  # Skip background (0) and border (-1)
-                mask = (markers == marker).astype(np.uint8) * 255
-                masks.append(mask)
-        
-        return masks, None
+        return table[markers + 1], len(segments), None
+
+
+def segment_image_by_color(cv2_image, n_segments=5, method='kmeans',
+                           fit_pixels=KMEANS_FIT_PIXELS, attempts=KMEANS_ATTEMPTS, backend='sample'):
+    """
+    Segment image into N color regions
+    method: 'kmeans' or 'watershed' (see segment_labels)
+    Returns: list of masks for each segment
+    """
+    labels, n_labels, centers = segment_labels(cv2_image, n_segments, method, fit_pixels, attempts, backend)
+    masks = [cv2.compare(labels, label, cv2.CMP_EQ) for label in range(1, n_labels + 1)]
+    return masks, centers
 
 
 def hex_to_rgb(hex_color):
@@ -352,14 +790,17 @@ def rgb_to_hsv_range(rgb_color, tolerance=10):
 
 
 # ================= ML-based color analysis utilities =================
-def _sample_pixels_for_model(cv2_image, max_samples=50000, colorspace='BGR'):
-    """Randomly sample up to max_samples pixels for model fitting to speed up."""
+def _sample_pixels_for_model(cv2_image, max_samples=50000, colorspace='BGR', seed=None):
+    """
+    Randomly sample up to max_samples pixels for model fitting to speed up.
+    A fixed seed makes the sample, and therefore the fitted model, reproducible.
+    """
     img = cv2_image
-    h, w = img.shape[:2]
     data = img.reshape(-1, 3)
     n = data.shape[0]
     if n > max_samples:
-        idx = np.random.choice(n, size=max_samples, replace=False)
+        # Generator.choice avoids permuting all n indices like np.random.choice does
+        idx = np.random.default_rng(seed).choice(n, size=max_samples, replace=False)
         data = data[idx]
     if colorspace == 'RGB':
         data = data[:, ::-1]
@@ -374,7 +815,7 @@ def gmm_quantize_colors(cv2_image, n_components=8, covariance_type='tied'):
     from sklearn.mixture import GaussianMixture
 
     # Fit GMM on sampled RGB pixels for better color representation
-    samples_rgb = _sample_pixels_for_model(cv2.cvtColor(cv2_image, cv2.COLOR_BGR2RGB), colorspace='RGB')
+    samples_rgb = _sample_pixels_for_model(cv2_image, colorspace='RGB', seed=42)
     gmm = GaussianMixture(n_components=n_components, covariance_type=covariance_type, random_state=42)
     gmm.fit(samples_rgb)
 
@@ -382,12 +823,15 @@ def gmm_quantize_colors(cv2_image, n_components=8, covariance_type='tied'):
     centers_rgb = np.clip(gmm.means_, 0, 255).astype(np.uint8)
     weights = gmm.weights_
 
-    # Assign each pixel to nearest component (predict)
-    h, w = cv2_image.shape[:2]
-    pixels_rgb = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2RGB).reshape(-1, 3)
-    labels = gmm.predict(np.float32(pixels_rgb))
-    quantized_rgb = centers_rgb[labels].reshape(h, w, 3)
-    quantized_bgr = cv2.cvtColor(quantized_rgb, cv2.COLOR_RGB2BGR)
+    # Assign each pixel to nearest component (predict), in strips: predict
+    # allocates several float64 (pixels x components) arrays
+    centers_bgr = centers_rgb[:, ::-1]
+
+    def quantize_strip(strip):
+        labels = gmm.predict(np.float32(strip.reshape(-1, 3)[:, ::-1]))
+        return centers_bgr[labels].reshape(strip.shape)
+
+    quantized_bgr = map_strips(quantize_strip, cv2_image, strip_pixels=_ASSIGN_CHUNK_PIXELS)
 
     # Build palette with weights
     palette = []
@@ -405,51 +849,14 @@ def gmm_quantize_colors(cv2_image, n_components=8, covariance_type='tied'):
     return quantized_bgr, palette
 
 
-# Color name mapping (CSS3 basic color set)
-_CSS3_COLORS = [
-    ("black", [0, 0, 0]), ("white", [255, 255, 255]), ("red", [255, 0, 0]),
-    ("lime", [0, 255, 0]), ("blue", [0, 0, 255]), ("yellow", [255, 255, 0]),
-    ("cyan", [0, 255, 255]), ("magenta", [255, 0, 255]), ("silver", [192, 192, 192]),
-    ("gray", [128, 128, 128]), ("maroon", [128, 0, 0]), ("olive", [128, 128, 0]),
-    ("green", [0, 128, 0]), ("purple", [128, 0, 128]), ("teal", [0, 128, 128]),
-    ("navy", [0, 0, 128]), ("orange", [255, 165, 0]), ("pink", [255, 192, 203]),
-    ("brown", [165, 42, 42]), ("gold", [255, 215, 0])
-]
-
-
-def _rgb_to_lab(rgb):
-    # rgb list to Lab using OpenCV
-    rgb_pixel = np.uint8([[rgb]])  # shape (1,1,3)
-    lab_pixel = cv2.cvtColor(rgb_pixel, cv2.COLOR_RGB2LAB)[0][0]
-    return lab_pixel.astype(np.float32)
-
+def nearest_color_name(rgb, dictionary=DEFAULT_COLOR_DICTIONARY):
+    """Find nearest color name for a given rgb list using Lab distance."""
+    return get_color_index(dictionary).nearest(rgb)
 
-def _delta_e_lab(lab1, lab2):
-    # Simple Euclidean in Lab space
-    return float(np.linalg.norm(lab1 - lab2))
 
-
-def nearest_color_name(rgb):
-    """Find nearest CSS3 color name for a given rgb list using Lab distance."""
-    lab = _rgb_to_lab(rgb)
-    best = (None, 1e9)
-    for name, ref_rgb in _CSS3_COLORS:
-        d = _delta_e_lab(lab, _rgb_to_lab(ref_rgb))
-        if d < best[1]:
-            best = (name, d)
-    return {'name': best[0], 'distance': best[1]}
-
-
-def assign_color_names(palette):
+def assign_color_names(palette, dictionary=DEFAULT_COLOR_DICTIONARY):
     """
     Given a palette list [{'color_rgb': [r,g,b], 'color_hex': '#xxxxxx', ...}],
-    append nearest color names.
-    """
-    enriched = []
-    for item in palette:
-        info = nearest_color_name(item['color_rgb'])
-        new_item = dict(item)
-        new_item['nearest_name'] = info['name']
-        new_item['name_distance'] = info['distance']
-        enriched.append(new_item)
-    return enriched
+    append nearest color names (one vectorized lookup, see color_names).
+    """
+    return get_color_index(dictionary).name_palette(palette)
@@ -1,553 +1,629 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import HttpResponse
-from PIL import Image
-import io
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import BasePermission, IsAuthenticated
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+import hmac
+import mimetypes
 import logging
 
 from .serializers import (
-    ImageUploadSerializer, 
-    ImageProcessingSerializer, 
+    ImageUploadSerializer,
+    ImageProcessingSerializer,
+    BatchEffectsSerializer,
+    EditingSessionSerializer,
     BrightnessContrastSerializer,
     HSVChannelSerializer,
     ColorAnalysisSerializer
 )
+from .cache import make_cache_key, result_cache
+from .analysis import run_color_analysis
+from .batch import aiter_chunks, iter_batch_sources, stream_batch_zip
+from .buffers import buffer_pool
+from .editing import SessionTooLarge, editing_sessions
+from .executor import ExecutorBusy, ExecutorTimeout
+from .jobs import JOB_COMPLETED, job_store, public_job, submit_color_analysis_job
+from .metrics import get_metrics_settings, record_request, registry, request_timer, stage
+from .pipeline import image_space, plan_effects
+from .renderers import ImageJSONRenderer, ImageRenderer, MultipartMixedRenderer
 from .utils import (
-    pil_to_cv2, 
-    cv2_to_pil, 
-    image_to_base64,
+    EncodedImage,
+    decode_image,
+    decode_image_bytes,
+    encode_image,
+    read_image_bytes,
     apply_grayscale,
     apply_negative,
     adjust_brightness_contrast,
     convert_to_hsv_channels,
     apply_histogram_equalization,
-    apply_multiple_effects,
-    get_dominant_colors,
-    detect_color_regions,
-    quantize_colors,
-    create_color_mask,
-    segment_image_by_color,
-    hex_to_rgb,
-    gmm_quantize_colors,
-    assign_color_names
+    apply_multiple_effects
 )
 
 logger = logging.getLogger(__name__)
 
 
-class GrayscaleImageView(APIView):
-    """API để chuyển ảnh sang grayscale (đen trắng)"""
+class ImageProcessingView(APIView):
+    """
+    Base view cho các API xử lý ảnh: validate upload, gọi process() và
+    trả về kết quả. Ảnh được decode trực tiếp bằng OpenCV (decode_image).
+
+    Kết quả được trả về theo header Accept: JSON với data URL (mặc định),
+    image/* (ảnh chính dạng binary) hoặc multipart/mixed (JSON + từng ảnh).
+
+    Kết quả được cache theo hash của ảnh upload + operation + tham số
+    (xem cache.ResultCache); header X-Cache cho biết HIT/MISS.
+
+    Thời gian từng giai đoạn (parse, validate, cache, decode, operation,
+    encode, render) được trả về trong header Server-Timing và ghi vào
+    histogram trên /metrics (xem metrics.py).
+
+    Các buffer ảnh trung gian được mượn từ buffer_pool trong suốt request
+    và trả lại pool sau khi response đã render (xem buffers.py).
+    """
     parser_classes = (MultiPartParser, FormParser)
-    
+    renderer_classes = (ImageJSONRenderer, BrowsableAPIRenderer, MultipartMixedRenderer, ImageRenderer)
+    serializer_class = ImageUploadSerializer
+    operation = None
+    error_context = 'image processing'
+
+    def dispatch(self, request, *args, **kwargs):
+        # Buffers lent by buffer_pool go back once the response is rendered
+        with request_timer() as timer, buffer_pool.scope():
+            self.stage_timer = timer
+            self.metrics_mode = None
+            return super().dispatch(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timer = getattr(self, 'stage_timer', None)
+        if timer is None:
+            return response
+
+        # Render here rather than in the handler so the render stage is measured
+        if hasattr(response, 'render') and not response.is_rendered:
+            with timer.stage('render'):
+                response.render()
+        total = timer.total()
+        response['Server-Timing'] = timer.server_timing(total)
+        record_request(timer, self.operation, self.metrics_mode, response.status_code, total)
+        return response
+
     def post(self, request):
         try:
-            serializer = ImageUploadSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Apply grayscale
-                gray_image = apply_grayscale(cv2_image)
-                
-                # Convert back to PIL
-                result_pil = cv2_to_pil(gray_image)
-                
-                # Convert to base64
-                base64_image = image_to_base64(result_pil)
-                
-                return Response({
-                    'success': True,
-                    'message': 'Image converted to grayscale successfully',
-                    'processed_image': base64_image
-                }, status=status.HTTP_200_OK)
-            
+            with stage('parse'):
+                request_data = request.data
+            serializer = self.serializer_class(data=request_data)
+            with stage('validate'):
+                is_valid = serializer.is_valid()
+            if is_valid:
+                self.metrics_mode = serializer.validated_data.get('mode')
+                result, cache_status = self.get_result(serializer.validated_data)
+                response = self.build_response(result)
+                if cache_status:
+                    response['X-Cache'] = cache_status
+                return response
+
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in grayscale conversion: {str(e)}")
+
+        except ExecutorBusy as e:
+            logger.warning(f"Rejected {self.error_context}: {str(e)}")
             return Response({
                 'success': False,
-                'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
+                'message': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '5'})
 
-class NegativeImageView(APIView):
-    """API để chuyển ảnh sang ảnh âm bản (negative)"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
-        try:
-            serializer = ImageUploadSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Apply negative effect
-                negative_image = apply_negative(cv2_image)
-                
-                # Convert back to PIL
-                result_pil = cv2_to_pil(negative_image)
-                
-                # Convert to base64
-                base64_image = image_to_base64(result_pil)
-                
-                return Response({
-                    'success': True,
-                    'message': 'Image converted to negative successfully',
-                    'processed_image': base64_image
-                }, status=status.HTTP_200_OK)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in negative conversion: {str(e)}")
+        except ExecutorTimeout as e:
+            logger.error(f"Timeout in {self.error_context}: {str(e)}")
             return Response({
                 'success': False,
                 'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
+            }, status=status.HTTP_504_GATEWAY_TIMEOUT)
 
-class BrightnessContrastView(APIView):
-    """API để điều chỉnh độ sáng và độ tương phản"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
-        try:
-            serializer = BrightnessContrastSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                brightness = serializer.validated_data['brightness']
-                contrast = serializer.validated_data['contrast']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Adjust brightness and contrast
-                adjusted_image = adjust_brightness_contrast(cv2_image, brightness, contrast)
-                
-                # Convert back to PIL
-                result_pil = cv2_to_pil(adjusted_image)
-                
-                # Convert to base64
-                base64_image = image_to_base64(result_pil)
-                
-                return Response({
-                    'success': True,
-                    'message': 'Brightness and contrast adjusted successfully',
-                    'processed_image': base64_image,
-                    'settings': {
-                        'brightness': brightness,
-                        'contrast': contrast
-                    }
-                }, status=status.HTTP_200_OK)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
         except Exception as e:
-            logger.error(f"Error in brightness/contrast adjustment: {str(e)}")
+            logger.error(f"Error in {self.error_context}: {str(e)}")
             return Response({
                 'success': False,
                 'message': f'Error processing image: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def get_result(self, data):
+        """Return (payload, cache status), serving repeated requests from the result cache"""
+        if not (result_cache.enabled and self.is_cacheable(data)):
+            with stage('operation'):
+                return self.process(data), None
+
+        with stage('cache'):
+            key = make_cache_key(self.operation, read_image_bytes(data['image']), self.get_cache_params(data))
+            result = result_cache.get(key)
+        if result is not None:
+            return result, 'HIT'
+
+        with stage('operation'):
+            result = self.process(data)
+        with stage('cache'):
+            result_cache.set(key, result)
+        return result, 'MISS'
+
+    def get_cache_params(self, data):
+        """Every validated parameter except the upload itself, plus the output format"""
+        params = {name: value for name, value in data.items() if name != 'image'}
+        params['format'] = self.get_image_format()
+        return params
+
+    def is_cacheable(self, data):
+        return True
+
+    def process(self, data):
+        """Run the operation on validated data and return the response payload"""
+        raise NotImplementedError
+
+    def build_response(self, result):
+        return Response(result, status=status.HTTP_200_OK)
+
+    def get_image_format(self):
+        """Encode as PNG only when the client explicitly asked for image/png"""
+        accepted = getattr(self.request, 'accepted_media_type', None) or ''
+        return 'PNG' if accepted.startswith('image/png') else 'JPEG'
+
+    def encode_result(self, cv2_image):
+        return EncodedImage.from_array(cv2_image, self.get_image_format())
+
+
+class GrayscaleImageView(ImageProcessingView):
+    """API để chuyển ảnh sang grayscale (đen trắng)"""
+    operation = 'grayscale'
+    error_context = 'grayscale conversion'
+
+    def process(self, data):
+        # Grayscale stays single-channel and is encoded as an 8-bit gray file
+        cv2_image = decode_image(data['image'], keep_gray=True)
+        gray_image = apply_grayscale(cv2_image, expand=False)
+
+        return {
+            'success': True,
+            'message': 'Image converted to grayscale successfully',
+            'processed_image': self.encode_result(gray_image)
+        }
+
 
-class HSVChannelView(APIView):
+class NegativeImageView(ImageProcessingView):
+    """API để chuyển ảnh sang ảnh âm bản (negative)"""
+    operation = 'negative'
+    error_context = 'negative conversion'
+
+    def process(self, data):
+        cv2_image = decode_image(data['image'], keep_gray=True)
+        negative_image = apply_negative(cv2_image)
+
+        return {
+            'success': True,
+            'message': 'Image converted to negative successfully',
+            'processed_image': self.encode_result(negative_image)
+        }
+
+
+class BrightnessContrastView(ImageProcessingView):
+    """API để điều chỉnh độ sáng và độ tương phản"""
+    serializer_class = BrightnessContrastSerializer
+    operation = 'brightness_contrast'
+    error_context = 'brightness/contrast adjustment'
+
+    def process(self, data):
+        brightness = data['brightness']
+        contrast = data['contrast']
+
+        cv2_image = decode_image(data['image'], keep_gray=True)
+        adjusted_image = adjust_brightness_contrast(cv2_image, brightness, contrast)
+
+        return {
+            'success': True,
+            'message': 'Brightness and contrast adjusted successfully',
+            'processed_image': self.encode_result(adjusted_image),
+            'settings': {
+                'brightness': brightness,
+                'contrast': contrast
+            }
+        }
+
+
+class HSVChannelView(ImageProcessingView):
     """API để chuyển đổi ảnh sang không gian màu HSV và trả về từng kênh"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
-        try:
-            serializer = HSVChannelSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                channel = serializer.validated_data['channel']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Convert to HSV channels
-                hsv_channels = convert_to_hsv_channels(cv2_image)
-                
-                response_data = {
-                    'success': True,
-                    'message': 'HSV conversion completed successfully'
-                }
-                
-                if channel == 'all':
-                    # Return all channels
-                    for ch_name, ch_image in hsv_channels.items():
-                        result_pil = cv2_to_pil(ch_image)
-                        base64_image = image_to_base64(result_pil)
-                        response_data[f'{ch_name}_channel'] = base64_image
-                else:
-                    # Return specific channel
-                    if channel in hsv_channels:
-                        result_pil = cv2_to_pil(hsv_channels[channel])
-                        base64_image = image_to_base64(result_pil)
-                        response_data['processed_image'] = base64_image
-                        response_data['channel'] = channel
-                
-                return Response(response_data, status=status.HTTP_200_OK)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in HSV conversion: {str(e)}")
-            return Response({
-                'success': False,
-                'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    serializer_class = HSVChannelSerializer
+    operation = 'hsv_channels'
+    error_context = 'HSV conversion'
+
+    def process(self, data):
+        channel = data['channel']
 
+        # Only the requested channels are computed; H/S/V are encoded as
+        # 8-bit grayscale, the hsv composite only on request
+        if channel == 'all':
+            names = ['H', 'S', 'V'] + (['hsv'] if data['include_composite'] else [])
+        else:
+            names = [channel]
 
-class HistogramEqualizationView(APIView):
+        cv2_image = decode_image(data['image'])
+        hsv_channels = convert_to_hsv_channels(cv2_image, names)
+
+        response_data = {
+            'success': True,
+            'message': 'HSV conversion completed successfully'
+        }
+
+        if channel == 'all':
+            # Return all channels
+            for ch_name, ch_image in hsv_channels.items():
+                response_data[f'{ch_name}_channel'] = self.encode_result(ch_image)
+        else:
+            # Return specific channel
+            response_data['processed_image'] = self.encode_result(hsv_channels[channel])
+            response_data['channel'] = channel
+
+        return response_data
+
+
+class HistogramEqualizationView(ImageProcessingView):
     """API để áp dụng cân bằng histogram"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
-        try:
-            serializer = ImageUploadSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Apply histogram equalization
-                equalized_image = apply_histogram_equalization(cv2_image)
-                
-                # Convert back to PIL
-                result_pil = cv2_to_pil(equalized_image)
-                
-                # Convert to base64
-                base64_image = image_to_base64(result_pil)
-                
-                return Response({
-                    'success': True,
-                    'message': 'Histogram equalization applied successfully',
-                    'processed_image': base64_image
-                }, status=status.HTTP_200_OK)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in histogram equalization: {str(e)}")
-            return Response({
-                'success': False,
-                'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    operation = 'histogram_equalization'
+    error_context = 'histogram equalization'
+
+    def process(self, data):
+        cv2_image = decode_image(data['image'], keep_gray=True)
+        equalized_image = apply_histogram_equalization(cv2_image)
+
+        return {
+            'success': True,
+            'message': 'Histogram equalization applied successfully',
+            'processed_image': self.encode_result(equalized_image)
+        }
 
 
-class MultipleEffectsView(APIView):
+class MultipleEffectsView(ImageProcessingView):
     """API để áp dụng nhiều hiệu ứng cùng lúc"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
-        try:
-            serializer = ImageProcessingSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                effects = serializer.validated_data['effects']
-                brightness = serializer.validated_data['brightness']
-                contrast = serializer.validated_data['contrast']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Apply multiple effects
-                processed_image = apply_multiple_effects(
-                    cv2_image, effects, brightness, contrast
-                )
-                
-                # Convert back to PIL
-                result_pil = cv2_to_pil(processed_image)
-                
-                # Convert to base64
-                base64_image = image_to_base64(result_pil)
-                
-                return Response({
-                    'success': True,
-                    'message': 'Multiple effects applied successfully',
-                    'processed_image': base64_image,
-                    'applied_effects': effects,
-                    'settings': {
-                        'brightness': brightness,
-                        'contrast': contrast
-                    }
-                }, status=status.HTTP_200_OK)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in multiple effects processing: {str(e)}")
-            return Response({
-                'success': False,
-                'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    serializer_class = ImageProcessingSerializer
+    operation = 'multiple_effects'
+    error_context = 'multiple effects processing'
+
+    def process(self, data):
+        effects = data['effects']
+        brightness = data['brightness']
+        contrast = data['contrast']
+
+        # Grayscale files (and results of grayscale) stay single-channel
+        cv2_image = decode_image(data['image'], keep_gray=True)
+        plan = plan_effects(effects, brightness, contrast, input_space=image_space(cv2_image), output_space=None)
+        processed_image = plan.run(cv2_image)
 
+        response_data = {
+            'success': True,
+            'message': 'Multiple effects applied successfully',
+            'processed_image': self.encode_result(processed_image),
+            'applied_effects': effects,
+            'settings': {
+                'brightness': brightness,
+                'contrast': contrast
+            }
+        }
+        if data['explain']:
+            response_data['plan'] = plan.explain(cv2_image.shape)
+        return response_data
 
-class ImageDownloadView(APIView):
+
+class ImageDownloadView(ImageProcessingView):
     """API để download ảnh đã xử lý"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
-        try:
-            serializer = ImageProcessingSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                effects = serializer.validated_data['effects']
-                brightness = serializer.validated_data['brightness']
-                contrast = serializer.validated_data['contrast']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                # Apply effects
-                if effects:
-                    processed_image = apply_multiple_effects(
-                        cv2_image, effects, brightness, contrast
-                    )
-                else:
-                    processed_image = cv2_image
-                
-                # Convert back to PIL
-                result_pil = cv2_to_pil(processed_image)
-                
-                # Create response for file download
-                response = HttpResponse(content_type='image/jpeg')
-                response['Content-Disposition'] = 'attachment; filename="processed_image.jpg"'
-                
-                # Save image to response
-                buffer = io.BytesIO()
-                result_pil.save(buffer, format='JPEG')
-                response.write(buffer.getvalue())
-                
-                return response
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in image download: {str(e)}")
-            return Response({
-                'success': False,
-                'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    serializer_class = ImageProcessingSerializer
+    operation = 'download'
+    error_context = 'image download'
 
+    def process(self, data):
+        image_file = data['image']
+        effects = data['effects']
 
-class ColorAnalysisView(APIView):
-    """API để phân tích và phân biệt màu ảnh với nhiều chế độ hoạt động"""
-    parser_classes = (MultiPartParser, FormParser)
-    
-    def post(self, request):
+        if not effects:
+            # Nothing to apply: hand back the uploaded bytes untouched
+            content_type = getattr(image_file, 'content_type', None) or 'image/jpeg'
+            extension = mimetypes.guess_extension(content_type) or '.jpg'
+            return {
+                'content': bytes(read_image_bytes(image_file)),
+                'content_type': content_type,
+                'filename': f'processed_image{extension}'
+            }
+
+        cv2_image = decode_image(image_file, keep_gray=True)
+        processed_image = apply_multiple_effects(
+            cv2_image, effects, data['brightness'], data['contrast'], expand=False
+        )
+
+        return {
+            'content': encode_image(processed_image, 'JPEG'),
+            'content_type': 'image/jpeg',
+            'filename': 'processed_image.jpg'
+        }
+
+    def is_cacheable(self, data):
+        # The no-effect download just echoes the upload, there is nothing to save
+        return bool(data['effects'])
+
+    def build_response(self, result):
+        # Create response for file download
+        response = HttpResponse(result['content'], content_type=result['content_type'])
+        response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
+        return response
+
+
+class BatchEffectsView(ImageProcessingView):
+    """
+    API để áp dụng cùng một chuỗi hiệu ứng cho nhiều ảnh (nhiều file và/hoặc
+    một file ZIP). Ảnh được xử lý song song trên thread pool và kết quả được
+    stream về dạng ZIP ngay khi từng ảnh xong; lỗi của từng ảnh được ghi vào
+    manifest.json thay vì dừng cả batch.
+    """
+    serializer_class = BatchEffectsSerializer
+    operation = 'batch_effects'
+    error_context = 'batch processing'
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Spool every upload to disk so the batch is never held in memory
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def is_cacheable(self, data):
+        return False
+
+    def process(self, data):
+        sources = iter_batch_sources(data['images'], data.get('archive'))
+        return stream_batch_zip(
+            sources, data['effects'], data['brightness'], data['contrast'], data['format']
+        )
+
+    def build_response(self, result):
+        if isinstance(self.request._request, ASGIRequest):
+            # Stream chunk by chunk under ASGI instead of building the whole ZIP first
+            result = aiter_chunks(result)
+        response = StreamingHttpResponse(result, content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="processed_images.zip"'
+        return response
+
+
+class EditingSessionMixin:
+    """Phiên chỉnh sửa thuộc về user đã tạo nó (None với request ẩn danh)"""
+
+    def get_owner_id(self):
+        return self.request.user.id if self.request.user.is_authenticated else None
+
+    def get_session(self, session_id):
+        return editing_sessions.get(session_id, self.get_owner_id())
+
+    def session_not_found(self):
+        return Response({
+            'success': False,
+            'message': 'Editing session not found or expired'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+
+class EditingSessionCreateView(EditingSessionMixin, ImageProcessingView):
+    """
+    API tạo phiên chỉnh sửa: upload ảnh một lần, ảnh đã decode (và một mức
+    preview nhỏ) được giữ trên server. Các lần kéo slider sau đó chỉ gửi
+    tham số tới preview/, ảnh full-size được tạo bằng render/.
+    """
+    operation = 'session_create'
+    error_context = 'editing session creation'
+
+    def is_cacheable(self, data):
+        return False
+
+    def process(self, data):
+        source = read_image_bytes(data['image'])
+        cv2_image = decode_image_bytes(source, keep_gray=True)
         try:
-            serializer = ColorAnalysisSerializer(data=request.data)
-            if serializer.is_valid():
-                image_file = serializer.validated_data['image']
-                mode = serializer.validated_data['mode']
-                
-                # Convert to PIL Image
-                pil_image = Image.open(image_file)
-                
-                # Convert to OpenCV format
-                cv2_image = pil_to_cv2(pil_image)
-                
-                response_data = {
-                    'success': True,
-                    'mode': mode
-                }
-                
-                if mode == 'dominant_colors':
-                    num_colors = serializer.validated_data['num_colors']
-                    dominant_colors = get_dominant_colors(cv2_image, k=num_colors)
-                    
-                    response_data.update({
-                        'message': f'Extracted {len(dominant_colors)} dominant colors successfully',
-                        'dominant_colors': dominant_colors,
-                        'total_colors': len(dominant_colors)
-                    })
-                
-                elif mode == 'color_detection':
-                    target_color_hex = serializer.validated_data['target_color']
-                    tolerance = serializer.validated_data['tolerance']
-                    
-                    # Convert hex to RGB
-                    target_color_rgb = hex_to_rgb(target_color_hex)
-                    
-                    # Detect color regions
-                    mask, bounding_boxes = detect_color_regions(cv2_image, target_color_rgb, tolerance)
-                    
-                    # Convert mask to base64
-                    mask_pil = Image.fromarray(mask)
-                    mask_base64 = image_to_base64(mask_pil)
-                    
-                    response_data.update({
-                        'message': f'Detected {len(bounding_boxes)} regions with target color',
-                        'target_color': target_color_hex,
-                        'target_color_rgb': target_color_rgb,
-                        'tolerance': tolerance,
-                        'mask': mask_base64,
-                        'bounding_boxes': bounding_boxes,
-                        'regions_found': len(bounding_boxes)
-                    })
-                
-                elif mode == 'color_quantization':
-                    quantization_levels = serializer.validated_data['quantization_levels']
-                    
-                    # Quantize colors
-                    quantized_image, palette = quantize_colors(cv2_image, k=quantization_levels)
-                    
-                    # Convert to base64
-                    result_pil = cv2_to_pil(quantized_image)
-                    quantized_base64 = image_to_base64(result_pil)
-                    
-                    response_data.update({
-                        'message': f'Image quantized to {len(palette)} colors successfully',
-                        'quantized_image': quantized_base64,
-                        'color_palette': palette,
-                        'quantization_levels': quantization_levels
-                    })
-                
-                elif mode == 'color_mask':
-                    color_space = serializer.validated_data['color_space']
-                    lower_range = serializer.validated_data['lower_range']
-                    upper_range = serializer.validated_data['upper_range']
-                    
-                    # Create color range
-                    color_range = {
-                        'lower': lower_range,
-                        'upper': upper_range
-                    }
-                    
-                    # Create mask
-                    mask = create_color_mask(cv2_image, color_range, color_space)
-                    
-                    # Convert mask to base64
-                    mask_pil = Image.fromarray(mask)
-                    mask_base64 = image_to_base64(mask_pil)
-                    
-                    # Calculate mask statistics
-                    total_pixels = mask.shape[0] * mask.shape[1]
-                    white_pixels = cv2.countNonZero(mask)
-                    coverage_percentage = (white_pixels / total_pixels) * 100
-                    
-                    response_data.update({
-                        'message': f'Color mask created successfully in {color_space} color space',
-                        'color_space': color_space,
-                        'color_range': color_range,
-                        'mask': mask_base64,
-                        'coverage_percentage': round(coverage_percentage, 2),
-                        'masked_pixels': int(white_pixels),
-                        'total_pixels': int(total_pixels)
-                    })
-                
-                elif mode == 'multi_segment':
-                    num_segments = serializer.validated_data['num_segments']
-                    segmentation_method = serializer.validated_data['segmentation_method']
-                    
-                    # Segment image
-                    masks, centers = segment_image_by_color(cv2_image, num_segments, segmentation_method)
-                    
-                    # Convert masks to base64
-                    segment_masks = []
-                    for i, mask in enumerate(masks):
-                        mask_pil = Image.fromarray(mask)
-                        mask_base64 = image_to_base64(mask_pil)
-                        
-                        # Calculate segment statistics
-                        total_pixels = mask.shape[0] * mask.shape[1]
-                        white_pixels = cv2.countNonZero(mask)
-                        coverage_percentage = (white_pixels / total_pixels) * 100
-                        
-                        segment_info = {
-                            'segment_id': i + 1,
-                            'mask': mask_base64,
-                            'coverage_percentage': round(coverage_percentage, 2),
-                            'pixel_count': int(white_pixels)
-                        }
-                        
-                        # Add center color if available (from k-means)
-                        if centers is not None and i < len(centers):
-                            center_bgr = centers[i]
-                            center_rgb = [int(center_bgr[2]), int(center_bgr[1]), int(center_bgr[0])]
-                            center_hex = '#{:02x}{:02x}{:02x}'.format(center_rgb[0], center_rgb[1], center_rgb[2])
-                            segment_info.update({
-                                'center_color_rgb': center_rgb,
-                                'center_color_hex': center_hex
-                            })
-                        
-                        segment_masks.append(segment_info)
-                    
-                    response_data.update({
-                        'message': f'Image segmented into {len(masks)} regions using {segmentation_method}',
-                        'segmentation_method': segmentation_method,
-                        'num_segments': len(masks),
-                        'segments': segment_masks
-                    })
-
-                elif mode == 'gmm_quantization':
-                    n_components = serializer.validated_data['n_components']
-                    covariance_type = serializer.validated_data['covariance_type']
-                    
-                    # Apply GMM-based quantization
-                    quant_bgr, palette = gmm_quantize_colors(cv2_image, n_components=n_components, covariance_type=covariance_type)
-                    result_pil = cv2_to_pil(quant_bgr)
-                    base64_img = image_to_base64(result_pil)
-                    
-                    response_data.update({
-                        'message': f'GMM quantization to {n_components} components completed',
-                        'quantized_image': base64_img,
-                        'palette': palette,
-                        'n_components': n_components,
-                        'covariance_type': covariance_type
-                    })
-
-                elif mode == 'color_name_palette':
-                    # First, compute dominant colors by k-means (reusing quantize_colors)
-                    palette_size = serializer.validated_data['palette_size']
-                    _, palette = quantize_colors(cv2_image, k=palette_size)
-                    
-                    # Assign nearest color names
-                    enriched = assign_color_names(palette)
-                    
-                    response_data.update({
-                        'message': 'Color names assigned to palette successfully',
-                        'palette': enriched,
-                        'palette_size': palette_size
-                    })
-                
-                return Response(response_data, status=status.HTTP_200_OK)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-        except Exception as e:
-            logger.error(f"Error in color analysis: {str(e)}")
+            session = editing_sessions.create(cv2_image, self.get_owner_id(), source)
+        except SessionTooLarge as e:
+            return {'success': False, 'message': str(e)}
+
+        return {
+            'success': True,
+            'message': 'Editing session created',
+            **session.describe(),
+            'expires_in': editing_sessions.config['TTL'],
+            'preview_url': f"{self.request.path}{session.id}/preview/",
+            'render_url': f"{self.request.path}{session.id}/render/",
+        }
+
+    def build_response(self, result):
+        if not result['success']:
+            return Response(result, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+
+class EditingSessionPreviewView(EditingSessionMixin, ImageProcessingView):
+    """API áp dụng chuỗi hiệu ứng lên ảnh preview của phiên chỉnh sửa (chỉ gửi tham số)"""
+    serializer_class = EditingSessionSerializer
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+    operation = 'session_preview'
+    error_context = 'editing session preview'
+    full_resolution = False
+
+    def post(self, request, session_id):
+        self.session = self.get_session(session_id)
+        if self.session is None:
+            return self.session_not_found()
+        return super().post(request)
+
+    def is_cacheable(self, data):
+        return False
+
+    def process(self, data):
+        effects = data['effects']
+        brightness = data['brightness']
+        contrast = data['contrast']
+
+        image = self.session.image if self.full_resolution else self.session.preview
+        plan = plan_effects(effects, brightness, contrast, input_space=image_space(image), output_space=None)
+        processed_image = plan.run(image)
+
+        response_data = {
+            'success': True,
+            'message': f"Effects {'rendered' if self.full_resolution else 'previewed'} successfully",
+            'session_id': self.session.id,
+            'processed_image': self.encode_result(processed_image),
+            'width': processed_image.shape[1],
+            'height': processed_image.shape[0],
+            'applied_effects': effects,
+            'settings': {
+                'brightness': brightness,
+                'contrast': contrast
+            }
+        }
+        if data['explain']:
+            response_data['plan'] = plan.explain(image.shape)
+        return response_data
+
+
+class EditingSessionRenderView(EditingSessionPreviewView):
+    """API tạo ảnh full-size của phiên chỉnh sửa với tham số cuối cùng"""
+    operation = 'session_render'
+    error_context = 'editing session render'
+    full_resolution = True
+
+
+class EditingSessionDetailView(EditingSessionMixin, APIView):
+    """API xem thông tin hoặc xoá phiên chỉnh sửa"""
+
+    def get(self, request, session_id):
+        session = self.get_session(session_id)
+        if session is None:
+            return self.session_not_found()
+        return Response(session.describe(), status=status.HTTP_200_OK)
+
+    def delete(self, request, session_id):
+        if not editing_sessions.delete(session_id, self.get_owner_id()):
+            return self.session_not_found()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ColorAnalysisView(ImageProcessingView):
+    """
+    API để phân tích và phân biệt màu ảnh với nhiều chế độ hoạt động.
+    Các chế độ nặng (k-means, GMM, watershed) chạy trong process pool
+    (image_executor) để không chặn worker ASGI.
+    """
+    serializer_class = ColorAnalysisSerializer
+    operation = 'color_analysis'
+    error_context = 'color analysis'
+
+    def process(self, data):
+        cv2_image = decode_image(data['image'])
+        return run_color_analysis(cv2_image, data, self.get_image_format())
+
+
+class ColorAnalysisJobView(ImageProcessingView):
+    """
+    API để gửi job phân tích màu chạy nền (cùng tham số với color-analysis).
+    Trả về job_id ngay lập tức; trạng thái được đẩy qua WebSocket
+    ws/image-jobs/ khi job hoàn thành.
+    """
+    serializer_class = ColorAnalysisSerializer
+    permission_classes = (IsAuthenticated,)
+    operation = 'color_analysis_job'
+    error_context = 'color analysis job submission'
+
+    def is_cacheable(self, data):
+        return False
+
+    def process(self, data):
+        params = {name: value for name, value in data.items() if name != 'image'}
+        job = submit_color_analysis_job(self.request.user.id, params, read_image_bytes(data['image']))
+        return public_job(job)
+
+    def build_response(self, result):
+        return Response({
+            'success': True,
+            'message': 'Color analysis job queued',
+            **result,
+            'status_url': f"{self.request.path}{result['job_id']}/",
+            'result_url': f"{self.request.path}{result['job_id']}/result/",
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class ImageJobMixin:
+    permission_classes = (IsAuthenticated,)
+
+    def get_job(self, job_id):
+        job = job_store.get(job_id)
+        if job is None or job['user_id'] != self.request.user.id:
+            return None
+        return job
+
+    def job_not_found(self):
+        return Response({
+            'success': False,
+            'message': 'Job not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+
+class ImageJobDetailView(ImageJobMixin, APIView):
+    """API để xem trạng thái của job xử lý ảnh"""
+
+    def get(self, request, job_id):
+        job = self.get_job(job_id)
+        if job is None:
+            return self.job_not_found()
+        return Response(public_job(job), status=status.HTTP_200_OK)
+
+
+class ImageJobResultView(ImageJobMixin, APIView):
+    """API để lấy kết quả của job đã hoàn thành (hỗ trợ JSON, image/*, multipart/mixed)"""
+    renderer_classes = ImageProcessingView.renderer_classes
+
+    def get(self, request, job_id):
+        job = self.get_job(job_id)
+        if job is None:
+            return self.job_not_found()
+
+        result = job_store.get_result(job_id) if job['status'] == JOB_COMPLETED else None
+        if result is None:
             return Response({
                 'success': False,
-                'message': f'Error processing image: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'message': f"Job is {job['status']}",
+                **public_job(job)
+            }, status=status.HTTP_409_CONFLICT)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class HasMetricsToken(BasePermission):
+    """
+    Số liệu vận hành chỉ dành cho Prometheus/operator: yêu cầu header
+    `Authorization: Bearer <IMAGE_PROCESSING_METRICS['TOKEN']>` (403 nếu sai),
+    endpoint trả về 404 khi chưa cấu hình token.
+    """
+
+    def has_permission(self, request, view):
+        token = get_metrics_settings()['TOKEN']
+        if not token:
+            raise NotFound()
+        return hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+
+
+class CacheStatsView(APIView):
+    """API để xem thống kê hit/miss của cache kết quả xử lý ảnh (cần token metrics)"""
+    authentication_classes = ()
+    permission_classes = (HasMetricsToken,)
+
+    def get(self, request):
+        return Response(result_cache.stats(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """Prometheus metrics (text format): thời gian từng giai đoạn xử lý ảnh và thống kê cache"""
+    authentication_classes = ()
+    permission_classes = (HasMetricsToken,)
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')